@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from asso_tn.sessions import delete_expired_sessions
+
+
+class Command(BaseCommand):
+    help = "Delete expired sessions in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.SESSION_SWEEP_BATCH_SIZE,
+            help="Number of sessions to delete per transaction.",
+        )
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            default=None,
+            help="Stop after this many batches (default: no limit).",
+        )
+
+    def handle(self, *args, **options):
+        deleted = delete_expired_sessions(
+            batch_size=options["batch_size"],
+            max_batches=options["max_batches"],
+        )
+        self.stdout.write(f"Deleted {deleted} expired sessions.")
@@ -0,0 +1,211 @@
+import bisect
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger("django")
+
+# Upper bounds of histogram buckets.  The last bucket is unbounded.
+k_time_buckets_ms = (10, 25, 50, 100, 250, 500, 1000, 2500)
+k_query_buckets = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """Count observations into fixed buckets and keep count, sum, max."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return 0
+        return self.total / self.count
+
+    def as_dict(self):
+        labels = [f"<={bound}" for bound in self.bounds]
+        labels.append(f">{self.bounds[-1]}")
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 2),
+            "max": round(self.max, 2),
+            "buckets": dict(zip(labels, self.buckets)),
+        }
+
+
+class ViewStats:
+    """Aggregated measurements for one URL name."""
+
+    def __init__(self):
+        self.queries = Histogram(k_query_buckets)
+        self.db_ms = Histogram(k_time_buckets_ms)
+        self.render_ms = Histogram(k_time_buckets_ms)
+        self.wall_ms = Histogram(k_time_buckets_ms)
+        self.over_budget = 0
+
+    def as_dict(self):
+        return {
+            "queries": self.queries.as_dict(),
+            "db_ms": self.db_ms.as_dict(),
+            "render_ms": self.render_ms.as_dict(),
+            "wall_ms": self.wall_ms.as_dict(),
+            "over_budget": self.over_budget,
+        }
+
+
+class RequestStats:
+    """In-memory, per-process aggregate of request measurements."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.since = time.time()
+
+    def record(self, view_name, queries, db_ms, render_ms, wall_ms, budget):
+        with self.lock:
+            stats = self.views.setdefault(view_name, ViewStats())
+            stats.queries.add(queries)
+            stats.db_ms.add(db_ms)
+            stats.render_ms.add(render_ms)
+            stats.wall_ms.add(wall_ms)
+            if budget is not None and queries > budget:
+                stats.over_budget += 1
+
+    def snapshot(self) -> dict:
+        """Return the current aggregates as plain data."""
+        with self.lock:
+            return {
+                view_name: stats.as_dict()
+                for view_name, stats in sorted(self.views.items())
+            }
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.since = time.time()
+
+
+request_stats = RequestStats()
+
+
+class QueryTimer:
+    """Database execute wrapper that counts queries and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class InstrumentationMiddleware:
+    """Measure each request and aggregate the results by URL name.
+
+    We record the number of SQL queries, the time spent in the
+    database, the time spent rendering the template (for views that
+    return a TemplateResponse; other views render inside the view and
+    that time is counted in wall time only), and the wall time.  The
+    aggregates are visible to staff on the dashboard and are logged
+    every REQUEST_STATS_LOG_INTERVAL_SECONDS.
+
+    REQUEST_STATS_QUERY_BUDGETS maps URL names to the number of
+    queries we expect a view to need at most.  Exceeding the budget
+    logs a warning, which makes N+1 query patterns visible in
+    production.
+
+    Enabled by REQUEST_STATS_ENABLED.  Place it first in MIDDLEWARE so
+    that the wall time covers the other middleware.
+
+    """
+
+    def __init__(self, get_response):
+        """One-time configuration and initialization."""
+        if not getattr(settings, "REQUEST_STATS_ENABLED", False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.query_budgets = settings.REQUEST_STATS_QUERY_BUDGETS
+        self.default_query_budget = settings.REQUEST_STATS_DEFAULT_QUERY_BUDGET
+        self.log_interval = settings.REQUEST_STATS_LOG_INTERVAL_SECONDS
+        self.last_log = time.monotonic()
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        request._instrumentation_render_ms = 0.0
+        query_timer = QueryTimer()
+        with connection.execute_wrapper(query_timer):
+            response = self.get_response(request)
+        wall_ms = (time.perf_counter() - start) * 1000
+
+        resolver_match = getattr(request, "resolver_match", None)
+        if resolver_match is not None:
+            view_name = resolver_match.view_name
+        else:
+            view_name = "<unresolved>"
+        budget = self.query_budgets.get(view_name, self.default_query_budget)
+        if budget is not None and query_timer.count > budget:
+            logger.warning(
+                f"Query budget exceeded: {view_name} made "
+                f"{query_timer.count} queries (budget {budget}) "
+                f"for {request.path}"
+            )
+        request_stats.record(
+            view_name,
+            queries=query_timer.count,
+            db_ms=query_timer.seconds * 1000,
+            render_ms=request._instrumentation_render_ms,
+            wall_ms=wall_ms,
+            budget=budget,
+        )
+        self.maybe_log()
+        return response
+
+    def process_template_response(self, request, response):
+        """Time the template rendering that happens after the view."""
+        render_start = time.perf_counter()
+
+        def record_render_time(rendered_response):
+            request._instrumentation_render_ms = (
+                time.perf_counter() - render_start
+            ) * 1000
+
+        response.add_post_render_callback(record_render_time)
+        return response
+
+    def maybe_log(self):
+        """Log a summary line per view if the log interval has passed."""
+        now = time.monotonic()
+        if now - self.last_log < self.log_interval:
+            return
+        self.last_log = now
+        for view_name, stats in request_stats.snapshot().items():
+            logger.info(
+                f"request_stats {view_name}: "
+                f"n={stats['wall_ms']['count']} "
+                f"wall_ms(mean={stats['wall_ms']['mean']}, "
+                f"max={stats['wall_ms']['max']}) "
+                f"queries(mean={stats['queries']['mean']}, "
+                f"max={stats['queries']['max']}) "
+                f"db_ms(mean={stats['db_ms']['mean']}) "
+                f"render_ms(mean={stats['render_ms']['mean']}) "
+                f"over_budget={stats['over_budget']}"
+            )
@@ -1,9 +1,40 @@
+from django.conf import settings
 from django.utils.crypto import get_random_string
 
+# The tn_session is a random string that identifies a visitor's browser
+# for a while so that we can stitch together multiple visits (UTM),
+# and recognise anonymous voters (photo), flaggers (mobilito) and
+# donors (stripe_app).
+k_tn_session_cookie_name = "tn_session"
+k_tn_session_cookie_salt = "asso_tn.tn_session"
+k_six_months_in_seconds = 15552000
+
+
+def get_tn_session(request, default=None):
+    """Return the visitor's tn_session identifier.
+
+    Use this rather than reading request.session, since the identifier
+    may not live in the django session (cf. TN_SESSION_SIGNED_COOKIE).
+
+    """
+    tn_session = getattr(request, "tn_session", None)
+    if tn_session is None:
+        tn_session = request.session.get("tn_session")
+    return tn_session or default
+
 
 class SessionCookieMiddleWare:
     """
     Adds the session cookie in each request.
+
+    By default, the tn_session identifier is stored in the django
+    session, which means that every new visitor (bots included) costs
+    a django_session row.  If settings.TN_SESSION_SIGNED_COOKIE is
+    True, the identifier is instead carried in its own signed cookie
+    and anonymous visitors cause no session writes at all.
+
+    In either case, the identifier is available as request.tn_session,
+    preferably read with get_tn_session().
     """
 
     def __init__(self, get_response):
@@ -22,18 +53,51 @@ class SessionCookieMiddleWare:
     def process_request(self, request):
         """
         Adds the session cookie in each request.
+
+        Expired sessions are not cleared here but periodically, cf.
+        asso_tn/sessions.py.
         """
-        request.session.clear_expired()
+        request.tn_session_is_new = False
+        if settings.TN_SESSION_SIGNED_COOKIE:
+            tn_session = request.get_signed_cookie(
+                k_tn_session_cookie_name,
+                default=None,
+                salt=k_tn_session_cookie_salt,
+            )
+            if not tn_session:
+                # Visitors from before we used signed cookies keep
+                # their identifier.  Reading the session doesn't touch
+                # the database if the visitor has no session cookie.
+                tn_session = request.session.get(
+                    "tn_session"
+                ) or get_random_string(20)
+                request.tn_session_is_new = True
+            request.tn_session = tn_session
+            return request
+
         if not request.session.get("tn_session"):
             request.session["tn_session"] = get_random_string(20)
-            k_six_months_in_seconds = 15552000
             request.session.set_expiry(k_six_months_in_seconds)
+        request.tn_session = request.session["tn_session"]
         return request
 
     def process_response(self, request, response):
         """
         Adds the session cookie in each response.
         """
+        if settings.TN_SESSION_SIGNED_COOKIE:
+            if request.tn_session_is_new:
+                response.set_signed_cookie(
+                    k_tn_session_cookie_name,
+                    request.tn_session,
+                    salt=k_tn_session_cookie_salt,
+                    max_age=k_six_months_in_seconds,
+                    secure=settings.SESSION_COOKIE_SECURE,
+                    httponly=True,
+                    samesite="Lax",
+                )
+            return response
+
         if not request.session.get("tn_session"):
             response.set_cookie("tn_session", request.session)
         return response
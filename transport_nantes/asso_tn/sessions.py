@@ -0,0 +1,52 @@
+import logging
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+
+logger = logging.getLogger("django")
+
+
+def delete_expired_sessions(batch_size=1000, max_batches=None) -> int:
+    """Delete expired sessions in batches and return how many we deleted.
+
+    SessionCookieMiddleWare used to call clear_expired() on every
+    request, which on the database backend is a full DELETE of expired
+    rows each time.  We now do that here, periodically, from the
+    clear_expired_sessions management command or the celery task of
+    the same name.
+
+    Deleting in batches of batch_size keeps each transaction (and the
+    locks it holds) short.  If max_batches is not None, stop after
+    that many batches; the next run will pick up where we left off.
+
+    Session backends other than the database one don't have a table to
+    sweep, so we just ask them to clear_expired().
+
+    """
+    if settings.SESSION_ENGINE != "django.contrib.sessions.backends.db":
+        engine = import_module(settings.SESSION_ENGINE)
+        engine.SessionStore.clear_expired()
+        return 0
+
+    total_deleted = 0
+    num_batches = 0
+    now = timezone.now()
+    while max_batches is None or num_batches < max_batches:
+        expired_keys = list(
+            Session.objects.filter(expire_date__lt=now).values_list(
+                "session_key", flat=True
+            )[:batch_size]
+        )
+        if not expired_keys:
+            break
+        deleted, _ = Session.objects.filter(
+            session_key__in=expired_keys
+        ).delete()
+        total_deleted += deleted
+        num_batches += 1
+    logger.info(
+        f"Deleted {total_deleted} expired sessions in {num_batches} batches."
+    )
+    return total_deleted
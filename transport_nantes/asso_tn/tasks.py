@@ -0,0 +1,17 @@
+from celery import shared_task
+from django.conf import settings
+
+from asso_tn.sessions import delete_expired_sessions
+
+
+@shared_task
+def clear_expired_sessions():
+    """Delete expired sessions.
+
+    Scheduled by celery beat, cf. CELERY_BEAT_SCHEDULE in settings.
+
+    """
+    return delete_expired_sessions(
+        batch_size=settings.SESSION_SWEEP_BATCH_SIZE,
+        max_batches=settings.SESSION_SWEEP_MAX_BATCHES,
+    )
@@ -1,9 +1,16 @@
 import datetime
+import io
 
 from django.contrib.auth.models import User
-from django.test import Client, TestCase
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse, reverse_lazy
+from utm.models import UTM
 
+from .sessions import delete_expired_sessions
+from .user_agent import parse_user_agent, user_agent_cache_info
 from .utils import make_timed_token, token_valid
 
 
@@ -34,6 +41,102 @@ class TimedTokenTest(TestCase):
             self.assertEqual(after_response[1], 0)
 
 
+class UserAgentTest(TestCase):
+    k_iphone = (
+        "Mozilla/5.0 (iPhone; CPU iPhone OS 5_1 like Mac OS X) "
+        "AppleWebKit/534.46 (KHTML, like Gecko) Version/5.1 "
+        "Mobile/9B179 Safari/7534.48.3"
+    )
+
+    def test_parse(self):
+        info = parse_user_agent(self.k_iphone)
+        self.assertEqual(info.ua_device, "iPhone")
+        self.assertEqual(info.os_family, "iOS")
+        self.assertEqual(info.os_version, "5.1")
+        self.assertEqual(info.device_brand, "Apple")
+        self.assertTrue(info.is_mobile)
+        self.assertFalse(info.is_bot)
+        self.assertEqual(info.summary, "iPhone / iOS 5.1 / Mobile Safari 5.1")
+
+    def test_missing_user_agent(self):
+        for value in (None, ""):
+            info = parse_user_agent(value)
+            self.assertEqual(info.ua_device, "Other")
+            self.assertFalse(info.is_mobile)
+            self.assertFalse(info.is_pc)
+
+    def test_cache(self):
+        parse_user_agent(self.k_iphone)
+        before = user_agent_cache_info()
+        first = parse_user_agent(self.k_iphone)
+        second = parse_user_agent(self.k_iphone)
+        after = user_agent_cache_info()
+        self.assertIs(first, second)
+        self.assertEqual(after.hits, before.hits + 2)
+        self.assertEqual(after.misses, before.misses)
+
+
+class SessionSweepTest(TestCase):
+    def make_sessions(self, count, expiry_seconds):
+        for _ in range(count):
+            session = SessionStore()
+            session.set_expiry(expiry_seconds)
+            session.create()
+
+    def test_delete_expired_sessions(self):
+        self.make_sessions(5, -60)
+        self.make_sessions(2, 3600)
+        self.assertEqual(delete_expired_sessions(batch_size=2), 5)
+        self.assertEqual(Session.objects.count(), 2)
+
+    def test_max_batches(self):
+        self.make_sessions(5, -60)
+        self.assertEqual(
+            delete_expired_sessions(batch_size=2, max_batches=2), 4
+        )
+        self.assertEqual(Session.objects.count(), 1)
+
+    def test_command(self):
+        self.make_sessions(3, -60)
+        out = io.StringIO()
+        call_command("clear_expired_sessions", "--batch-size=2", stdout=out)
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertIn("Deleted 3 expired sessions.", out.getvalue())
+
+
+class TnSessionCookieTest(TestCase):
+    def test_session_mode(self):
+        """By default, the tn_session lives in the django session."""
+        self.client.get(reverse("index"))
+        tn_session = self.client.session.get("tn_session")
+        self.assertEqual(len(tn_session), 20)
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(UTM.objects.get().session_id, tn_session)
+
+    @override_settings(TN_SESSION_SIGNED_COOKIE=True)
+    def test_signed_cookie_mode(self):
+        """Anonymous visitors get a signed cookie and no session row."""
+        response = self.client.get(reverse("index"))
+        self.assertEqual(Session.objects.count(), 0)
+        cookie = response.cookies["tn_session"]
+        self.assertTrue(cookie["httponly"])
+        self.client.get(reverse("index"))
+        self.assertEqual(Session.objects.count(), 0)
+        session_ids = set(UTM.objects.values_list("session_id", flat=True))
+        self.assertEqual(len(session_ids), 1)
+        tn_session = session_ids.pop()
+        self.assertEqual(len(tn_session), 20)
+        self.assertIn(tn_session, cookie.value)
+
+    @override_settings(TN_SESSION_SIGNED_COOKIE=True)
+    def test_signed_cookie_tampered(self):
+        """A cookie we didn't sign is replaced."""
+        self.client.cookies["tn_session"] = "not-signed-by-us"
+        response = self.client.get(reverse("index"))
+        self.assertNotEqual(UTM.objects.get().session_id, "not-signed-by-us")
+        self.assertIn("tn_session", response.cookies)
+
+
 class TestIndex(TestCase):
     def test_index_page(self):
         """Test the new index page.
@@ -0,0 +1,82 @@
+from functools import lru_cache
+from typing import NamedTuple
+
+import user_agents
+
+# Parsing a user agent string runs a long list of regular expressions,
+# but we see the same few hundred browser strings over and over.  So
+# we remember the result for the most recently seen strings.
+k_user_agent_cache_size = 2048
+
+
+class UserAgentInfo(NamedTuple):
+    """The user agent properties we store, in compact immutable form.
+
+    The ua_* fields match the UTM model, the rest match what stripe_app
+    records in TrackingProgression.
+
+    """
+
+    # Short human readable description, e.g. "iPhone / iOS 5.1 / Safari".
+    summary: str
+    ua_device: str
+    ua_os: str
+    ua_browser: str
+    browser_family: str
+    browser_version: str
+    os_family: str
+    os_version: str
+    device_family: str
+    device_brand: str
+    device_model: str
+    is_tablet: bool
+    is_mobile: bool
+    is_touch_capable: bool
+    is_pc: bool
+    is_bot: bool
+    is_email_client: bool
+
+
+@lru_cache(maxsize=k_user_agent_cache_size)
+def _classify_user_agent(user_agent_string: str) -> UserAgentInfo:
+    """Parse a user agent string.  Prefer parse_user_agent()."""
+    user_agent = user_agents.parse(user_agent_string)
+    return UserAgentInfo(
+        summary=str(user_agent),
+        ua_device=user_agent.get_device(),
+        ua_os=user_agent.get_os(),
+        ua_browser=user_agent.get_browser(),
+        browser_family=user_agent.browser.family,
+        browser_version=user_agent.browser.version_string,
+        os_family=user_agent.os.family,
+        os_version=user_agent.os.version_string,
+        device_family=user_agent.device.family,
+        device_brand=user_agent.device.brand,
+        device_model=user_agent.device.model,
+        is_tablet=user_agent.is_tablet,
+        is_mobile=user_agent.is_mobile,
+        is_touch_capable=user_agent.is_touch_capable,
+        is_pc=user_agent.is_pc,
+        is_bot=user_agent.is_bot,
+        is_email_client=user_agent.is_email_client,
+    )
+
+
+def parse_user_agent(user_agent_string) -> UserAgentInfo:
+    """Return the UserAgentInfo for a user agent string.
+
+    If we receive no user agent (None or empty), the device, os, and
+    browser will be "Other" and the booleans will all be false.
+
+    """
+    return _classify_user_agent(user_agent_string or "")
+
+
+def request_user_agent(request) -> UserAgentInfo:
+    """Return the UserAgentInfo for the request's user agent."""
+    return parse_user_agent(request.META.get("HTTP_USER_AGENT", ""))
+
+
+def user_agent_cache_info():
+    """Return the cache statistics (hits, misses, maxsize, currsize)."""
+    return _classify_user_agent.cache_info()
@@ -0,0 +1,62 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from asso_tn.middleware.instrumentation import Histogram, request_stats
+
+
+class HistogramTest(TestCase):
+    def test_buckets(self):
+        histogram = Histogram((1, 10))
+        for value in (0, 1, 5, 10, 11, 100):
+            histogram.add(value)
+        self.assertEqual(histogram.buckets, [2, 2, 2])
+        self.assertEqual(histogram.count, 6)
+        self.assertEqual(histogram.max, 100)
+        self.assertEqual(histogram.as_dict()["buckets"][">10"], 2)
+
+
+class RequestStatsTest(TestCase):
+    def setUp(self):
+        request_stats.reset()
+        self.staff = User.objects.create_user(
+            username="staff", password="pw", is_staff=True
+        )
+
+    def test_index_is_recorded(self):
+        self.client.get(reverse("index"))
+        self.client.get(reverse("index"))
+        stats = request_stats.snapshot()["index"]
+        self.assertEqual(stats["wall_ms"]["count"], 2)
+        self.assertGreater(stats["queries"]["max"], 0)
+        self.assertGreater(stats["render_ms"]["max"], 0)
+
+    @override_settings(REQUEST_STATS_QUERY_BUDGETS={"index": 0})
+    def test_query_budget(self):
+        with self.assertLogs("django", level="WARNING") as logs:
+            self.client.get(reverse("index"))
+        self.assertTrue(
+            any("Query budget exceeded: index" in line for line in logs.output)
+        )
+        self.assertEqual(request_stats.snapshot()["index"]["over_budget"], 1)
+
+    def test_stats_page_requires_staff(self):
+        url = reverse("dashboard:request_stats")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        User.objects.create_user(username="joe", password="pw")
+        self.client.login(username="joe", password="pw")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_stats_page(self):
+        self.client.get(reverse("index"))
+        self.client.login(username="staff", password="pw")
+        url = reverse("dashboard:request_stats")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "index")
+        response = self.client.get(url + "?format=json")
+        self.assertEqual(
+            response.json()["views"]["index"]["wall_ms"]["count"], 1
+        )
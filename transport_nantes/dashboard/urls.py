@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import DashboardIndex, SignatureView
+from .views import DashboardIndex, RequestStatsView, SignatureView
 
 app_name = "dashboard"
 urlpatterns = [
     path("", DashboardIndex.as_view(), name="index"),
     path("signature/", SignatureView.as_view(), name="signature"),
+    path("stats/", RequestStatsView.as_view(), name="request_stats"),
 ]
@@ -1,6 +1,10 @@
+from datetime import datetime, timezone
+
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import JsonResponse
 from django.views.generic.base import TemplateView
 from django.views.generic.edit import FormView
+from asso_tn.middleware.instrumentation import request_stats
 from asso_tn.utils import StaffRequiredMixin
 from django.urls import reverse_lazy
 
@@ -29,3 +33,33 @@ class SignatureView(LoginRequiredMixin, FormView):
 
     template_name = "dashboard/signature.html"
     form_class = SignatureForm
+
+
+class RequestStatsView(StaffRequiredMixin, TemplateView):
+    """Show per-view request measurements for this process.
+
+    Cf. asso_tn.middleware.instrumentation.  Add ?format=json for the
+    full histograms.
+
+    """
+
+    template_name = "dashboard/request_stats.html"
+    login_url = reverse_lazy("authentication:login")
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["since"] = datetime.fromtimestamp(
+            request_stats.since, timezone.utc
+        )
+        context["view_stats"] = request_stats.snapshot()
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.request.GET.get("format") == "json":
+            return JsonResponse(
+                {
+                    "since": context["since"].isoformat(),
+                    "views": context["view_stats"],
+                }
+            )
+        return super().render_to_response(context, **response_kwargs)
@@ -1,5 +1,11 @@
 from django.contrib import admin
-from .models import MailingList, MailingListEvent, Petition
+from .models import (
+    MailingList,
+    MailingListCounts,
+    MailingListEvent,
+    MailingListSubscription,
+    Petition,
+)
 from .forms import MailingListAdminForm
 
 
@@ -10,3 +16,5 @@ class MailingListAdmin(admin.ModelAdmin):
 admin.site.register(MailingList, MailingListAdmin)
 admin.site.register(MailingListEvent)
 admin.site.register(Petition)
+admin.site.register(MailingListSubscription)
+admin.site.register(MailingListCounts)
@@ -1,17 +1,33 @@
-from django.contrib.auth.models import User
-from django.db.models import Max, Q, OuterRef, Subquery
-from .models import MailingList, MailingListEvent
+from django.db import transaction
+from django.db.models import (
+    Exists,
+    F,
+    FilteredRelation,
+    OuterRef,
+    Q,
+    Value,
+)
+from django.db.models.functions import Coalesce
+from .models import (
+    MailingList,
+    MailingListCounts,
+    MailingListEvent,
+    MailingListSubscription,
+)
 
 
 def subscribe_user_to_list(user, mailing_list) -> MailingListEvent:
     """Subscribe user to a mailing list or sign a petition"""
 
-    subscribe = MailingListEvent.objects.create(
-        user=user,
-        mailing_list=mailing_list,
-        event_type=MailingListEvent.EventType.SUBSCRIBE,
-    )
-    subscribe.save()
+    # The event and the subscription state change together, cf.
+    # MailingListSubscription.
+    with transaction.atomic():
+        subscribe = MailingListEvent.objects.create(
+            user=user,
+            mailing_list=mailing_list,
+            event_type=MailingListEvent.EventType.SUBSCRIBE,
+        )
+    return subscribe
 
 
 def unsubscribe_user_from_list(user, mailing_list) -> MailingListEvent:
@@ -20,35 +36,48 @@ def unsubscribe_user_from_list(user, mailing_list) -> MailingListEvent:
     the user if he sign again it will only count
     as one)"""
 
-    unsubscribe = MailingListEvent.objects.create(
-        user=user,
-        mailing_list=mailing_list,
-        event_type=MailingListEvent.EventType.UNSUBSCRIBE,
-    )
-    unsubscribe.save()
+    with transaction.atomic():
+        unsubscribe = MailingListEvent.objects.create(
+            user=user,
+            mailing_list=mailing_list,
+            event_type=MailingListEvent.EventType.UNSUBSCRIBE,
+        )
+    return unsubscribe
+
+
+def bounce_user_from_list(user, mailing_list) -> MailingListEvent:
+    """Record that mail to user from this mailing list bounced."""
+    with transaction.atomic():
+        bounce = MailingListEvent.objects.create(
+            user=user,
+            mailing_list=mailing_list,
+            event_type=MailingListEvent.EventType.BOUNCE,
+        )
+    return bounce
 
 
 def user_current_state(user, mailing_list):
     """Return user's most current state on the provided mailing list
 
-    Return the most recent event associated with this user in this
-    mailing list.
+    Return the most recent subscribe or unsubscribe event associated
+    with this user in this mailing list, or an unsaved unsubscribe
+    event if there is none.
 
     """
-    try:
-        the_user = MailingListEvent.objects.filter(
-            Q(event_type=MailingListEvent.EventType.SUBSCRIBE)
-            | Q(event_type=MailingListEvent.EventType.UNSUBSCRIBE),
-            user=user,
-            mailing_list=mailing_list,
-        ).latest("event_timestamp")
-        return the_user
-    except MailingListEvent.DoesNotExist:
-        return MailingListEvent(
-            user=user,
-            mailing_list=mailing_list,
-            event_type=MailingListEvent.EventType.UNSUBSCRIBE,
+    subscription = (
+        MailingListSubscription.objects.filter(
+            user=user, mailing_list=mailing_list
         )
+        .select_related("event")
+        .first()
+    )
+    if subscription is not None and subscription.event is not None:
+        return subscription.event
+    return MailingListEvent(
+        user=user,
+        mailing_list=mailing_list,
+        event_type=MailingListEvent.EventType.UNSUBSCRIBE,
+    )
 
 
 def user_subscribe_count(mailing_list):
@@ -56,22 +85,11 @@ def user_subscribe_count(mailing_list):
 
     We want to know how many users are currently subscribed.  Note
     that individual users might subscribe and unsubscribe multiple
-    times.  Other (future) events could happen as well.
+    times.  Other (future) events could happen as well.  The count is
+    maintained as events happen, cf. MailingListCounts.
     """
-    users_subscribed = (
-        User.objects.annotate(
-            latest_action=Subquery(
-                MailingListEvent.objects.filter(
-                    mailing_list=mailing_list, user=OuterRef("pk")
-                )
-                .order_by("-event_timestamp")
-                .values("event_type")[:1]
-            )
-        )
-        .filter(latest_action="sub")
-        .count()
-    )
-    return users_subscribed
+    num_subscribed, _ = MailingListCounts.get_counts(mailing_list.pk)
+    return num_subscribed
 
 
 def subscriber_count(mailing_list):
@@ -83,34 +101,84 @@ def subscriber_count(mailing_list):
     petition.
 
     """
-    user_states = (
-        MailingListEvent.objects.filter(
-            Q(event_type=MailingListEvent.EventType.SUBSCRIBE),
-            mailing_list=mailing_list,
-        )
-        .values("user")
-        .annotate(latest=Max("event_timestamp"))
+    _, num_signed = MailingListCounts.get_counts(mailing_list.pk)
+    return num_signed
+
+
+def with_counts(mailing_lists):
+    """Annotate a MailingList queryset with its counts.
+
+    Each list gets num_subscribed (cf. user_subscribe_count()) and
+    num_signed (cf. subscriber_count()), read from MailingListCounts
+    in the same query as the lists.
+
+    """
+    return mailing_lists.annotate(
+        num_subscribed=Coalesce(F("counts__num_subscribed"), Value(0)),
+        num_signed=Coalesce(F("counts__num_signed"), Value(0)),
+    )
+
+
+def with_user_state(mailing_lists, user):
+    """Annotate a MailingList queryset with user's state on each list.
+
+    Each list gets user_state, the event_type that user_current_state()
+    would return, in the same query as the lists.
+
+    """
+    return mailing_lists.annotate(
+        user_subscription=FilteredRelation(
+            "mailinglistsubscription",
+            condition=Q(mailinglistsubscription__user=user),
+        ),
+        user_state=Coalesce(
+            F("user_subscription__state"),
+            Value(MailingListEvent.EventType.UNSUBSCRIBE.value),
+        ),
     )
-    users_subscribed = user_states.filter(
-        Q(event_type=MailingListEvent.EventType.SUBSCRIBE)
-    ).count()
-    return users_subscribed
 
 
 def get_subcribed_users_email_list(mailing_list: MailingList) -> list:
     """Return a list of email addresses of users subscribed to this list."""
-    # Returns a set of user PK that subscribed to this list at least once.
-    set_of_once_subscribed_users = set(
-        MailingListEvent.objects.filter(
-            mailing_list__mailing_list_token=mailing_list.mailing_list_token
-        ).values_list("user", flat=True)
+    return list(
+        MailingListSubscription.objects.filter(
+            mailing_list=mailing_list,
+            state=MailingListEvent.EventType.SUBSCRIBE,
+        )
+        .order_by("user_id")
+        .values_list("user__email", flat=True)
+    )
+
+
+def get_subcribed_users_email_list_from_events(
+    mailing_list: MailingList,
+) -> list:
+    """Return the same as get_subcribed_users_email_list() from the events.
+
+    A user is subscribed if their most recent subscribe or unsubscribe
+    event on the list is a subscribe.  One query: we keep the
+    subscribe events that no later subscribe or unsubscribe event by
+    the same user on the same list supersedes.  Events with the same
+    timestamp are ordered by id.
+
+    """
+    state_events = MailingListEvent.objects.filter(
+        mailing_list=mailing_list,
+        event_type__in=[
+            MailingListEvent.EventType.SUBSCRIBE,
+            MailingListEvent.EventType.UNSUBSCRIBE,
+        ],
+    )
+    later_events = state_events.filter(user=OuterRef("user")).filter(
+        Q(event_timestamp__gt=OuterRef("event_timestamp"))
+        | Q(
+            event_timestamp=OuterRef("event_timestamp"),
+            pk__gt=OuterRef("pk"),
+        )
+    )
+    return list(
+        state_events.filter(event_type=MailingListEvent.EventType.SUBSCRIBE)
+        .filter(~Exists(later_events))
+        .order_by("user_id")
+        .values_list("user__email", flat=True)
     )
-    # Get the list of subscribed users.
-    subscribed_users = []
-    for user_id in set_of_once_subscribed_users:
-        user = User.objects.get(pk=user_id)
-        latest_event = user_current_state(user, mailing_list)
-        if latest_event.event_type == "sub":
-            subscribed_users.append(user.email)
-
-    return subscribed_users
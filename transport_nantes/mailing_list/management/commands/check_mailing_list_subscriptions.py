@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mailing_list.models import MailingListSubscription
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that the MailingListSubscription table agrees with the "
+        "mailing list events."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Recompute the rows that disagree.",
+        )
+
+    def handle(self, *args, **options):
+        inconsistencies = MailingListSubscription.inconsistencies()
+        for (user_id, mailing_list_id), expected, actual in inconsistencies:
+            self.stdout.write(
+                f"user {user_id}, mailing list {mailing_list_id}: "
+                f"expected {expected}, found {actual}"
+            )
+            if options["fix"]:
+                MailingListSubscription.recompute(user_id, mailing_list_id)
+        if not inconsistencies:
+            self.stdout.write("MailingListSubscription is consistent.")
+        elif options["fix"]:
+            self.stdout.write(f"Fixed {len(inconsistencies)} rows.")
+        else:
+            raise CommandError(f"{len(inconsistencies)} rows are wrong.")
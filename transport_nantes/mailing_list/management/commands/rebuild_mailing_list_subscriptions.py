@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from mailing_list.models import MailingListSubscription
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the current state of each user on each mailing list "
+        "(the MailingListSubscription table) from the events."
+    )
+
+    def handle(self, *args, **options):
+        num_subscriptions = MailingListSubscription.rebuild()
+        self.stdout.write(
+            f"Recomputed {num_subscriptions} (user, mailing list) states."
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from mailing_list.models import MailingListCounts
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the subscribers and signers of every mailing list and "
+        "correct the stored counts."
+    )
+
+    def handle(self, *args, **options):
+        corrected = MailingListCounts.reconcile()
+        self.stdout.write(f"Corrected the counts of {corrected} lists.")
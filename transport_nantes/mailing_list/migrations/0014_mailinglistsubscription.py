@@ -0,0 +1,126 @@
+# Generated by Django 4.1.10 on 2026-10-18 17:06
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_subscriptions(apps, schema_editor):
+    """Compute the current state of each user on each list."""
+    event_model = apps.get_model("mailing_list", "MailingListEvent")
+    subscription_model = apps.get_model(
+        "mailing_list", "MailingListSubscription"
+    )
+    subscriptions = {}
+    events = (
+        event_model.objects.order_by("event_timestamp", "pk")
+        .values_list(
+            "user_id", "mailing_list_id", "pk", "event_type", "event_timestamp"
+        )
+        .iterator()
+    )
+    for user_id, mailing_list_id, pk, event_type, timestamp in events:
+        key = (user_id, mailing_list_id)
+        if key not in subscriptions:
+            subscriptions[key] = subscription_model(
+                user_id=user_id, mailing_list_id=mailing_list_id
+            )
+        subscription = subscriptions[key]
+        # Events are in order, so each one is the latest so far.
+        if event_type == "bounce":
+            subscription.last_bounce_time = timestamp
+            continue
+        if event_type == "sub" and subscription.first_subscribe_time is None:
+            subscription.first_subscribe_time = timestamp
+        subscription.state = event_type
+        subscription.event_id = pk
+        subscription.since = timestamp
+    subscription_model.objects.bulk_create(
+        subscriptions.values(), batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("mailing_list", "0013_alter_mailinglist_linked_article"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailingListSubscription",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[
+                            ("sub", "inscription"),
+                            ("unsub", "désinscription"),
+                            ("bounce", "bounce"),
+                        ],
+                        default="unsub",
+                        max_length=6,
+                    ),
+                ),
+                ("since", models.DateTimeField(blank=True, null=True)),
+                (
+                    "first_subscribe_time",
+                    models.DateTimeField(blank=True, null=True),
+                ),
+                (
+                    "last_bounce_time",
+                    models.DateTimeField(blank=True, null=True),
+                ),
+                (
+                    "event",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="mailing_list.mailinglistevent",
+                    ),
+                ),
+                (
+                    "mailing_list",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="mailing_list.mailinglist",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="mailinglistsubscription",
+            index=models.Index(
+                fields=["mailing_list", "state"],
+                name="mailing_list_sub_state_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="mailinglistsubscription",
+            constraint=models.UniqueConstraint(
+                fields=("user", "mailing_list"),
+                name="unique_mailing_list_subscription",
+            ),
+        ),
+        migrations.RunPython(
+            fill_subscriptions, reverse_code=migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.1.10 on 2026-10-18 17:11
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def fill_counts(apps, schema_editor):
+    """Count the subscribers and signers of each list."""
+    mailing_list_model = apps.get_model("mailing_list", "MailingList")
+    subscription_model = apps.get_model(
+        "mailing_list", "MailingListSubscription"
+    )
+    counts_model = apps.get_model("mailing_list", "MailingListCounts")
+    counts = {
+        row[0]: row[1:]
+        for row in subscription_model.objects.order_by()
+        .values("mailing_list_id")
+        .annotate(
+            num_subscribed=Count("pk", filter=Q(state="sub")),
+            num_signed=Count(
+                "pk", filter=Q(first_subscribe_time__isnull=False)
+            ),
+        )
+        .values_list("mailing_list_id", "num_subscribed", "num_signed")
+    }
+    now = django.utils.timezone.now()
+    counts_model.objects.bulk_create(
+        [
+            counts_model(
+                mailing_list_id=mailing_list_id,
+                num_subscribed=counts.get(mailing_list_id, (0, 0))[0],
+                num_signed=counts.get(mailing_list_id, (0, 0))[1],
+                reconcile_time=now,
+            )
+            for mailing_list_id in mailing_list_model.objects.values_list(
+                "pk", flat=True
+            )
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("mailing_list", "0014_mailinglistsubscription"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailingListCounts",
+            fields=[
+                (
+                    "mailing_list",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="counts",
+                        serialize=False,
+                        to="mailing_list.mailinglist",
+                    ),
+                ),
+                ("num_subscribed", models.IntegerField(default=0)),
+                ("num_signed", models.IntegerField(default=0)),
+                (
+                    "reconcile_time",
+                    models.DateTimeField(blank=True, null=True),
+                ),
+            ],
+        ),
+        migrations.RunPython(fill_counts, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,16 @@
-from django.db import models
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Count, F, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 import django.utils.timezone
 
+logger = logging.getLogger("django")
+
 
 # This application might have been called newsletter.  Think of this
 # as about newsletters, not about the lists, in the sense that this is
@@ -170,3 +179,434 @@ class MailingListEvent(models.Model):
 
 # We'll need to make sure we have an automatic unsubscribe pathway
 # with link in mails.
+
+
+class MailingListSubscription(models.Model):
+    """The current state of a user on a mailing list.
+
+    MailingListEvent is the record of what happened.  Deciding whether
+    a user is subscribed from it means finding the user's latest
+    subscribe or unsubscribe event, so we keep the answer here, one
+    row per (user, mailing list) that has events.  Bounces don't change
+    the state, but we note the time of the latest one.
+
+    The row is updated whenever an event is saved or deleted (cf.
+    update_subscription below), in the same transaction.  Events
+    written without save(), e.g., with bulk_create(), need a call to
+    apply_event() or rebuild().  The rebuild_mailing_list_subscriptions
+    management command recomputes the table from the events and
+    check_mailing_list_subscriptions compares the two.
+
+    """
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "mailing_list"],
+                name="unique_mailing_list_subscription",
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["mailing_list", "state"],
+                name="mailing_list_sub_state_idx",
+            )
+        ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    mailing_list = models.ForeignKey(MailingList, on_delete=models.CASCADE)
+    # SUBSCRIBE or UNSUBSCRIBE: the type of the latest such event, or
+    # UNSUBSCRIBE if there is none.
+    state = models.CharField(
+        max_length=6,
+        choices=MailingListEvent.EventType.choices,
+        default=MailingListEvent.EventType.UNSUBSCRIBE,
+    )
+    # The latest subscribe or unsubscribe event and its timestamp.
+    event = models.ForeignKey(
+        MailingListEvent,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+    )
+    since = models.DateTimeField(null=True, blank=True)
+    # The first subscribe event: for petitions, when the user signed.
+    first_subscribe_time = models.DateTimeField(null=True, blank=True)
+    last_bounce_time = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return (
+            f"U={self.user_id}, L={self.mailing_list_id}, "
+            f"S={self.state}, {self.since}"
+        )
+
+    @property
+    def is_subscribed(self) -> bool:
+        return self.state == MailingListEvent.EventType.SUBSCRIBE
+
+    def counted(self) -> tuple:
+        """Return what this row adds to (num_subscribed, num_signed)."""
+        return (
+            int(self.is_subscribed),
+            int(self.first_subscribe_time is not None),
+        )
+
+    def fold(self, event_id, event_type, event_timestamp):
+        """Update this row as if event came after the events seen so far.
+
+        Events may arrive out of order: the state follows the event
+        with the latest (timestamp, id).
+
+        """
+        if event_type == MailingListEvent.EventType.BOUNCE:
+            if (
+                self.last_bounce_time is None
+                or event_timestamp > self.last_bounce_time
+            ):
+                self.last_bounce_time = event_timestamp
+            return
+        if event_type == MailingListEvent.EventType.SUBSCRIBE and (
+            self.first_subscribe_time is None
+            or event_timestamp < self.first_subscribe_time
+        ):
+            self.first_subscribe_time = event_timestamp
+        if (
+            self.since is None
+            or event_timestamp > self.since
+            or (
+                event_timestamp == self.since
+                and event_id > (self.event_id or 0)
+            )
+        ):
+            self.state = event_type
+            self.since = event_timestamp
+            self.event_id = event_id
+
+    @classmethod
+    def apply_event(cls, event):
+        """Update the row of event's user and mailing list."""
+        with transaction.atomic():
+            subscription, _ = cls.objects.select_for_update().get_or_create(
+                user_id=event.user_id, mailing_list_id=event.mailing_list_id
+            )
+            before = subscription.counted()
+            subscription.fold(
+                event.pk, event.event_type, event.event_timestamp
+            )
+            subscription.save()
+            MailingListCounts.add_difference(
+                event.mailing_list_id, before, subscription.counted()
+            )
+
+    @classmethod
+    def recompute(cls, user_id, mailing_list_id):
+        """Recompute the row of user and mailing list from the events."""
+        events = (
+            MailingListEvent.objects.filter(
+                user_id=user_id, mailing_list_id=mailing_list_id
+            )
+            .order_by("event_timestamp", "pk")
+            .values_list("pk", "event_type", "event_timestamp")
+        )
+        subscription = cls(user_id=user_id, mailing_list_id=mailing_list_id)
+        for event in events:
+            subscription.fold(*event)
+        with transaction.atomic():
+            previous = (
+                cls.objects.select_for_update()
+                .filter(user_id=user_id, mailing_list_id=mailing_list_id)
+                .first()
+            )
+            before = previous.counted() if previous else (0, 0)
+            cls.objects.filter(
+                user_id=user_id, mailing_list_id=mailing_list_id
+            ).delete()
+            if subscription.event_id or subscription.last_bounce_time:
+                subscription.save()
+            MailingListCounts.add_difference(
+                mailing_list_id, before, subscription.counted()
+            )
+
+    @classmethod
+    def from_events(cls) -> dict:
+        """Compute the rows from the events.
+
+        Return a dict mapping (user_id, mailing_list_id) to an unsaved
+        MailingListSubscription.  One pass over the events.
+
+        """
+        subscriptions = {}
+        events = (
+            MailingListEvent.objects.order_by("event_timestamp", "pk")
+            .values_list(
+                "user_id",
+                "mailing_list_id",
+                "pk",
+                "event_type",
+                "event_timestamp",
+            )
+            .iterator()
+        )
+        for user_id, mailing_list_id, *event in events:
+            key = (user_id, mailing_list_id)
+            if key not in subscriptions:
+                subscriptions[key] = cls(
+                    user_id=user_id, mailing_list_id=mailing_list_id
+                )
+            subscriptions[key].fold(*event)
+        return subscriptions
+
+    @classmethod
+    def rebuild(cls) -> int:
+        """Recompute the table from the events.  Return the row count."""
+        subscriptions = list(cls.from_events().values())
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(subscriptions, batch_size=1000)
+            MailingListCounts.reconcile()
+        return len(subscriptions)
+
+    @classmethod
+    def inconsistencies(cls) -> list:
+        """Return the rows that differ from what the events say.
+
+        The result is a list of (key, expected, actual) where key is
+        (user_id, mailing_list_id) and expected and actual are tuples
+        of the fields we compare, or None if there's no row.
+
+        """
+        fields = (
+            "state",
+            "event_id",
+            "since",
+            "first_subscribe_time",
+            "last_bounce_time",
+        )
+        expected = {
+            key: tuple(getattr(subscription, field) for field in fields)
+            for key, subscription in cls.from_events().items()
+        }
+        actual = {
+            (row[0], row[1]): tuple(row[2:])
+            for row in cls.objects.values_list(
+                "user_id", "mailing_list_id", *fields
+            ).iterator()
+        }
+        return [
+            (key, expected.get(key), actual.get(key))
+            for key in sorted(expected.keys() | actual.keys())
+            if expected.get(key) != actual.get(key)
+        ]
+
+
+class MailingListCounts(models.Model):
+    """Running counts of a mailing list's subscribers and signers.
+
+    num_subscribed is the number of users currently subscribed (what
+    user_subscribe_count() returns), num_signed the number of users who
+    ever subscribed, which for a petition is the number of signatures
+    (what subscriber_count() returns).
+
+    MailingListSubscription adjusts the counts each time it changes a
+    row, in the same transaction, so reading them costs a primary key
+    lookup rather than a count over the list's subscriptions, and we
+    keep them in the cache as well (cf. get_counts()).  reconcile()
+    recounts from MailingListSubscription and corrects any drift; celery
+    beat runs it periodically, cf. CELERY_BEAT_SCHEDULE in settings.
+
+    """
+
+    mailing_list = models.OneToOneField(
+        MailingList,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="counts",
+    )
+    num_subscribed = models.IntegerField(default=0)
+    num_signed = models.IntegerField(default=0)
+    # When reconcile() last checked these counts.
+    reconcile_time = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return (
+            f"L={self.mailing_list_id}, "
+            f"subscribed={self.num_subscribed}, signed={self.num_signed}"
+        )
+
+    @staticmethod
+    def cache_key(mailing_list_id) -> str:
+        return f"mailing_list_counts:{mailing_list_id}"
+
+    @classmethod
+    def forget(cls, mailing_list_id):
+        """Drop the cached counts of the list, now and on commit.
+
+        Deleting on commit as well keeps a concurrent reader from
+        caching the counts we are about to replace.
+
+        """
+        key = cls.cache_key(mailing_list_id)
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key))
+
+    @classmethod
+    def add_difference(cls, mailing_list_id, before: tuple, after: tuple):
+        """Move the counts of the list from before to after.
+
+        before and after are (num_subscribed, num_signed) contributions
+        of one MailingListSubscription, cf. counted().
+
+        """
+        num_subscribed = after[0] - before[0]
+        num_signed = after[1] - before[1]
+        if not (num_subscribed or num_signed):
+            return
+        updated = cls.objects.filter(pk=mailing_list_id).update(
+            num_subscribed=F("num_subscribed") + num_subscribed,
+            num_signed=F("num_signed") + num_signed,
+        )
+        if not updated:
+            # The list has no counts yet.  Counting now includes the
+            # change we were asked to add.
+            cls.recount([mailing_list_id])
+        cls.forget(mailing_list_id)
+
+    @classmethod
+    def count(cls, mailing_list_ids=None) -> dict:
+        """Count from MailingListSubscription, in one query.
+
+        Return a dict mapping mailing list id to (num_subscribed,
+        num_signed) for the lists in mailing_list_ids (default: all
+        lists), omitting lists without subscriptions.
+
+        """
+        subscriptions = MailingListSubscription.objects.all()
+        if mailing_list_ids is not None:
+            subscriptions = subscriptions.filter(
+                mailing_list_id__in=mailing_list_ids
+            )
+        counts = (
+            subscriptions.order_by()
+            .values("mailing_list_id")
+            .annotate(
+                num_subscribed=Count(
+                    "pk", filter=Q(state=MailingListEvent.EventType.SUBSCRIBE)
+                ),
+                num_signed=Count(
+                    "pk", filter=Q(first_subscribe_time__isnull=False)
+                ),
+            )
+            .values_list("mailing_list_id", "num_subscribed", "num_signed")
+        )
+        return {row[0]: tuple(row[1:]) for row in counts}
+
+    @classmethod
+    def recount(cls, mailing_list_ids) -> dict:
+        """Store the counts of the listed mailing lists from scratch.
+
+        Return the new counts as count() does, with (0, 0) for lists
+        without subscriptions.
+
+        """
+        counts = cls.count(mailing_list_ids)
+        now = django.utils.timezone.now()
+        result = {}
+        for mailing_list_id in mailing_list_ids:
+            num_subscribed, num_signed = counts.get(mailing_list_id, (0, 0))
+            cls.objects.update_or_create(
+                pk=mailing_list_id,
+                defaults={
+                    "num_subscribed": num_subscribed,
+                    "num_signed": num_signed,
+                    "reconcile_time": now,
+                },
+            )
+            cls.forget(mailing_list_id)
+            result[mailing_list_id] = (num_subscribed, num_signed)
+        return result
+
+    @classmethod
+    def reconcile(cls) -> int:
+        """Recount every list and correct the counts that drifted.
+
+        Return the number of lists whose counts were wrong or missing.
+
+        """
+        counts = cls.count()
+        stored = {
+            row[0]: tuple(row[1:])
+            for row in cls.objects.values_list(
+                "mailing_list_id", "num_subscribed", "num_signed"
+            )
+        }
+        wrong = [
+            mailing_list_id
+            for mailing_list_id in MailingList.objects.values_list(
+                "pk", flat=True
+            )
+            if stored.get(mailing_list_id)
+            != counts.get(mailing_list_id, (0, 0))
+        ]
+        for mailing_list_id in wrong:
+            logger.warning(
+                f"Mailing list {mailing_list_id} counts were "
+                f"{stored.get(mailing_list_id)}, "
+                f"recounted {counts.get(mailing_list_id, (0, 0))}."
+            )
+        with transaction.atomic():
+            cls.recount(wrong)
+            cls.objects.update(reconcile_time=django.utils.timezone.now())
+        return len(wrong)
+
+    @classmethod
+    def get_counts(cls, mailing_list_id) -> tuple:
+        """Return (num_subscribed, num_signed) for the list.
+
+        From the cache if we can, else from the table (and cache it),
+        else counted.
+
+        """
+        key = cls.cache_key(mailing_list_id)
+        counts = cache.get(key)
+        if counts is not None:
+            return counts
+        counts = (
+            cls.objects.filter(pk=mailing_list_id)
+            .values_list("num_subscribed", "num_signed")
+            .first()
+        )
+        if counts is None:
+            counts = cls.recount([mailing_list_id])[mailing_list_id]
+        counts = tuple(counts)
+        cache.set(key, counts, settings.MAILING_LIST_COUNTS_CACHE_SECONDS)
+        return counts
+
+
+@receiver(post_save, sender=MailingList)
+def create_mailing_list_counts(sender, instance, created, raw=False, **kwargs):
+    """Start each new mailing list with zero counts."""
+    if created and not raw:
+        MailingListCounts.objects.get_or_create(mailing_list=instance)
+        MailingListCounts.forget(instance.pk)
+
+
+@receiver(post_save, sender=MailingListEvent)
+def update_subscription(sender, instance, raw=False, **kwargs):
+    """Keep MailingListSubscription up to date with the events."""
+    if raw:
+        return
+    if kwargs.get("created"):
+        MailingListSubscription.apply_event(instance)
+    else:
+        # A modified event may no longer be the latest.
+        MailingListSubscription.recompute(
+            instance.user_id, instance.mailing_list_id
+        )
+
+
+@receiver(post_delete, sender=MailingListEvent)
+def update_subscription_on_delete(sender, instance, **kwargs):
+    MailingListSubscription.recompute(
+        instance.user_id, instance.mailing_list_id
+    )
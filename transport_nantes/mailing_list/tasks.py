@@ -0,0 +1,13 @@
+from celery import shared_task
+
+from mailing_list.models import MailingListCounts
+
+
+@shared_task
+def reconcile_mailing_list_counts():
+    """Recount mailing list subscribers and signers, correcting drift.
+
+    Scheduled by celery beat, cf. CELERY_BEAT_SCHEDULE in settings.
+
+    """
+    return MailingListCounts.reconcile()
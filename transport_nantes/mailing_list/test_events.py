@@ -1,10 +1,28 @@
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
 from django.test import TestCase
 from django.contrib.auth.models import User
 import datetime
+from io import StringIO
+import random
 from django.utils.timezone import make_aware
 
-from .events import subscriber_count, user_current_state, user_subscribe_count
-from .models import MailingList, MailingListEvent
+from .events import (
+    bounce_user_from_list,
+    get_subcribed_users_email_list,
+    get_subcribed_users_email_list_from_events,
+    subscribe_user_to_list,
+    subscriber_count,
+    unsubscribe_user_from_list,
+    user_current_state,
+    user_subscribe_count,
+)
+from .models import (
+    MailingList,
+    MailingListCounts,
+    MailingListEvent,
+    MailingListSubscription,
+)
 
 
 class EventsTest(TestCase):
@@ -140,3 +158,262 @@ class EventsTest(TestCase):
         )
         self.assertEqual(subscriber_count(dog_list), 2)
         self.assertEqual(subscriber_count(cat_list), 0)
+
+
+def get_subcribed_users_email_list_by_replay(mailing_list) -> list:
+    """The original get_subcribed_users_email_list(), 2N+1 queries."""
+    set_of_once_subscribed_users = set(
+        MailingListEvent.objects.filter(
+            mailing_list__mailing_list_token=mailing_list.mailing_list_token
+        ).values_list("user", flat=True)
+    )
+    subscribed_users = []
+    for user_id in set_of_once_subscribed_users:
+        user = User.objects.get(pk=user_id)
+        latest_event = user_current_state(user, mailing_list)
+        if latest_event.event_type == "sub":
+            subscribed_users.append(user.email)
+    return subscribed_users
+
+
+class SubscribedUsersEmailListTest(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create(username=f"user{i}", email=f"{i}@example.com")
+            for i in range(12)
+        ]
+        self.lists = [
+            MailingList.objects.create(
+                mailing_list_token=token, list_active=True
+            )
+            for token in ("dog", "cat", "bird")
+        ]
+        self.base_time = make_aware(datetime.datetime(2022, 1, 1))
+
+    def make_random_history(self, rng, num_events):
+        # Distinct timestamps, since the original breaks ties
+        # arbitrarily.
+        offsets = rng.sample(range(100000), num_events)
+        MailingListEvent.objects.bulk_create(
+            MailingListEvent(
+                user=rng.choice(self.users),
+                mailing_list=rng.choice(self.lists),
+                event_timestamp=self.base_time
+                + datetime.timedelta(minutes=offset),
+                event_type=rng.choice(
+                    [
+                        MailingListEvent.EventType.SUBSCRIBE,
+                        MailingListEvent.EventType.SUBSCRIBE,
+                        MailingListEvent.EventType.UNSUBSCRIBE,
+                        MailingListEvent.EventType.BOUNCE,
+                    ]
+                ),
+            )
+            for offset in offsets
+        )
+
+    def test_matches_replay_on_random_histories(self):
+        rng = random.Random(0)
+        for _ in range(20):
+            MailingListEvent.objects.all().delete()
+            self.make_random_history(rng, rng.randint(0, 60))
+            # bulk_create() doesn't send post_save.
+            MailingListSubscription.rebuild()
+            for mailing_list in self.lists:
+                expected = get_subcribed_users_email_list_by_replay(
+                    mailing_list
+                )
+                self.assertCountEqual(
+                    get_subcribed_users_email_list_from_events(mailing_list),
+                    expected,
+                )
+                self.assertCountEqual(
+                    get_subcribed_users_email_list(mailing_list), expected
+                )
+
+    def test_one_query(self):
+        self.make_random_history(random.Random(1), 50)
+        with self.assertNumQueries(1):
+            get_subcribed_users_email_list_from_events(self.lists[0])
+        with self.assertNumQueries(1):
+            get_subcribed_users_email_list(self.lists[0])
+
+    def test_same_timestamp(self):
+        for event_type in (
+            MailingListEvent.EventType.UNSUBSCRIBE,
+            MailingListEvent.EventType.SUBSCRIBE,
+        ):
+            MailingListEvent.objects.create(
+                user=self.users[0],
+                mailing_list=self.lists[0],
+                event_timestamp=self.base_time,
+                event_type=event_type,
+            )
+        # The later event wins.
+        self.assertEqual(
+            get_subcribed_users_email_list(self.lists[0]), ["0@example.com"]
+        )
+
+
+class MailingListSubscriptionTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username="Alice", email="a@a.fr")
+        self.bob = User.objects.create(username="Bob", email="b@b.fr")
+        self.dog_list = MailingList.objects.create(
+            mailing_list_token="dog", list_active=True
+        )
+        self.cat_list = MailingList.objects.create(
+            mailing_list_token="cat", list_active=True
+        )
+        self.base_time = make_aware(datetime.datetime(2022, 1, 1))
+
+    def subscription(self, user, mailing_list):
+        return MailingListSubscription.objects.get(
+            user=user, mailing_list=mailing_list
+        )
+
+    def test_follows_events(self):
+        subscribe_user_to_list(self.alice, self.dog_list)
+        self.assertTrue(
+            self.subscription(self.alice, self.dog_list).is_subscribed
+        )
+        unsubscribe_user_from_list(self.alice, self.dog_list)
+        subscription = self.subscription(self.alice, self.dog_list)
+        self.assertFalse(subscription.is_subscribed)
+        self.assertIsNotNone(subscription.first_subscribe_time)
+        # Bounces don't change the state.
+        subscribe_user_to_list(self.alice, self.dog_list)
+        bounce = bounce_user_from_list(self.alice, self.dog_list)
+        subscription = self.subscription(self.alice, self.dog_list)
+        self.assertTrue(subscription.is_subscribed)
+        self.assertEqual(subscription.last_bounce_time, bounce.event_timestamp)
+        self.assertFalse(
+            MailingListSubscription.objects.filter(user=self.bob).exists()
+        )
+
+    def test_out_of_order_events(self):
+        MailingListEvent.objects.create(
+            user=self.bob,
+            mailing_list=self.cat_list,
+            event_timestamp=self.base_time + datetime.timedelta(2),
+            event_type=MailingListEvent.EventType.UNSUBSCRIBE,
+        )
+        MailingListEvent.objects.create(
+            user=self.bob,
+            mailing_list=self.cat_list,
+            event_timestamp=self.base_time + datetime.timedelta(1),
+            event_type=MailingListEvent.EventType.SUBSCRIBE,
+        )
+        subscription = self.subscription(self.bob, self.cat_list)
+        self.assertFalse(subscription.is_subscribed)
+        self.assertEqual(
+            subscription.first_subscribe_time,
+            self.base_time + datetime.timedelta(1),
+        )
+        self.assertEqual(MailingListSubscription.inconsistencies(), [])
+
+    def test_deleting_events(self):
+        subscribe_user_to_list(self.bob, self.dog_list)
+        unsubscribe = unsubscribe_user_from_list(self.bob, self.dog_list)
+        unsubscribe.delete()
+        self.assertTrue(
+            self.subscription(self.bob, self.dog_list).is_subscribed
+        )
+        MailingListEvent.objects.filter(user=self.bob).delete()
+        self.assertFalse(
+            MailingListSubscription.objects.filter(user=self.bob).exists()
+        )
+
+    def test_read_paths(self):
+        subscribe_user_to_list(self.alice, self.dog_list)
+        subscribe_user_to_list(self.bob, self.dog_list)
+        unsubscribe_user_from_list(self.bob, self.dog_list)
+        with self.assertNumQueries(1):
+            state = user_current_state(self.bob, self.dog_list)
+        self.assertEqual(
+            state.event_type, MailingListEvent.EventType.UNSUBSCRIBE
+        )
+        self.assertEqual(user_subscribe_count(self.dog_list), 1)
+        self.assertEqual(subscriber_count(self.dog_list), 2)
+        self.assertEqual(
+            get_subcribed_users_email_list(self.dog_list), ["a@a.fr"]
+        )
+
+    def test_check_and_rebuild_commands(self):
+        subscribe_user_to_list(self.alice, self.dog_list)
+        subscribe_user_to_list(self.bob, self.cat_list)
+        call_command("check_mailing_list_subscriptions", stdout=StringIO())
+
+        MailingListSubscription.objects.filter(user=self.alice).update(
+            state=MailingListEvent.EventType.UNSUBSCRIBE
+        )
+        MailingListSubscription.objects.filter(user=self.bob).delete()
+        self.assertEqual(len(MailingListSubscription.inconsistencies()), 2)
+        with self.assertRaises(CommandError):
+            call_command("check_mailing_list_subscriptions", stdout=StringIO())
+        call_command(
+            "check_mailing_list_subscriptions", "--fix", stdout=StringIO()
+        )
+        self.assertEqual(MailingListSubscription.inconsistencies(), [])
+
+        MailingListSubscription.objects.all().delete()
+        call_command("rebuild_mailing_list_subscriptions", stdout=StringIO())
+        self.assertEqual(MailingListSubscription.inconsistencies(), [])
+        self.assertEqual(MailingListSubscription.objects.count(), 2)
+
+
+class MailingListCountsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(username="Alice", email="a@a.fr")
+        self.bob = User.objects.create(username="Bob", email="b@b.fr")
+        self.dog_list = MailingList.objects.create(
+            mailing_list_token="dog", list_active=True
+        )
+
+    def counts(self):
+        return MailingListCounts.objects.values_list(
+            "num_subscribed", "num_signed"
+        ).get(mailing_list=self.dog_list)
+
+    def test_counts_follow_events(self):
+        self.assertEqual(self.counts(), (0, 0))
+        subscribe_user_to_list(self.alice, self.dog_list)
+        subscribe_user_to_list(self.alice, self.dog_list)
+        subscribe_user_to_list(self.bob, self.dog_list)
+        self.assertEqual(self.counts(), (2, 2))
+        unsubscribe_user_from_list(self.bob, self.dog_list)
+        bounce_user_from_list(self.alice, self.dog_list)
+        self.assertEqual(self.counts(), (1, 2))
+        MailingListEvent.objects.filter(user=self.bob).delete()
+        self.assertEqual(self.counts(), (1, 1))
+        self.assertEqual(MailingListCounts.reconcile(), 0)
+
+    def test_counts_are_cached(self):
+        subscribe_user_to_list(self.alice, self.dog_list)
+        self.assertEqual(user_subscribe_count(self.dog_list), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(user_subscribe_count(self.dog_list), 1)
+            self.assertEqual(subscriber_count(self.dog_list), 1)
+        # A new event replaces the cached counts.
+        unsubscribe_user_from_list(self.alice, self.dog_list)
+        self.assertEqual(user_subscribe_count(self.dog_list), 0)
+        self.assertEqual(subscriber_count(self.dog_list), 1)
+
+    def test_reconcile(self):
+        subscribe_user_to_list(self.alice, self.dog_list)
+        subscribe_user_to_list(self.bob, self.dog_list)
+        MailingListCounts.objects.filter(mailing_list=self.dog_list).delete()
+        cat_list = MailingList.objects.create(mailing_list_token="cat")
+        MailingListCounts.objects.filter(mailing_list=cat_list).update(
+            num_signed=3
+        )
+        out = StringIO()
+        call_command("reconcile_mailing_list_counts", stdout=out)
+        self.assertIn("2 lists", out.getvalue())
+        self.assertEqual(self.counts(), (2, 2))
+        self.assertEqual(user_subscribe_count(cat_list), 0)
+        self.assertEqual(subscriber_count(cat_list), 0)
+        self.assertFalse(
+            MailingListCounts.objects.filter(reconcile_time=None).exists()
+        )
@@ -1,4 +1,7 @@
+from django.core.cache import cache
+from django.db import connection
 from django.test import Client, LiveServerTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
@@ -11,7 +14,7 @@ from datetime import datetime, timezone
 from .models import MailingList, MailingListEvent, Petition
 from django.contrib.auth.models import User
 from django.urls import reverse
-from .events import user_current_state
+from .events import subscribe_user_to_list, user_current_state
 
 
 class MailingListIntegrationTestCase(LiveServerTestCase):
@@ -438,3 +441,66 @@ class MailingListStatusCodeTest(TestCase):
         )
         # Testing that both context is not the same
         self.assertNotEqual(good_mailing_list_0, good_mailing_list_1)
+
+
+class MailingListOverviewQueryCountTest(TestCase):
+    """The list overview and the user status page query in constant time."""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="ml-admin", password="ml-admin", email="a@example.com"
+        )
+        self.client.login(username="ml-admin", password="ml-admin")
+        self.num_lists = 0
+
+    def add_lists(self, count):
+        for _ in range(count):
+            self.num_lists += 1
+            mailing_list = MailingList.objects.create(
+                mailing_list_name=f"list-{self.num_lists:03}",
+                mailing_list_token=f"token-{self.num_lists}",
+                list_active=True,
+                is_petition=self.num_lists % 3 == 0,
+            )
+            if self.num_lists % 2:
+                subscribe_user_to_list(self.user, mailing_list)
+
+    def count_queries(self, url):
+        # Not counting the session update on the first request, nor
+        # hitting cached counts.
+        self.client.get(url)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_list_items(self):
+        url = reverse("mailing_list:list_items")
+        self.add_lists(3)
+        num_queries, _ = self.count_queries(url)
+        self.add_lists(20)
+        self.assertEqual(self.count_queries(url)[0], num_queries)
+
+        _, response = self.count_queries(url)
+        counts = {
+            mailing_list.mailing_list_name: count
+            for mailing_list, count in response.context["mailing_lists"]
+            + response.context["petitions_lists"]
+        }
+        self.assertEqual(len(counts), self.num_lists)
+        self.assertEqual(counts["list-001"], 1)
+        self.assertEqual(counts["list-002"], 0)
+        self.assertEqual(counts["list-003"], 1)
+
+    def test_user_status(self):
+        url = reverse("mailing_list:user_status")
+        self.add_lists(3)
+        num_queries, _ = self.count_queries(url)
+        self.add_lists(20)
+        num_queries_after, response = self.count_queries(url)
+        self.assertEqual(num_queries_after, num_queries)
+        for mailing_list, state in response.context["mailing_lists"]:
+            self.assertEqual(
+                state, user_current_state(self.user, mailing_list).event_type
+            )
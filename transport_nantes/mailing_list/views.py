@@ -10,8 +10,7 @@ from django.contrib.auth.mixins import (
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Case, When, Subquery, OuterRef
-from django.db.models.expressions import Value
+from django.db.models import Exists, OuterRef
 from django.http import (
     Http404,
     HttpResponseBadRequest,
@@ -29,7 +28,8 @@ from .events import (
     subscriber_count,
     unsubscribe_user_from_list,
     user_current_state,
-    user_subscribe_count,
+    with_counts,
+    with_user_state,
 )
 from .forms import (
     FirstStepQuickMailingListSignupForm,
@@ -38,7 +38,12 @@ from .forms import (
     QuickPetitionSignupForm,
     SubscribeUpdateForm,
 )
-from .models import MailingList, Petition, MailingListEvent
+from .models import (
+    MailingList,
+    MailingListEvent,
+    MailingListSubscription,
+    Petition,
+)
 
 logger = logging.getLogger("django")
 
@@ -266,6 +271,7 @@ class PetitionView(AssoView):
         context["body_text_4"] = petition.petition4_md
         context["petition"] = petition
         context["petition_token"] = petition.mailing_list.mailing_list_token
+        context["signature_count"] = subscriber_count(petition.mailing_list)
         # context['hero_image'] = 'asso_tn/traffic-1600.jpg'
         context["page"] = {
             "hero_image": "asso_tn/traffic-1600.jpg",
@@ -286,16 +292,14 @@ class MailingListListView(
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        lists = self.get_queryset()
+        lists = with_counts(self.get_queryset())
         context["mailing_lists"] = [
-            (list, user_subscribe_count(list))
+            (list, list.num_subscribed)
             for list in lists
             if not list.is_petition
         ]
         context["petitions_lists"] = [
-            (list, subscriber_count(list))
-            for list in lists
-            if list.is_petition
+            (list, list.num_signed) for list in lists if list.is_petition
         ]
         return context
 
@@ -309,15 +313,14 @@ class UserStatusView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         """Create a list with all active mailing list
         with the current state of the user"""
-        object_list = MailingList.objects.filter(
-            list_active=True, is_petition=False
-        ).order_by("mailing_list_name")
-        user = self.request.user
+        object_list = with_user_state(
+            MailingList.objects.filter(
+                list_active=True, is_petition=False
+            ).order_by("mailing_list_name"),
+            self.request.user,
+        )
         object_list_with_state = [
-            (
-                mailing_list,
-                user_current_state(user, mailing_list).event_type,
-            )
+            (mailing_list, mailing_list.user_state)
             for mailing_list in object_list
         ]
         return object_list_with_state
@@ -461,22 +464,13 @@ class PressSubscriptionManagementView(TemplateView):
             context["press_subscription_list"] = (
                 MailingList.objects.filter(mailing_list_type="PRESS")
                 .order_by("-id")
-                .annotate(  # noqa
-                    is_subbed=Subquery(
-                        MailingListEvent.objects.filter(
-                            mailing_list=OuterRef("id"), user=context["user"]
-                        )
-                        .order_by("-event_timestamp")
-                        .annotate(
-                            is_subbed=Case(
-                                When(
-                                    event_type=MailingListEvent.EventType.SUBSCRIBE,  # noqa
-                                    then=Value(True),
-                                ),
-                                default=Value(False),
-                            )
+                .annotate(
+                    is_subbed=Exists(
+                        MailingListSubscription.objects.filter(
+                            mailing_list=OuterRef("id"),
+                            user=context["user"],
+                            state=MailingListEvent.EventType.SUBSCRIBE,
                         )
-                        .values("is_subbed")[:1]
                     )
                 )
             )
@@ -0,0 +1,345 @@
+"""Render the charts of Mobilito sessions.
+
+The timeseries and fraction images are embedded in result emails and
+on summary pages, so the same image is fetched many times, and
+rendering one with matplotlib takes a good part of a second.  We
+render each chart once and store the PNG in media, under
+mobilito/charts/<session sha1>/.
+
+The file name contains a fingerprint of what the charts are drawn
+from: the number of events, the end timestamp and the counts.  If any
+of these change, the stored PNG is no longer found and the chart is
+rendered again.  The fingerprint is also the ETag of the image, so
+that browsers and mail proxies can revalidate for free.
+
+Drawing is CPU-bound and would hold a web process for hundreds of
+milliseconds, so with MOBILITO_CHARTS_IN_BACKGROUND the charts are
+drawn by celery, whose workers load matplotlib, our fonts and the
+icons once, when they start (cf. tasks.py).  The charts of an ended
+session are drawn before its results email is sent.  A request for a
+chart that isn't stored yet queues its rendering and waits
+MOBILITO_CHART_WAIT_SECONDS at most for it, then draws it itself: the
+images are embedded in mails, whose clients don't retry.
+
+"""
+
+import hashlib
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models.functions import Coalesce
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from mobilito import rendering
+from mobilito.models import Event, MobilitoSession, k_event_count_fields
+from topicblog.campaigns import make_email_request
+
+logger = logging.getLogger("django")
+
+k_chart_directory = "mobilito/charts"
+# Change this when the charts are drawn differently, so that the
+# stored ones are rendered again.
+k_chart_version = "2"
+# How long a chart request waits before queueing the same chart again,
+# in case the first rendering was lost.
+k_chart_queued_seconds = 60
+# How often a chart request looks for the chart it waits for.
+k_chart_poll_seconds = 0.1
+
+
+# Event types in the order of the rows of the timeseries chart.
+k_timeseries_event_types = np.array(
+    [
+        Event.EventTypes.PEDESTRIAN,
+        Event.EventTypes.BICYCLE,
+        Event.EventTypes.MOTOR_VEHICLE,
+        Event.EventTypes.PUBLIC_TRANSPORT,
+    ]
+)
+k_timeseries_event_type_order = np.argsort(k_timeseries_event_types)
+
+
+def timeseries_data(mobilito_session: MobilitoSession):
+    """Return the times and rows of the events of mobilito_session.
+
+    Cf. rendering.draw_timeseries().  An event happened when the
+    client says it was tapped, or else when we received it.
+
+    """
+    events = list(
+        Event.objects.filter(mobilito_session=mobilito_session)
+        .annotate(event_time=Coalesce("client_timestamp", "timestamp"))
+        .values_list("event_time", "event_type")
+    )
+    event_times, event_types = zip(*events) if events else ((), ())
+    times = np.fromiter(
+        (event_time.timestamp() for event_time in event_times),
+        dtype=np.float64,
+        count=len(event_times),
+    )
+    rows = k_timeseries_event_type_order[
+        np.searchsorted(
+            k_timeseries_event_types,
+            np.array(event_types, dtype=k_timeseries_event_types.dtype),
+            sorter=k_timeseries_event_type_order,
+        )
+    ]
+    return times, rows
+
+
+def render_timeseries(mobilito_session: MobilitoSession) -> bytes:
+    """Render the time series chart of mobilito_session.
+
+    Sessions of more than MOBILITO_TIMESERIES_DENSITY_THRESHOLD events
+    are drawn as events per minute.  Cf. rendering.draw_timeseries().
+
+    """
+    times, rows = timeseries_data(mobilito_session)
+    if len(times) > settings.MOBILITO_TIMESERIES_DENSITY_THRESHOLD:
+        bin_seconds = 60
+    else:
+        bin_seconds = None
+    return rendering.draw_timeseries(
+        times,
+        rows,
+        mobilito_session.start_timestamp.timestamp(),
+        bin_seconds,
+    )
+
+
+def render_fraction(mobilito_session: MobilitoSession) -> bytes:
+    """Render the eco fraction chart of mobilito_session.
+
+    Cf. rendering.draw_fraction().
+
+    """
+    counts = [
+        getattr(mobilito_session, field_name)
+        for field_name in k_event_count_fields.values()
+    ]
+    return rendering.draw_fraction(counts)
+
+
+# Chart name -> function that renders it as PNG bytes.
+k_chart_renderers = {
+    "timeseries": render_timeseries,
+    "fraction": render_fraction,
+}
+
+
+def chart_fingerprint(mobilito_session: MobilitoSession) -> str:
+    """Return a digest of what the charts of mobilito_session show."""
+    num_events = Event.objects.filter(
+        mobilito_session=mobilito_session
+    ).count()
+    end_timestamp = mobilito_session.end_timestamp
+    parts = [
+        k_chart_version,
+        str(num_events),
+        end_timestamp.isoformat() if end_timestamp else "",
+    ] + [
+        str(getattr(mobilito_session, field_name))
+        for field_name in k_event_count_fields.values()
+    ]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def chart_session_directory(mobilito_session: MobilitoSession) -> str:
+    return f"{k_chart_directory}/{mobilito_session.session_sha1}"
+
+
+def chart_file_name(
+    mobilito_session: MobilitoSession, chart_name: str, fingerprint: str
+) -> str:
+    return (
+        f"{chart_session_directory(mobilito_session)}/"
+        f"{chart_name}-{fingerprint}.png"
+    )
+
+
+def session_chart_files(mobilito_session: MobilitoSession) -> list:
+    """Return the names of the stored charts of mobilito_session."""
+    directory = chart_session_directory(mobilito_session)
+    try:
+        _, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [f"{directory}/{file_name}" for file_name in files]
+
+
+def get_chart(
+    mobilito_session: MobilitoSession, chart_name: str, fingerprint: str
+) -> bytes:
+    """Return the chart as PNG bytes, rendering it if need be.
+
+    The chart is stored, replacing those with another fingerprint.
+    The charts of sessions in progress change with every tap, so they
+    are replaced often, but not drawn again for each request.
+
+    """
+    file_name = chart_file_name(mobilito_session, chart_name, fingerprint)
+    if default_storage.exists(file_name):
+        with default_storage.open(file_name, "rb") as chart_file:
+            return chart_file.read()
+    png = k_chart_renderers[chart_name](mobilito_session)
+    store_chart(mobilito_session, chart_name, file_name, png)
+    return png
+
+
+def store_chart(
+    mobilito_session: MobilitoSession,
+    chart_name: str,
+    file_name: str,
+    png: bytes,
+) -> None:
+    """Store a chart as file_name, deleting its other fingerprints.
+
+    Two requests may render the same chart at once.  The second to
+    store it keeps the first one's file rather than storing a copy
+    under another name.
+
+    """
+    for other_file_name in session_chart_files(mobilito_session):
+        base_name = other_file_name.rsplit("/", 1)[1]
+        if other_file_name != file_name and base_name.startswith(
+            f"{chart_name}-"
+        ):
+            default_storage.delete(other_file_name)
+    if default_storage.exists(file_name):
+        return
+    stored_name = default_storage.save(file_name, ContentFile(png))
+    if stored_name != file_name:
+        # Someone stored file_name since we looked.
+        default_storage.delete(stored_name)
+        return
+    logger.info(f"Stored {file_name}")
+
+
+def render_charts(mobilito_session: MobilitoSession) -> None:
+    """Render and store the charts of a session.
+
+    A failed chart is only logged: it will be rendered on request.
+
+    """
+    fingerprint = chart_fingerprint(mobilito_session)
+    for chart_name in k_chart_renderers:
+        try:
+            get_chart(mobilito_session, chart_name, fingerprint)
+        except Exception as e:
+            logger.error(
+                f"Failed to render {chart_name} chart of mobilito_session "
+                f"{mobilito_session.session_sha1}: {e}"
+            )
+
+
+def render_charts_and_send_results(
+    mobilito_session: MobilitoSession, site_url: str = None
+) -> None:
+    """Render and store the charts of a session.
+
+    With site_url, then email the session's results, which show the
+    charts, with links to site_url.
+
+    """
+    render_charts(mobilito_session)
+    if site_url is None:
+        return
+
+    # The views import us.
+    from mobilito.views import send_results
+
+    send_results(make_email_request(site_url), mobilito_session)
+
+
+def queue_charts(
+    mobilito_session: MobilitoSession, site_url: str = None
+) -> bool:
+    """Render the charts of a session in the background.
+
+    Cf. render_charts_and_send_results().  With
+    MOBILITO_CHARTS_IN_BACKGROUND False, or if we can't reach the
+    celery broker, do it here.  Return whether it was queued.
+
+    """
+    if settings.MOBILITO_CHARTS_IN_BACKGROUND:
+        from mobilito.tasks import render_mobilito_charts
+
+        try:
+            render_mobilito_charts.delay(mobilito_session.pk, site_url)
+            return True
+        except Exception as e:
+            logger.error(
+                f"Failed to queue the charts of mobilito_session "
+                f"{mobilito_session.session_sha1}: {e}"
+            )
+    render_charts_and_send_results(mobilito_session, site_url)
+    return False
+
+
+def wait_for_chart(
+    mobilito_session: MobilitoSession, chart_name: str, fingerprint: str
+) -> bool:
+    """Have celery render the chart, and wait for it to be stored.
+
+    Queue the rendering of the session's charts, at most once every
+    k_chart_queued_seconds, and wait MOBILITO_CHART_WAIT_SECONDS at
+    most.  Return whether the chart is stored.
+
+    """
+    file_name = chart_file_name(mobilito_session, chart_name, fingerprint)
+    if default_storage.exists(file_name):
+        return True
+    queued_key = (
+        f"mobilito-charts-{mobilito_session.session_sha1}-{fingerprint}"
+    )
+    if cache.add(queued_key, True, k_chart_queued_seconds):
+        if not queue_charts(mobilito_session):
+            # Rendered here.
+            cache.delete(queued_key)
+            return default_storage.exists(file_name)
+    deadline = time.monotonic() + settings.MOBILITO_CHART_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(k_chart_poll_seconds)
+        if default_storage.exists(file_name):
+            return True
+    logger.warning(
+        f"Waited {settings.MOBILITO_CHART_WAIT_SECONDS} seconds for "
+        f"{file_name}, rendering it here."
+    )
+    return False
+
+
+def delete_charts(mobilito_session: MobilitoSession) -> None:
+    """Delete the stored charts of mobilito_session."""
+    for file_name in session_chart_files(mobilito_session):
+        default_storage.delete(file_name)
+
+
+def chart_response(
+    request: HttpRequest, mobilito_session: MobilitoSession, chart_name: str
+) -> HttpResponse:
+    """Respond with a chart of mobilito_session, or 304 if unchanged."""
+    fingerprint = chart_fingerprint(mobilito_session)
+    etag = f'"{chart_name}-{fingerprint}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if settings.MOBILITO_CHARTS_IN_BACKGROUND:
+            wait_for_chart(mobilito_session, chart_name, fingerprint)
+        png = get_chart(mobilito_session, chart_name, fingerprint)
+        response = HttpResponse(png, content_type="image/png")
+    response["ETag"] = etag
+    if mobilito_session.end_timestamp is None:
+        patch_cache_control(response, no_cache=True)
+    else:
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=settings.MOBILITO_CHART_MAX_AGE_SECONDS,
+        )
+    return response
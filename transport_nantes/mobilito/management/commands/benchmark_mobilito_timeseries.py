@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta, timezone
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from mobilito import rendering
+from mobilito.charts import timeseries_data
+from mobilito.models import Event, MobilitoSession, MobilitoUser
+
+
+def make_session(num_events: int, hours: float) -> MobilitoSession:
+    """Make a session of num_events random taps over hours."""
+    start = datetime.now(timezone.utc) - timedelta(hours=hours)
+    user = User.objects.create(username=f"benchmark-{time.monotonic_ns()}")
+    mobilito_session = MobilitoSession.objects.create(
+        user=MobilitoUser.objects.create(user=user),
+        start_timestamp=start,
+        end_timestamp=start + timedelta(hours=hours),
+    )
+    offsets = sorted(random.random() * hours * 3600 for _ in range(num_events))
+    Event.objects.bulk_create(
+        [
+            Event(
+                mobilito_session=mobilito_session,
+                event_type=random.choice(Event.EventTypes.values),
+                client_timestamp=start + timedelta(seconds=offset),
+                sequence_number=n,
+            )
+            for n, offset in enumerate(offsets)
+        ],
+        batch_size=1000,
+    )
+    return mobilito_session
+
+
+def per_event_data(mobilito_session: MobilitoSession):
+    """Prepare the series as we did before NumPy, one event at a time."""
+    scatter_map = {
+        Event.EventTypes.PEDESTRIAN: 0,
+        Event.EventTypes.BICYCLE: 1,
+        Event.EventTypes.MOTOR_VEHICLE: 2,
+        Event.EventTypes.PUBLIC_TRANSPORT: 3,
+    }
+    events = Event.objects.filter(mobilito_session=mobilito_session)
+    timestamps = [an_event.timestamp for an_event in events]
+    rows = [
+        scatter_map[an_event.event_type] + 0.3 * (random.random() - 0.5)
+        for an_event in events
+    ]
+    return timestamps, rows
+
+
+def best_time(function, repeat: int) -> float:
+    """Return the shortest of repeat calls to function, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time preparing and drawing the timeseries chart of synthetic "
+        "Mobilito sessions.  Nothing is kept in the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--events",
+            type=int,
+            nargs="+",
+            default=[1000, 10000, 50000],
+            help="Number of events of each synthetic session.",
+        )
+        parser.add_argument(
+            "--hours",
+            type=float,
+            default=4,
+            help="Length of the synthetic sessions.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Times to run each step, we report the fastest.",
+        )
+
+    def handle(self, *args, **options):
+        rendering.init_worker()
+        repeat = options["repeat"]
+        with transaction.atomic():
+            for num_events in options["events"]:
+                mobilito_session = make_session(num_events, options["hours"])
+                start_time = mobilito_session.start_timestamp.timestamp()
+                times, rows = timeseries_data(mobilito_session)
+
+                per_event = best_time(
+                    lambda: per_event_data(mobilito_session), repeat
+                )
+                vectorized = best_time(
+                    lambda: timeseries_data(mobilito_session), repeat
+                )
+                points = best_time(
+                    lambda: rendering.draw_timeseries(times, rows, start_time),
+                    repeat,
+                )
+                density = best_time(
+                    lambda: rendering.draw_timeseries(
+                        times, rows, start_time, bin_seconds=60
+                    ),
+                    repeat,
+                )
+                self.stdout.write(
+                    f"{num_events:7d} events: "
+                    f"data per event {per_event * 1000:8.1f} ms, "
+                    f"vectorized {vectorized * 1000:8.1f} ms; "
+                    f"draw points {points * 1000:8.1f} ms, "
+                    f"per minute {density * 1000:8.1f} ms"
+                )
+            transaction.set_rollback(True)
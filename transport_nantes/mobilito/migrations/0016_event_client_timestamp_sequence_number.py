@@ -0,0 +1,29 @@
+# Generated by Django 4.1.10 on 2026-10-18 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("mobilito", "0015_mobilitosession_map_image"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="event",
+            name="client_timestamp",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="event",
+            name="sequence_number",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="event",
+            constraint=models.UniqueConstraint(
+                fields=("mobilito_session", "sequence_number"),
+                name="unique_mobilito_event_sequence_number",
+            ),
+        ),
+    ]
@@ -4,7 +4,8 @@ import requests
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.files.base import ContentFile
-from django.db import IntegrityError, models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count
 from django.forms import ValidationError
 from django.urls import reverse
 
@@ -66,6 +67,78 @@ class MobilitoSession(models.Model):
             f"{self.user.user.email} created an event of type {event_type}"
         )
 
+    def add_events(self, events: list) -> int:
+        """Store a batch of events recorded by the client.
+
+        events is a list of (sequence number, event type, client
+        timestamp), already validated.  Clients number the events of a
+        session and resend a batch until we acknowledge it, so we skip
+        the sequence numbers we already have.  Return the number of
+        events stored.
+
+        A client may resend a batch while we are still storing it.  We
+        lock the session's row, so that batches of a session are stored
+        one after the other, and the events we didn't already have are
+        exactly the ones we store.
+
+        """
+        with transaction.atomic():
+            MobilitoSession.objects.select_for_update().filter(
+                pk=self.pk
+            ).exists()
+            num_created = self._add_events(events)
+        logger.info(
+            f"Created {num_created} events "
+            f"in mobilito_session {self.session_sha1}"
+        )
+        return num_created
+
+    def _add_events(self, events: list) -> int:
+        sequence_numbers = {sequence_number for sequence_number, *_ in events}
+        seen = set(
+            Event.objects.filter(
+                mobilito_session=self, sequence_number__in=sequence_numbers
+            ).values_list("sequence_number", flat=True)
+        )
+        new_events = []
+        for sequence_number, event_type, client_timestamp in events:
+            if sequence_number in seen:
+                continue
+            seen.add(sequence_number)
+            new_events.append(
+                Event(
+                    mobilito_session=self,
+                    event_type=event_type,
+                    client_timestamp=client_timestamp,
+                    sequence_number=sequence_number,
+                )
+            )
+        # The unique constraint is our last line of defence.
+        Event.objects.bulk_create(new_events, ignore_conflicts=True)
+        return len(new_events)
+
+    def reconcile_counts(self) -> dict:
+        """Set the session's counts from its stored events.
+
+        Return the counts, a dict mapping count field name to count.
+        The caller saves the session.
+
+        """
+        stored = dict(
+            Event.objects.filter(mobilito_session=self)
+            .order_by()
+            .values("event_type")
+            .annotate(count=Count("id"))
+            .values_list("event_type", "count")
+        )
+        counts = {
+            field_name: stored.get(event_type, 0)
+            for event_type, field_name in k_event_count_fields.items()
+        }
+        for field_name, count in counts.items():
+            setattr(self, field_name, count)
+        return counts
+
     def save(self, *args, **kwargs):
         if not self.session_sha1:
             self.session_sha1 = self.generate_session_sha1()
@@ -153,6 +226,14 @@ def event_type_validator(value):
 class Event(models.Model):
     """Model one press of a count button."""
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["mobilito_session", "sequence_number"],
+                name="unique_mobilito_event_sequence_number",
+            )
+        ]
+
     class EventTypes(models.TextChoices):
         PEDESTRIAN = "ped"
         BICYCLE = "bike"
@@ -169,6 +250,12 @@ class Event(models.Model):
         validators=[event_type_validator],
         blank=False,
     )
+    # Events sent in batches (cf. MobilitoSession.add_events()) carry
+    # the time of the tap on the client and the client's number for
+    # it, counting from zero in each session.  Events sent one by one
+    # have neither.
+    client_timestamp = models.DateTimeField(null=True, blank=True)
+    sequence_number = models.PositiveIntegerField(null=True, blank=True)
 
     def __str__(self):
         return (
@@ -185,6 +272,15 @@ class Event(models.Model):
             logger.error(f"Error while saving event : {e}")
 
 
+# The MobilitoSession count of each event type.
+k_event_count_fields = {
+    Event.EventTypes.PEDESTRIAN: "pedestrian_count",
+    Event.EventTypes.BICYCLE: "bicycle_count",
+    Event.EventTypes.MOTOR_VEHICLE: "motor_vehicle_count",
+    Event.EventTypes.PUBLIC_TRANSPORT: "public_transport_count",
+}
+
+
 class InappropriateFlag(models.Model):
     """Represent user spam/abuse reports on mobilito recording sessions.
 
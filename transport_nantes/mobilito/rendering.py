@@ -0,0 +1,334 @@
+"""Draw the charts of Mobilito sessions with matplotlib.
+
+This module doesn't use Django: the functions that draw take plain
+data and return PNG bytes.  Celery workers load the fonts and icons
+once, in init_worker(), when they start (cf. tasks.py).
+
+"""
+
+import io
+import logging
+from pathlib import Path
+
+import matplotlib
+import matplotlib.dates as mdates
+import matplotlib.font_manager as font_manager
+import matplotlib.image as mpimg
+import matplotlib.pyplot as plt
+import numpy as np
+
+logger = logging.getLogger("django")
+matplotlib.use("Agg")
+
+k_font_directory = (
+    Path(__file__).parent.parent / "open_graph" / "base_images" / "Montserrat"
+)
+k_icon_directory = Path(__file__).parent / "static" / "mobilito" / "images"
+# Pedestrian, bicycle, motor vehicle, public transport.
+k_icon_names = [
+    "ped-icon-small.png",
+    "bike-icon-small.png",
+    "car-icon-small.png",
+    "tc-icon-small.png",
+]
+k_num_modes = len(k_icon_names)
+icons = None
+
+fonts_inited = False
+
+
+def init_brand_font():
+    """Initialise our brand font.
+
+    This function may be a bit of a hack.
+
+    """
+    global fonts_inited
+    if not fonts_inited:
+        logger.info("Initing fonts.")
+        fontdir = str(k_font_directory)
+        font_manager.findSystemFonts(fontdir)
+        for font in font_manager.findSystemFonts(fontdir):
+            font_manager.fontManager.addfont(font)
+        matplotlib.rcParams["font.family"] = "Montserrat"
+        fonts_inited = True
+
+
+def load_icons() -> list:
+    """Return the icons of the four modes as image arrays."""
+    global icons
+    if icons is None:
+        icons = [
+            mpimg.imread(k_icon_directory / icon_name)
+            for icon_name in k_icon_names
+        ]
+    return icons
+
+
+def init_worker():
+    """Load what drawing needs before the first chart.
+
+    Called when a celery worker process starts.
+
+    """
+    init_brand_font()
+    load_icons()
+
+
+def bin_events(times, rows, bin_seconds: int):
+    """Count the events of each mode in bins of bin_seconds.
+
+    times are seconds since the epoch and rows the modes of the events
+    (cf. draw_timeseries()), as NumPy arrays.  Return the start times
+    of the bins, in seconds since the epoch, and an array with a row
+    of four counts per bin.
+
+    """
+    first_bin = np.floor(times.min() / bin_seconds)
+    bins = (np.floor(times / bin_seconds) - first_bin).astype(np.int64)
+    num_bins = bins.max() + 1
+    counts = np.bincount(
+        bins * k_num_modes + rows, minlength=num_bins * k_num_modes
+    ).reshape(num_bins, k_num_modes)
+    bin_starts = (first_bin + np.arange(num_bins)) * bin_seconds
+    return bin_starts, counts
+
+
+def as_datetimes(times):
+    """Convert seconds since the epoch to numpy datetimes (UTC)."""
+    return np.round(times * 1e6).astype(np.int64).astype("datetime64[us]")
+
+
+def draw_timeseries(
+    times, rows, start_time: float, bin_seconds: int = None
+) -> bytes:
+    """Generate a time series visualisation of a Mobilito session.
+
+    The point of this graphic is to visualise the time evolution of
+    traffic in the four modes we measure, giving an idea of density
+    over time of each mode.
+
+    On a web page we'll (eventually) use d3 to render these images, as
+    it's lighter and responsive.  But in email, a PNG works far
+    better, in the sense that d3 won't render in many an email client.
+
+    This needs to be localised to French.  And most of the
+    labels/titles are place holders for now.
+
+    times are the times of the events in seconds since the epoch, rows
+    their modes: 0 for pedestrians, 1 for bicycles, 2 for motor
+    vehicles, 3 for public transport, both as NumPy arrays.
+    start_time is the start of the session, for sessions without
+    events.
+
+    Long sessions have too many events to tell them apart.  With
+    bin_seconds, we draw a band per mode instead, as wide as the number
+    of events in each bin of bin_seconds.
+
+    """
+    init_brand_font()
+    mobilitains_light_blue = (91.0 / 255, 194.0 / 255, 231.0 / 255)
+    mobilitains_dark_blue = (67.0 / 255, 82.0 / 255, 110.0 / 255)
+    mobilitains_gray = (219.0 / 255, 227.0 / 255, 235.0 / 255)
+    # mobilitains_red = (250./255, 70./255, 22./255)
+    # mobilitains_maroon = (128./255, 105./255, 102./255)
+
+    img_walking, img_bicycle, img_car, img_tc = load_icons()
+    intermode_vertical = 1
+    vertical_jitter = 0.3
+    min_time = times.min() if len(times) else start_time
+
+    fig, ax = plt.subplots(figsize=(8, 5), dpi=100)
+
+    # Place a new axes for each image where we want the image.
+    # (x, y, width, height).
+    # Then remove ticks and box before rendering.
+    horizontal_offset = 0.02
+    base_height = 0.17
+    incr_height = 0.21
+
+    walk_icon = fig.add_axes(
+        [horizontal_offset, base_height + 0 * incr_height, 0.05, 0.05]
+    )
+    walk_icon.set_axis_off()
+    walk_icon.imshow(img_walking, aspect="equal")
+
+    bicycle_icon = fig.add_axes(
+        [horizontal_offset, base_height + 1 * incr_height, 0.05, 0.05]
+    )
+    bicycle_icon.set_axis_off()
+    bicycle_icon.imshow(img_bicycle, aspect="equal")
+
+    car_icon = fig.add_axes(
+        [horizontal_offset, base_height + 2 * incr_height, 0.05, 0.05]
+    )
+    car_icon.set_axis_off()
+    car_icon.imshow(img_car, aspect="equal")
+
+    tc_icon = fig.add_axes(
+        [horizontal_offset, base_height + 3 * incr_height, 0.05, 0.05]
+    )
+    tc_icon.set_axis_off()
+    tc_icon.imshow(img_tc, aspect="equal")
+
+    # Plot four invisible points on the center lines in order to make
+    # the plot register correctly, even if some modes have no data.
+    ax.scatter(
+        as_datetimes(np.full(k_num_modes, min_time)),
+        np.arange(k_num_modes),
+        s=10,
+        color=mobilitains_dark_blue,
+    )
+    if bin_seconds and len(times):
+        bin_starts, counts = bin_events(times, rows, bin_seconds)
+        half_widths = 0.4 * counts / counts.max()
+        bin_centers = as_datetimes(bin_starts + bin_seconds / 2)
+        for row in range(k_num_modes):
+            ax.fill_between(
+                bin_centers,
+                intermode_vertical * row - half_widths[:, row],
+                intermode_vertical * row + half_widths[:, row],
+                step="mid",
+                color=mobilitains_light_blue,
+                linewidth=0,
+            )
+    else:
+        jitter = vertical_jitter * (np.random.random(len(times)) - 0.5)
+        ax.scatter(
+            as_datetimes(times),
+            intermode_vertical * rows + jitter,
+            s=10,
+            color=mobilitains_light_blue,
+        )
+    ax.set_facecolor(mobilitains_dark_blue)
+
+    # The concise data formatter isn't useful but it's clear.
+    # So this needs work.
+    ax.xaxis.set_major_formatter(
+        mdates.ConciseDateFormatter(ax.xaxis.get_major_locator())
+    )
+    ax.tick_params(axis="x", colors=mobilitains_gray)
+
+    ax.set_xlabel("Temps", color=mobilitains_gray)
+    ax.set_title("Trafic par mode", color=mobilitains_gray)
+
+    ax.set_yticks([])
+    ax.spines["bottom"].set_color(mobilitains_gray)
+    ax.spines["top"].set_visible(False)
+    ax.spines["left"].set_visible(False)
+    ax.spines["right"].set_visible(False)
+
+    fig.set_facecolor(mobilitains_dark_blue)
+    fig.tight_layout(pad=2.0)
+    buf = io.BytesIO()
+    fig.set_size_inches(10, 5)
+    fig.savefig(buf, format="png", dpi=100)
+    plt.close()
+    return buf.getvalue()
+
+
+def draw_fraction(counts: list) -> bytes:
+    """Generate an image of the eco fraction of a Mobilito session.
+
+    The point of this graphic is to visualise the fraction of
+    pedestrian and bicycle traffic compard to car traffic.  It's
+    objective is purely to visualise a fraction, a / b.
+
+    On a web page we'll (eventually) use d3 to render these images, as
+    it's lighter and responsive.  But in email, a PNG works far
+    better, in the sense that d3 won't render in many an email client.
+
+    This needs to be localised to French.  And most of the
+    labels/titles are place holders for now.
+
+    counts are the numbers of pedestrians, bicycles, motor vehicles
+    and public transport vehicles.
+
+    """
+    img_walking, img_bicycle, img_car, img_tc = load_icons()
+
+    init_brand_font()
+    mobilitains_light_blue = (91.0 / 255, 194.0 / 255, 231.0 / 255)
+    mobilitains_dark_blue = (67.0 / 255, 82.0 / 255, 110.0 / 255)
+    mobilitains_gray = (219.0 / 255, 227.0 / 255, 235.0 / 255)
+    mobilitains_red = (250.0 / 255, 70.0 / 255, 22.0 / 255)
+    mobilitains_maroon = (128.0 / 255, 105.0 / 255, 102.0 / 255)
+
+    fig, ax = plt.subplots(figsize=(3, 3), dpi=100)
+
+    pedestrian_count, bicycle_count, motor_vehicle_count, _ = counts
+    modal_values = list(counts)
+    modal_colors = [
+        mobilitains_light_blue,
+        mobilitains_light_blue,
+        mobilitains_red,
+        mobilitains_maroon,
+    ]
+    modal_explosion = [0.01] * 4
+    pie = ax.pie(modal_values, colors=modal_colors, explode=modal_explosion)
+    pie_text = pie[1]
+
+    # Bug: these axes are being positioned in the coordinate system of
+    # the figure rather than relative to the pie axes.
+    walk_icon = fig.add_axes(
+        [
+            pie_text[0].get_position()[0],
+            pie_text[0].get_position()[1],
+            0.05,
+            0.05,
+        ]
+    )
+    walk_icon.set_axis_off()
+    walk_icon.imshow(img_walking, aspect="equal")
+
+    bicycle_icon = fig.add_axes(
+        [
+            pie_text[1].get_position()[0],
+            pie_text[1].get_position()[1],
+            0.05,
+            0.05,
+        ],
+        zorder=10,
+    )
+    bicycle_icon.set_axis_off()
+    bicycle_icon.imshow(img_bicycle, aspect="equal")
+
+    car_icon = fig.add_axes(
+        [
+            pie_text[2].get_position()[0],
+            pie_text[2].get_position()[1],
+            0.05,
+            0.05,
+        ],
+        zorder=-1,
+        transform=ax.transAxes,
+    )
+    car_icon.set_axis_off()
+    car_icon.imshow(img_car, aspect="equal")
+
+    tc_icon = fig.add_axes(
+        [
+            pie_text[3].get_position()[0],
+            pie_text[3].get_position()[1],
+            0.05,
+            0.05,
+        ]
+    )
+    tc_icon.set_axis_off()
+    tc_icon.imshow(img_tc, aspect="equal")
+
+    bike_ped_share = (
+        100.0
+        * (pedestrian_count + bicycle_count)
+        / (pedestrian_count + bicycle_count + motor_vehicle_count)
+    )
+    ax.set_title(
+        f"{bike_ped_share:.0f} % piétons et vélos", color=mobilitains_gray
+    )
+
+    fig.set_facecolor(mobilitains_dark_blue)
+    fig.tight_layout(pad=2.0)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    plt.close()
+    return buf.getvalue()
@@ -2,6 +2,89 @@ $(document).ready(function(){
 
     var last_event = '';
 
+    // Taps are recorded as events in a buffer, which we send to the
+    // server in batches: every k_flush_interval_ms, sooner once
+    // k_flush_size events are waiting, and with the form when the
+    // recording ends.  Each event has a sequence number, so the server
+    // ignores the events of a batch it has already received.  A batch
+    // that doesn't get through stays in the buffer for the next try.
+    // The buffer is also kept in localStorage, so that a reload
+    // doesn't lose it.  We keep it there when the recording ends: if
+    // the form doesn't get through, the next recording page sends it
+    // (cf. flush_earlier_sessions()), and if it did, the server skips
+    // the events it already has.
+    var k_flush_interval_ms = 5000;
+    var k_flush_size = 20;
+    var k_max_batch_size = 500;
+    var form = document.getElementById('recording-form');
+    var session = form.dataset.session;
+    var batch_url = form.dataset.batchUrl;
+    var storage_key = 'mobilito-events-' + session;
+    var stored = load_buffer();
+    var pending = stored.pending;
+    var next_sequence = stored.next_sequence;
+    var flushing = false;
+
+    function load_buffer() {
+        try {
+            var stored = JSON.parse(localStorage.getItem(storage_key));
+            if (stored && Array.isArray(stored.pending)) {
+                return stored;
+            }
+        } catch (e) {
+            // No localStorage, or nothing usable in it.
+        }
+        return {pending: [], next_sequence: 0};
+    }
+
+    function save_buffer() {
+        try {
+            localStorage.setItem(storage_key, JSON.stringify(
+                {pending: pending, next_sequence: next_sequence}));
+        } catch (e) {
+            // We still have the buffer in memory.
+        }
+    }
+
+    function record_event(event_type) {
+        pending.push({
+            sequence: next_sequence,
+            event_type: event_type,
+            timestamp: Date.now(),
+        });
+        next_sequence += 1;
+        save_buffer();
+        if (pending.length >= k_flush_size) {
+            flush();
+        }
+    }
+
+    function flush() {
+        if (flushing || pending.length == 0) {
+            return;
+        }
+        flushing = true;
+        var batch = pending.slice(0, k_max_batch_size);
+        $.ajax({
+            url: batch_url,
+            headers: {"X-CSRFToken": getCookie("csrftoken")},
+            type: 'post',
+            contentType: 'application/json',
+            data: JSON.stringify({session: session, events: batch}),
+            timeout: 10000,
+        }).done(function() {
+            var sent = new Set(batch.map(function(event) {
+                return event.sequence;
+            }));
+            pending = pending.filter(function(event) {
+                return !sent.has(event.sequence);
+            });
+            save_buffer();
+        }).always(function() {
+            flushing = false;
+        });
+    }
+
     function plus_button_click(e) {
         e.preventDefault();
         if (last_event == 'touchend' && e.type == 'click') {
@@ -17,16 +100,7 @@ $(document).ready(function(){
             // Update the value
             $('input[name='+fieldName+']').val(newValue);
             $('span[name='+fieldName+'-counter]').text(newValue);
-            // Send event to server
-            console.log(`Sending event to server`)
-            $.ajax({
-                url: '/mobilito/ajax/create-event/',
-                headers: {"X-CSRFToken": getCookie("csrftoken")},
-                type: 'post',
-                data: {
-                    event_type: fieldName,
-                },
-            });
+            record_event(fieldName);
         } else {
             // Otherwise put a 0 there
             $('input[name='+fieldName+']').val(0);
@@ -40,5 +114,61 @@ $(document).ready(function(){
         element.addEventListener('click', plus_button_click);
         element.addEventListener('touchend', plus_button_click);
     })
-});
 
+    // Send what earlier pages of this browser couldn't.
+    function flush_earlier_sessions() {
+        var keys = [];
+        try {
+            for (var i = 0; i < localStorage.length; i++) {
+                var key = localStorage.key(i);
+                if (key.startsWith('mobilito-events-') && key != storage_key) {
+                    keys.push(key);
+                }
+            }
+        } catch (e) {
+            return;
+        }
+        keys.forEach(function(key) {
+            var events;
+            try {
+                events = (JSON.parse(localStorage.getItem(key)) || {}).pending;
+            } catch (e) {
+                // Unreadable, drop it below.
+            }
+            if (!Array.isArray(events) || events.length == 0) {
+                localStorage.removeItem(key);
+                return;
+            }
+            $.ajax({
+                url: batch_url,
+                headers: {"X-CSRFToken": getCookie("csrftoken")},
+                type: 'post',
+                contentType: 'application/json',
+                data: JSON.stringify({
+                    session: key.substring('mobilito-events-'.length),
+                    events: events.slice(0, k_max_batch_size),
+                }),
+            }).done(function() {
+                var rest = events.slice(k_max_batch_size);
+                if (rest.length == 0) {
+                    localStorage.removeItem(key);
+                } else {
+                    // The rest on the next page load.
+                    localStorage.setItem(key, JSON.stringify({pending: rest}));
+                }
+            }).fail(function(xhr) {
+                // The server will never take these (not a session of
+                // this user, or not events), don't try again.
+                if (xhr.status == 400 || xhr.status == 404) {
+                    localStorage.removeItem(key);
+                }
+            });
+        });
+    }
+
+    flush_earlier_sessions();
+    setInterval(flush, k_flush_interval_ms);
+    form.addEventListener('submit', function() {
+        $('input[name=events]').val(JSON.stringify(pending));
+    });
+});
@@ -0,0 +1,28 @@
+from celery import shared_task
+from celery.signals import worker_process_init
+
+from mobilito import rendering
+from mobilito.charts import render_charts_and_send_results
+from mobilito.models import MobilitoSession
+
+
+@worker_process_init.connect
+def init_chart_rendering(**kwargs):
+    """Load fonts and icons before the first chart, cf. rendering.py."""
+    rendering.init_worker()
+
+
+@shared_task
+def render_mobilito_charts(mobilito_session_id, site_url=None):
+    """Render the charts of a session and maybe send its results.
+
+    Cf. charts.render_charts_and_send_results().
+
+    """
+    mobilito_session = MobilitoSession.objects.filter(
+        pk=mobilito_session_id
+    ).first()
+    if mobilito_session is None:
+        return False
+    render_charts_and_send_results(mobilito_session, site_url)
+    return True
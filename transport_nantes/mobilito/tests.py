@@ -1,8 +1,20 @@
-from datetime import datetime, timezone
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import json
+import random
+import tempfile
+from unittest import mock
+
+import numpy as np
 
 from django.contrib.auth.models import Permission, User
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse, reverse_lazy
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -13,10 +25,22 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 from webdriver_manager.chrome import ChromeDriverManager
 
+from topicblog.models import TopicBlogPanel
+
+from . import charts, rendering, tasks, views
 from .models import Event, InappropriateFlag, MobilitoSession, MobilitoUser
 from .views import TutorialState
 
 
+def use_temporary_media_root(test_case):
+    """Store the files test_case creates in a directory of its own."""
+    media_root = tempfile.TemporaryDirectory()
+    test_case.addCleanup(media_root.cleanup)
+    media_settings = override_settings(MEDIA_ROOT=media_root.name)
+    media_settings.enable()
+    test_case.addCleanup(media_settings.disable)
+
+
 class TutorialStateTests(TestCase):
     def setUp(self):
         self.tutorial_state = TutorialState()
@@ -388,6 +412,573 @@ class SessionHistoryViewTests(TestCase):
         )
 
 
+class EventBatchTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="foo", email="foo@example.com")
+        self.mobilito_user = MobilitoUser.objects.create(user=user)
+        self.start = datetime.now(timezone.utc) - timedelta(minutes=10)
+        self.mobilito_session = MobilitoSession.objects.create(
+            user=self.mobilito_user, start_timestamp=self.start
+        )
+        self.client.force_login(user)
+        session = self.client.session
+        session["mobilito_session_id"] = self.mobilito_session.id
+        session.save()
+        self.url = reverse("mobilito:batch_event_creation")
+
+    def make_events(self, first, count):
+        buttons = ["pedestrian", "bicycle", "motor-vehicle", "TC"]
+        return [
+            {
+                "sequence": n,
+                "event_type": buttons[n % 4],
+                "timestamp": (self.start.timestamp() + n) * 1000,
+            }
+            for n in range(first, first + count)
+        ]
+
+    def post(self, events, **payload):
+        payload["events"] = events
+        return self.client.post(
+            self.url, json.dumps(payload), content_type="application/json"
+        )
+
+    def test_batch_is_stored_once(self):
+        events = self.make_events(0, 8)
+        response = self.post(events)
+        self.assertEqual(
+            response.json(), {"created": 8, "duplicates": 0, "rejected": 0}
+        )
+        # A retry, overlapping with new events.
+        response = self.post(events[4:] + self.make_events(8, 2))
+        self.assertEqual(
+            response.json(), {"created": 2, "duplicates": 4, "rejected": 0}
+        )
+        stored = Event.objects.filter(
+            mobilito_session=self.mobilito_session
+        ).order_by("sequence_number")
+        self.assertEqual(
+            [event.sequence_number for event in stored], list(range(10))
+        )
+        self.assertEqual(
+            [event.event_type for event in stored[:4]],
+            ["ped", "bike", "car", "TC"],
+        )
+        self.assertEqual(
+            stored[3].client_timestamp, self.start + timedelta(seconds=3)
+        )
+
+    def test_constant_queries_per_batch(self):
+        self.post(self.make_events(0, 5))
+        with CaptureQueriesContext(connection) as small_batch:
+            self.post(self.make_events(5, 5))
+        # Small enough for one INSERT even on sqlite.
+        with CaptureQueriesContext(connection) as large_batch:
+            self.post(self.make_events(10, 150))
+        self.assertEqual(len(large_batch), len(small_batch))
+        self.assertEqual(Event.objects.count(), 160)
+
+    def test_invalid_events_are_rejected(self):
+        events = self.make_events(0, 2) + [
+            {"sequence": 2, "event_type": "unicorn"},
+            {"event_type": "pedestrian"},
+            {"sequence": -1, "event_type": "pedestrian"},
+            {"sequence": 3, "event_type": "bicycle", "timestamp": "soon"},
+            {"sequence": 4, "event_type": "bicycle", "timestamp": 0},
+        ]
+        response = self.post(
+            events, session=self.mobilito_session.session_sha1
+        )
+        self.assertEqual(
+            response.json(), {"created": 4, "duplicates": 0, "rejected": 3}
+        )
+        # Implausible client times are dropped, not the events.
+        self.assertEqual(
+            Event.objects.filter(client_timestamp__isnull=True).count(), 2
+        )
+        self.assertEqual(self.post("nope").status_code, 400)
+        self.assertEqual(self.post(self.make_events(0, 501)).status_code, 400)
+        self.assertEqual(self.post([], session="unknown").status_code, 404)
+
+    def test_single_event_endpoint(self):
+        response = self.client.post(
+            reverse("mobilito:event_creation"), {"event_type": "bicycle"}
+        )
+        self.assertEqual(response.status_code, 200)
+        event = Event.objects.get()
+        self.assertEqual(event.event_type, "bike")
+        self.assertIsNone(event.sequence_number)
+
+
+class FlakyRecordingClient:
+    """Record a session as the recording page does, over a bad network.
+
+    Taps go to a buffer that we flush in batches to the batch endpoint.
+    A flush may be lost on the way to the server (nothing is stored) or
+    on the way back (the events are stored, but we don't know it and
+    send them again).  Ending the recording posts the form with the
+    events still in the buffer.
+
+    """
+
+    k_buttons = ["pedestrian", "bicycle", "motor-vehicle", "public-transport"]
+
+    def __init__(self, client, mobilito_session, rng, loss_rate=0.3):
+        self.client = client
+        self.mobilito_session = mobilito_session
+        self.rng = rng
+        self.loss_rate = loss_rate
+        self.pending = []
+        self.next_sequence = 0
+        self.counts = Counter()
+        self.time = mobilito_session.start_timestamp.timestamp()
+
+    def tap(self, button):
+        self.time += self.rng.random()
+        self.pending.append(
+            {
+                "sequence": self.next_sequence,
+                "event_type": button,
+                "timestamp": self.time * 1000,
+            }
+        )
+        self.next_sequence += 1
+        self.counts[button] += 1
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch = self.pending[:500]
+        if self.rng.random() < self.loss_rate:
+            return
+        response = self.client.post(
+            reverse("mobilito:batch_event_creation"),
+            json.dumps(
+                {
+                    "session": self.mobilito_session.session_sha1,
+                    "events": batch,
+                }
+            ),
+            content_type="application/json",
+        )
+        if response.status_code != 200:
+            return
+        if self.rng.random() < self.loss_rate:
+            return
+        sent = {event["sequence"] for event in batch}
+        self.pending = [
+            event for event in self.pending if event["sequence"] not in sent
+        ]
+
+    def record(self, num_taps, flush_every=7):
+        for n in range(num_taps):
+            self.tap(self.rng.choice(self.k_buttons))
+            if n % flush_every == 0:
+                self.flush()
+
+    def end(self):
+        return self.client.post(
+            reverse("mobilito:recording"),
+            {
+                "session": self.mobilito_session.session_sha1,
+                "pedestrian": self.counts["pedestrian"],
+                "bicycle": self.counts["bicycle"],
+                "motor-vehicle": self.counts["motor-vehicle"],
+                "public-transport": self.counts["public-transport"],
+                "events": json.dumps(self.pending),
+            },
+        )
+
+
+class OfflineRecordingTests(TestCase):
+    def setUp(self):
+        use_temporary_media_root(self)
+        user = User.objects.create(username="foo", email="foo@example.com")
+        self.mobilito_session = MobilitoSession.objects.create(
+            user=MobilitoUser.objects.create(user=user),
+            start_timestamp=datetime.now(timezone.utc) - timedelta(hours=1),
+        )
+        self.client.force_login(user)
+        session = self.client.session
+        session["mobilito_session_id"] = self.mobilito_session.id
+        session.save()
+
+    def test_flaky_client_counts_match_events(self):
+        for seed in range(5):
+            Event.objects.all().delete()
+            client = FlakyRecordingClient(
+                self.client, self.mobilito_session, random.Random(seed)
+            )
+            client.record(300)
+            response = client.end()
+            self.assertEqual(response.status_code, 302)
+
+            self.mobilito_session.refresh_from_db()
+            self.assertIsNotNone(self.mobilito_session.end_timestamp)
+            self.assertEqual(
+                (
+                    self.mobilito_session.pedestrian_count,
+                    self.mobilito_session.bicycle_count,
+                    self.mobilito_session.motor_vehicle_count,
+                    self.mobilito_session.public_transport_count,
+                ),
+                (
+                    client.counts["pedestrian"],
+                    client.counts["bicycle"],
+                    client.counts["motor-vehicle"],
+                    client.counts["public-transport"],
+                ),
+            )
+            self.assertEqual(
+                sorted(
+                    Event.objects.filter(
+                        mobilito_session=self.mobilito_session
+                    ).values_list("sequence_number", flat=True)
+                ),
+                list(range(300)),
+            )
+
+    def test_counts_follow_stored_events(self):
+        client = FlakyRecordingClient(
+            self.client, self.mobilito_session, random.Random(0), loss_rate=0
+        )
+        client.record(10, flush_every=1)
+        # The page says one more pedestrian than it sent.
+        client.counts["pedestrian"] += 1
+        with self.assertLogs("django", level="WARNING"):
+            client.end()
+        self.mobilito_session.refresh_from_db()
+        self.assertEqual(
+            self.mobilito_session.pedestrian_count,
+            Event.objects.filter(
+                event_type=Event.EventTypes.PEDESTRIAN
+            ).count(),
+        )
+
+    def test_form_ends_its_own_session(self):
+        client = FlakyRecordingClient(
+            self.client, self.mobilito_session, random.Random(0), loss_rate=0
+        )
+        client.record(10)
+        # A second recording tab starts another session.
+        other_session = MobilitoSession.objects.create(
+            user=self.mobilito_session.user,
+            start_timestamp=datetime.now(timezone.utc),
+        )
+        session = self.client.session
+        session["mobilito_session_id"] = other_session.id
+        session.save()
+        response = client.end()
+        self.assertRedirects(
+            response,
+            self.mobilito_session.get_absolute_url(),
+            fetch_redirect_response=False,
+        )
+        self.mobilito_session.refresh_from_db()
+        other_session.refresh_from_db()
+        self.assertIsNotNone(self.mobilito_session.end_timestamp)
+        self.assertIsNone(other_session.end_timestamp)
+        self.assertEqual(
+            Event.objects.filter(
+                mobilito_session=self.mobilito_session
+            ).count(),
+            10,
+        )
+
+    def test_late_events_are_counted(self):
+        client = FlakyRecordingClient(
+            self.client, self.mobilito_session, random.Random(0), loss_rate=0
+        )
+        client.record(10, flush_every=100)
+        # The form doesn't bring the last events, the page sends them
+        # after the recording ended.
+        late_events, client.pending = client.pending, []
+        with self.assertLogs("django", level="WARNING"):
+            client.end()
+        client.pending = late_events
+        client.flush()
+        self.mobilito_session.refresh_from_db()
+        self.assertEqual(
+            self.mobilito_session.pedestrian_count,
+            client.counts["pedestrian"],
+        )
+
+
+class ChartTests(TestCase):
+    def setUp(self):
+        use_temporary_media_root(self)
+        user = User.objects.create(username="foo", email="foo@example.com")
+        now = datetime.now(timezone.utc)
+        self.mobilito_session = MobilitoSession.objects.create(
+            user=MobilitoUser.objects.create(user=user),
+            start_timestamp=now - timedelta(hours=1),
+            end_timestamp=now,
+        )
+        self.mobilito_session.add_events(
+            [
+                (n, event_type, now - timedelta(minutes=n))
+                for n, event_type in enumerate(Event.EventTypes.values * 3)
+            ]
+        )
+        self.mobilito_session.reconcile_counts()
+        self.mobilito_session.save()
+        self.client.force_login(user)
+        # The results email shows a panel.
+        TopicBlogPanel.objects.create(
+            slug="panel",
+            user=user,
+            template_name="topicblog/panel_did_you_know_tip_1.html",
+            publication_date=now,
+        )
+        self.renderers = {
+            chart_name: mock.Mock(wraps=renderer)
+            for chart_name, renderer in charts.k_chart_renderers.items()
+        }
+        renderers_patch = mock.patch.dict(
+            charts.k_chart_renderers, self.renderers
+        )
+        renderers_patch.start()
+        self.addCleanup(renderers_patch.stop)
+
+    def chart_url(self, chart_name):
+        return reverse(
+            f"mobilito:mobilito_session_{chart_name}_image",
+            args=[self.mobilito_session.session_sha1],
+        )
+
+    def test_chart_is_rendered_once(self):
+        for chart_name in ["timeseries", "fraction"]:
+            response = self.client.get(self.chart_url(chart_name))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "image/png")
+            self.assertTrue(response.content.startswith(b"\x89PNG"))
+            self.assertIn("max-age", response["Cache-Control"])
+            etag = response["ETag"]
+
+            again = self.client.get(self.chart_url(chart_name))
+            self.assertEqual(again.content, response.content)
+            self.assertEqual(again["ETag"], etag)
+            self.assertEqual(self.renderers[chart_name].call_count, 1)
+
+            not_modified = self.client.get(
+                self.chart_url(chart_name), HTTP_IF_NONE_MATCH=etag
+            )
+            self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(
+            len(charts.session_chart_files(self.mobilito_session)), 2
+        )
+
+    def test_new_events_change_the_chart(self):
+        etag = self.client.get(self.chart_url("timeseries"))["ETag"]
+        self.mobilito_session.add_events(
+            [(100, Event.EventTypes.BICYCLE, datetime.now(timezone.utc))]
+        )
+        response = self.client.get(
+            self.chart_url("timeseries"), HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(self.renderers["timeseries"].call_count, 2)
+        # The stale chart was replaced.
+        self.assertEqual(
+            len(charts.session_chart_files(self.mobilito_session)), 1
+        )
+
+    def test_session_in_progress_is_not_cached(self):
+        self.mobilito_session.end_timestamp = None
+        self.mobilito_session.save()
+        for _ in range(2):
+            response = self.client.get(self.chart_url("fraction"))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("no-cache", response["Cache-Control"])
+        self.assertEqual(self.renderers["fraction"].call_count, 1)
+        self.mobilito_session.add_events(
+            [(100, Event.EventTypes.BICYCLE, datetime.now(timezone.utc))]
+        )
+        self.mobilito_session.reconcile_counts()
+        self.mobilito_session.save()
+        self.client.get(self.chart_url("fraction"))
+        self.assertEqual(self.renderers["fraction"].call_count, 2)
+        # The stale chart was replaced.
+        self.assertEqual(
+            len(charts.session_chart_files(self.mobilito_session)), 1
+        )
+
+    def end_recording(self):
+        session = self.client.session
+        session["mobilito_session_id"] = self.mobilito_session.id
+        session.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("mobilito:recording"),
+                {
+                    "session": self.mobilito_session.session_sha1,
+                    "pedestrian": 3,
+                    "bicycle": 3,
+                    "motor-vehicle": 3,
+                    "public-transport": 3,
+                },
+            )
+
+    @override_settings(MOBILITO_CHARTS_IN_BACKGROUND=True)
+    def test_charts_are_rendered_in_background(self):
+        with mock.patch(
+            "mobilito.tasks.render_mobilito_charts.delay"
+        ) as delay:
+            self.end_recording()
+        delay.assert_called_once_with(
+            self.mobilito_session.pk, "http://testserver/"
+        )
+        self.assertEqual(self.renderers["timeseries"].call_count, 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+        # The celery worker sends the results once the charts are stored.
+        def send_results(request, mobilito_session):
+            self.assertEqual(
+                len(charts.session_chart_files(mobilito_session)), 2
+            )
+            real_send_results(request, mobilito_session)
+
+        real_send_results = views.send_results
+        with mock.patch.object(views, "send_results", send_results):
+            self.assertTrue(
+                tasks.render_mobilito_charts(*delay.call_args.args)
+            )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["foo@example.com"])
+        self.assertIn(
+            f"http://testserver{self.chart_url('timeseries')}",
+            mail.outbox[0].alternatives[0][0],
+        )
+
+    @override_settings(MOBILITO_CHARTS_IN_BACKGROUND=True)
+    def test_missing_chart_is_drawn_by_celery(self):
+        self.addCleanup(cache.clear)
+        with mock.patch(
+            "mobilito.tasks.render_mobilito_charts.delay",
+            side_effect=tasks.render_mobilito_charts,
+        ) as delay:
+            response = self.client.get(self.chart_url("fraction"))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.content.startswith(b"\x89PNG"))
+            # The worker drew both charts.
+            response = self.client.get(self.chart_url("timeseries"))
+            self.assertEqual(response.status_code, 200)
+        delay.assert_called_once_with(self.mobilito_session.pk, None)
+        self.assertEqual(self.renderers["fraction"].call_count, 1)
+        self.assertEqual(self.renderers["timeseries"].call_count, 1)
+
+    @override_settings(
+        MOBILITO_CHARTS_IN_BACKGROUND=True, MOBILITO_CHART_WAIT_SECONDS=0
+    )
+    def test_chart_is_drawn_here_if_celery_is_slow(self):
+        self.addCleanup(cache.clear)
+        with mock.patch(
+            "mobilito.tasks.render_mobilito_charts.delay"
+        ) as delay:
+            for _ in range(2):
+                response = self.client.get(self.chart_url("fraction"))
+                self.assertEqual(response.status_code, 200)
+        # Queued once, drawn here once.
+        delay.assert_called_once_with(self.mobilito_session.pk, None)
+        self.assertEqual(self.renderers["fraction"].call_count, 1)
+
+    @override_settings(MOBILITO_CHARTS_IN_BACKGROUND=True)
+    def test_chart_is_drawn_here_without_broker(self):
+        self.addCleanup(cache.clear)
+        with mock.patch(
+            "mobilito.tasks.render_mobilito_charts.delay",
+            side_effect=ConnectionError("No broker"),
+        ):
+            response = self.client.get(self.chart_url("fraction"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.renderers["fraction"].call_count, 1)
+
+    def test_concurrent_renders_store_one_file(self):
+        fingerprint = charts.chart_fingerprint(self.mobilito_session)
+        file_name = charts.chart_file_name(
+            self.mobilito_session, "fraction", fingerprint
+        )
+        stale_file_name = charts.chart_file_name(
+            self.mobilito_session, "fraction", "stale"
+        )
+        charts.store_chart(
+            self.mobilito_session, "fraction", stale_file_name, b"old"
+        )
+        for png in [b"first", b"second"]:
+            charts.store_chart(
+                self.mobilito_session, "fraction", file_name, png
+            )
+        self.assertEqual(
+            charts.session_chart_files(self.mobilito_session), [file_name]
+        )
+        with default_storage.open(file_name, "rb") as chart_file:
+            self.assertEqual(chart_file.read(), b"first")
+
+    def test_charts_are_rendered_at_end_and_forgotten_on_edit(self):
+        self.end_recording()
+        chart_files = charts.session_chart_files(self.mobilito_session)
+        self.assertEqual(len(chart_files), 2)
+        self.assertEqual(len(mail.outbox), 1)
+        for chart_name in ["timeseries", "fraction"]:
+            self.client.get(self.chart_url(chart_name))
+            self.assertEqual(self.renderers[chart_name].call_count, 1)
+
+        self.client.post(
+            reverse(
+                "mobilito:edit_location",
+                args=[self.mobilito_session.session_sha1],
+            ),
+            {"location": "Ailleurs"},
+        )
+        self.assertEqual(charts.session_chart_files(self.mobilito_session), [])
+        for file_name in chart_files:
+            self.assertFalse(default_storage.exists(file_name))
+
+    def test_timeseries_data(self):
+        start = self.mobilito_session.start_timestamp
+        Event.objects.all().delete()
+        self.mobilito_session.add_events(
+            [
+                (0, Event.EventTypes.PUBLIC_TRANSPORT, start),
+                (1, Event.EventTypes.PEDESTRIAN, start + timedelta(seconds=1)),
+            ]
+        )
+        # An event sent alone has no client timestamp.
+        received = Event.objects.create(
+            mobilito_session=self.mobilito_session,
+            event_type=Event.EventTypes.MOTOR_VEHICLE,
+        )
+        times, rows = charts.timeseries_data(self.mobilito_session)
+        self.assertEqual(
+            sorted(zip(times.tolist(), rows.tolist())),
+            [
+                (start.timestamp(), 3),
+                (start.timestamp() + 1, 0),
+                (received.timestamp.timestamp(), 2),
+            ],
+        )
+
+    def test_bin_events(self):
+        times = np.array([0.0, 10, 59, 61, 200]) + 60_000
+        rows = np.array([0, 0, 1, 3, 1])
+        bin_starts, counts = rendering.bin_events(times, rows, 60)
+        self.assertEqual(bin_starts.tolist(), [60_000, 60_060, 60_120, 60_180])
+        self.assertEqual(
+            counts.tolist(),
+            [[2, 1, 0, 0], [0, 0, 0, 1], [0, 0, 0, 0], [0, 1, 0, 0]],
+        )
+
+    @override_settings(MOBILITO_TIMESERIES_DENSITY_THRESHOLD=5)
+    def test_long_session_is_drawn_per_minute(self):
+        with mock.patch.object(
+            rendering, "draw_timeseries", wraps=rendering.draw_timeseries
+        ) as draw_timeseries:
+            response = self.client.get(self.chart_url("timeseries"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(draw_timeseries.call_args.args[3], 60)
+
+
 class MobilitoFlagSessionSeleniumTests(StaticLiveServerTestCase):
     """Test the flag session page using Selenium."""
 
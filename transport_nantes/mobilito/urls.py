@@ -43,6 +43,11 @@ urlpatterns = [
         name="mobilito_session_fraction_image",
     ),
     path("ajax/create-event/", views.create_event, name="event_creation"),
+    path(
+        "ajax/create-events/",
+        views.create_events,
+        name="batch_event_creation",
+    ),
     path(
         "ajax/get-address/",
         views.ReverseGeocodingView.as_view(),
@@ -1,20 +1,12 @@
 """Mobilito view functions."""
 
-import io
 import json
 import logging
 import pickle
-import random
 from base64 import b64decode, b64encode
 from datetime import datetime, timedelta, timezone
 from typing import Union
 
-import matplotlib
-import matplotlib.dates as mdates
-import matplotlib.font_manager as font_manager
-import matplotlib.image as mpimg
-import matplotlib.pyplot as plt
-import matplotlib.text
 import requests
 from authentication.views import create_send_record
 from django.conf import settings
@@ -22,6 +14,7 @@ from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
 from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
 from django.db.models import Q
 from django.http import (
     Http404,
@@ -38,7 +31,10 @@ from django.views import View
 from django.views.decorators.csrf import csrf_protect
 from django.views.generic import TemplateView, ListView
 from django.views.generic.edit import FormView, UpdateView
+from asso_tn.middleware.sessionCookie import get_tn_session
+from asso_tn.user_agent import request_user_agent
 from asso_tn.utils import make_timed_token, token_valid
+from mobilito.charts import chart_response, delete_charts, queue_charts
 from mobilito.forms import AddressForm, LocationEditForm
 from mobilito.models import (
     Event,
@@ -48,13 +44,11 @@ from mobilito.models import (
 )
 from topicblog.models import SendRecordTransactionalAdHoc, get_random_panel
 from topicblog.views import k_render_as_email
-from user_agents import parse
 
 from transport_nantes.settings import MAPS_API_KEY
 
 logger = logging.getLogger("django")
 gcp_logger = logging.getLogger("gcp")
-matplotlib.use("Agg")
 
 
 class TutorialState:
@@ -298,17 +292,18 @@ class RecordingView(LoginRequiredMixin, TemplateView):
         location = self.request.session.get("location")
         latitude = self.request.session.get("latitude")
         longitude = self.request.session.get("longitude")
-        user_agent = parse(self.request.META.get("HTTP_USER_AGENT"))
+        user_agent = request_user_agent(self.request)
         user = MobilitoUser.objects.get_or_create(user=self.request.user)[0]
         mobilito_session = MobilitoSession.objects.create(
             user=user,
             location=location,
             latitude=latitude,
             longitude=longitude,
-            user_browser=str(user_agent),
+            user_browser=user_agent.summary,
             start_timestamp=datetime.now(timezone.utc),
         )
         self.request.session["mobilito_session_id"] = mobilito_session.id
+        context["mobilito_session"] = mobilito_session
         logger.info(
             f"{self.request.user.email} started "
             "mobilito_session {mobilito_session.id}"
@@ -334,24 +329,64 @@ class RecordingView(LoginRequiredMixin, TemplateView):
         number_of_bicycles = request.POST.get("bicycle")
         number_of_cars = request.POST.get("motor-vehicle")
         number_of_public_transports = request.POST.get("public-transport")
-        # Update of associated mobilito_session
+        # Update of associated mobilito_session.  The page says which
+        # session it recorded (the one its batches went to): with a
+        # second recording tab, the django session points to another.
+        session_sha1 = request.POST.get("session")
         try:
-            mobilito_session: MobilitoSession = MobilitoSession.objects.get(
-                id=request.session.get("mobilito_session_id")
-            )
+            if session_sha1:
+                mobilito_session = MobilitoSession.objects.get(
+                    session_sha1=session_sha1, user__user=request.user
+                )
+            else:
+                mobilito_session = MobilitoSession.objects.get(
+                    id=request.session.get("mobilito_session_id")
+                )
+            mobilito_session: MobilitoSession
             mobilito_session.end_timestamp = now
-            mobilito_session.pedestrian_count = number_of_pedestrians
-            mobilito_session.bicycle_count = number_of_bicycles
-            mobilito_session.motor_vehicle_count = number_of_cars
-            mobilito_session.public_transport_count = (
-                number_of_public_transports
+            # The events the page couldn't send yet come with the form.
+            # The counts are those of the events we have, which the
+            # form's counts should match.
+            try:
+                pending_events = json.loads(request.POST.get("events") or "[]")
+                if not isinstance(pending_events, list):
+                    raise TypeError("events is not a list")
+            except (ValueError, TypeError) as e:
+                logger.error(
+                    f"Invalid pending events for mobilito_session "
+                    f"{mobilito_session.session_sha1}: {e}"
+                )
+                pending_events = []
+            mobilito_session.add_events(
+                validate_events(pending_events, mobilito_session)
             )
+            counts = mobilito_session.reconcile_counts()
+            form_counts = {
+                "pedestrian_count": number_of_pedestrians,
+                "bicycle_count": number_of_bicycles,
+                "motor_vehicle_count": number_of_cars,
+                "public_transport_count": number_of_public_transports,
+            }
+            if any(
+                str(count) != str(form_counts[field_name])
+                for field_name, count in counts.items()
+            ):
+                logger.warning(
+                    f"mobilito_session {mobilito_session.session_sha1} "
+                    f"has events {counts}, the page counted {form_counts}"
+                )
             mobilito_session.create_png_from_coordinates()
             mobilito_session.save()
-            send_results(request, mobilito_session)
+            # The results email shows the charts, so it is sent once
+            # they are stored.
+            site_url = request.build_absolute_uri("/")
+            transaction.on_commit(
+                lambda: queue_charts(mobilito_session, site_url)
+            )
         except MobilitoSession.DoesNotExist as e:
             logger.error(
                 f"Can't update a non-existing mobilito_session, "
+                f"session_sha1={session_sha1}, "
                 f"id={request.session.get('mobilito_session_id', '')}, "
                 f"user={request.user.email}, {e}"
             )
@@ -389,19 +424,30 @@ def get_mobilito_session(request: HttpRequest) -> Union[MobilitoSession, None]:
     return mobilito_session
 
 
+# The names of the recording buttons, as the client sends them.
+k_button_event_types = {
+    "pedestrian": Event.EventTypes.PEDESTRIAN,
+    "bicycle": Event.EventTypes.BICYCLE,
+    "motor-vehicle": Event.EventTypes.MOTOR_VEHICLE,
+    "public-transport": Event.EventTypes.PUBLIC_TRANSPORT,
+}
+# The most events we accept in one batch.
+k_max_events_per_batch = 500
+# How far outside the session we trust client clocks to be.
+k_client_clock_slack = timedelta(minutes=5)
+
+
+def event_type_from_button(name: str) -> str:
+    """Return the event type for a button name (or an event type)."""
+    name = str(name)
+    return k_button_event_types.get(name.lower(), name)
+
+
 def create_event(request: HttpRequest) -> HttpResponse:
     """Create a Mobilito event from a POST request."""
     if request.method == "POST":
         mobilito_session = get_mobilito_session(request)
-        event_type = request.POST.get("event_type").lower()
-        if event_type == "pedestrian":
-            event_type = "ped"
-        elif event_type == "bicycle":
-            event_type = "bike"
-        elif event_type == "motor-vehicle":
-            event_type = "car"
-        elif event_type == "public-transport":
-            event_type = "TC"
+        event_type = event_type_from_button(request.POST.get("event_type"))
         if mobilito_session:
             mobilito_session.create_event(event_type)
             return HttpResponse(status=200)
@@ -417,25 +463,142 @@ def create_event(request: HttpRequest) -> HttpResponse:
         return HttpResponse(status=403)
 
 
+def parse_client_timestamp(
+    value, mobilito_session: MobilitoSession, now: datetime
+) -> Union[datetime, None]:
+    """Return the time of a client event, given in ms since the epoch.
+
+    Return None if the value is missing or implausible for the session.
+
+    """
+    try:
+        timestamp = datetime.fromtimestamp(float(value) / 1000, timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    earliest = mobilito_session.start_timestamp - k_client_clock_slack
+    if not earliest <= timestamp <= now + k_client_clock_slack:
+        return None
+    return timestamp
+
+
+def validate_events(events: list, mobilito_session: MobilitoSession) -> list:
+    """Validate client events for MobilitoSession.add_events().
+
+    events is a list of dicts as the client sends them (cf.
+    create_events()).  Return the valid ones as (sequence number,
+    event type, client timestamp); invalid events are dropped.
+
+    """
+    now = datetime.now(timezone.utc)
+    valid_events = []
+    for event in events:
+        try:
+            sequence_number = int(event["sequence"])
+            event_type = event_type_from_button(event["event_type"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if (
+            not 0 <= sequence_number < 2**31
+            or event_type not in Event.EventTypes.values
+        ):
+            continue
+        valid_events.append(
+            (
+                sequence_number,
+                event_type,
+                parse_client_timestamp(
+                    event.get("timestamp"), mobilito_session, now
+                ),
+            )
+        )
+    return valid_events
+
+
+def create_events(request: HttpRequest) -> HttpResponse:
+    """Create a batch of Mobilito events from a JSON POST request.
+
+    The body is {"session": session_sha1, "events": [{"sequence": n,
+    "event_type": t, "timestamp": ms}, ...]}, where session defaults to
+    the recording session in the user's django session, event_type is
+    an event type or a recording button name, and timestamp is when
+    the button was pressed on the client.
+
+    Clients resend a batch until we acknowledge it, so events whose
+    sequence number we already have are skipped.  Invalid events are
+    acknowledged and dropped.  We answer with the number of events
+    stored, skipped and rejected.
+
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    if not request.user.is_authenticated:
+        return HttpResponse(status=403)
+    try:
+        payload = json.loads(request.body)
+        events = payload["events"]
+        if not isinstance(events, list):
+            raise TypeError("events is not a list")
+    except (ValueError, KeyError, TypeError) as e:
+        logger.info(f"{request.user.email} sent an invalid batch: {e}")
+        return JsonResponse({"error": "invalid batch"}, status=400)
+    if len(events) > k_max_events_per_batch:
+        return JsonResponse({"error": "batch too large"}, status=400)
+
+    if payload.get("session"):
+        mobilito_session = MobilitoSession.objects.filter(
+            session_sha1=payload["session"], user__user=request.user
+        ).first()
+    else:
+        mobilito_session = get_mobilito_session(request)
+    if mobilito_session is None:
+        logger.error(
+            f"{request.user.email} tried to create events in a "
+            "non-existing mobilito_session"
+        )
+        return JsonResponse({"error": "no such session"}, status=404)
+
+    valid_events = validate_events(events, mobilito_session)
+    num_created = mobilito_session.add_events(valid_events)
+    if num_created and mobilito_session.end_timestamp is not None:
+        # Events that the page couldn't send before the recording
+        # ended.  Not save(), which would fetch a map.
+        MobilitoSession.objects.filter(pk=mobilito_session.pk).update(
+            **mobilito_session.reconcile_counts()
+        )
+    return JsonResponse(
+        {
+            "created": num_created,
+            "duplicates": len(valid_events) - num_created,
+            "rejected": len(events) - len(valid_events),
+        }
+    )
+
+
 def send_results(
     request: HttpRequest, mobilito_session: MobilitoSession
 ) -> None:
-    """Send mobilito_session's results by email to user."""
-    logger.info("Sending mobilito_session results to %s", request.user.email)
+    """Send mobilito_session's results by email to its user.
+
+    request needn't be the user's: the results are sent in the
+    background, cf. charts.queue_charts().
+
+    """
+    email = mobilito_session.user.user.email
+    logger.info("Sending mobilito_session results to %s", email)
     try:
         logger.info("MobilitoSession id : %s", mobilito_session.id)
         logger.info("Creating send record ...")
-        send_record = create_send_record(request.user.email)
+        send_record = create_send_record(email)
         custom_email = prepare_email(request, mobilito_session, send_record)
-        logger.info("Sending email to %s", request.user.email)
+        logger.info("Sending email to %s", email)
         custom_email.send(fail_silently=False)
-        logger.info("Email sent to %s", request.user.email)
+        logger.info("Email sent to %s", email)
         send_record.handoff_time = datetime.now(timezone.utc)
         send_record.save()
     except Exception as err:
         # We don't really know that this is why we are here.
         # We've caught a generic exception.
-        logger.error("Error sending email to %s: %s", request.user.email, err)
+        logger.error("Error sending email to %s: %s", email, err)
         send_record.status = "FAILED"
         send_record.save()
 
@@ -525,7 +688,7 @@ class MobilitoSessionSummaryView(TemplateView):
         user = (
             self.request.user if self.request.user.is_authenticated else None
         )
-        reporter_tn_session_id = self.request.session.get("tn_session")
+        reporter_tn_session_id = get_tn_session(self.request)
 
         user_has_reported_this_session = InappropriateFlag.objects.filter(
             Q(reporter_user=user)
@@ -571,262 +734,28 @@ class MobilitoSessionSummaryView(TemplateView):
         return self.render_to_response(context)
 
 
-fonts_inited = False
-
-
-def init_brand_font():
-    """Initialise our brand font.
-
-    This function may be a bit of a hack.
-
-    """
-    global fonts_inited
-    if not fonts_inited:
-        logger.info("Initing fonts.")
-        fontdir = "open_graph/base_images/Montserrat/"
-        font_manager.findSystemFonts(fontdir)
-        for font in font_manager.findSystemFonts(fontdir):
-            font_manager.fontManager.addfont(font)
-        matplotlib.rcParams["font.family"] = "Montserrat"
-        fonts_inited = True
-
-
 def mobilito_session_timeseries_image(request, session_sha1):
-    """Generate a time series visualisation of a Mobilito session.
-
-    The point of this graphic is to visualise the time evolution of
-    traffic in the four modes we measure, giving an idea of density
-    over time of each mode.
+    """Serve the time series chart of a Mobilito session.
 
-    On a web page we'll (eventually) use d3 to render these images, as
-    it's lighter and responsive.  But in email, a PNG works far
-    better, in the sense that d3 won't render in many an email client.
-
-    This needs to be localised to French.  And most of the
-    labels/titles are place holders for now.
+    Cf. charts.render_timeseries().
 
     """
     mobilito_session = get_object_or_404(
         MobilitoSession, session_sha1=session_sha1
     )
-    events = Event.objects.filter(mobilito_session=mobilito_session)
-    scatter_map = {
-        Event.EventTypes.PEDESTRIAN: 0,
-        Event.EventTypes.BICYCLE: 1,
-        Event.EventTypes.MOTOR_VEHICLE: 2,
-        Event.EventTypes.PUBLIC_TRANSPORT: 3,
-    }
-
-    init_brand_font()
-    mobilitains_light_blue = (91.0 / 255, 194.0 / 255, 231.0 / 255)
-    mobilitains_dark_blue = (67.0 / 255, 82.0 / 255, 110.0 / 255)
-    mobilitains_gray = (219.0 / 255, 227.0 / 255, 235.0 / 255)
-    # mobilitains_red = (250./255, 70./255, 22./255)
-    # mobilitains_maroon = (128./255, 105./255, 102./255)
-
-    icon_path = "mobilito/static/mobilito/images"
-    img_walking = mpimg.imread(f"{icon_path}/ped-icon-small.png")
-    img_bicycle = mpimg.imread(f"{icon_path}/bike-icon-small.png")
-    img_car = mpimg.imread(f"{icon_path}/car-icon-small.png")
-    img_tc = mpimg.imread(f"{icon_path}/tc-icon-small.png")
-    intermode_vertical = 1
-    vertical_jitter = 0.3
-    event_timestamps = [an_event.timestamp for an_event in events]
-    min_timestamp = min(event_timestamps)
-    # Plot four invisible points on the center lines in order to make
-    # the plot register correctly, even if some modes have no data.
-    x_scatter_points = [min_timestamp] * 4 + event_timestamps
-    y_scatter_points = [0, 1, 2, 3] + [
-        intermode_vertical * scatter_map[an_event.event_type]
-        + vertical_jitter * (random.random() - 0.5)
-        for an_event in events
-    ]
-    point_colors = [mobilitains_dark_blue] * 4 + [
-        mobilitains_light_blue
-    ] * len(events)
-
-    fig, ax = plt.subplots(figsize=(8, 5), dpi=100)
-
-    # Place a new axes for each image where we want the image.
-    # (x, y, width, height).
-    # Then remove ticks and box before rendering.
-    horizontal_offset = 0.02
-    base_height = 0.17
-    incr_height = 0.21
-
-    walk_icon = fig.add_axes(
-        [horizontal_offset, base_height + 0 * incr_height, 0.05, 0.05]
-    )
-    walk_icon.set_axis_off()
-    walk_icon.imshow(img_walking, aspect="equal")
-
-    bicycle_icon = fig.add_axes(
-        [horizontal_offset, base_height + 1 * incr_height, 0.05, 0.05]
-    )
-    bicycle_icon.set_axis_off()
-    bicycle_icon.imshow(img_bicycle, aspect="equal")
-
-    car_icon = fig.add_axes(
-        [horizontal_offset, base_height + 2 * incr_height, 0.05, 0.05]
-    )
-    car_icon.set_axis_off()
-    car_icon.imshow(img_car, aspect="equal")
-
-    tc_icon = fig.add_axes(
-        [horizontal_offset, base_height + 3 * incr_height, 0.05, 0.05]
-    )
-    tc_icon.set_axis_off()
-    tc_icon.imshow(img_tc, aspect="equal")
-
-    ax.scatter(x_scatter_points, y_scatter_points, s=10, c=point_colors)
-    ax.set_facecolor(mobilitains_dark_blue)
-
-    # The concise data formatter isn't useful but it's clear.
-    # So this needs work.
-    ax.xaxis.set_major_formatter(
-        mdates.ConciseDateFormatter(ax.xaxis.get_major_locator())
-    )
-    ax.tick_params(axis="x", colors=mobilitains_gray)
-
-    ax.set_xlabel("Temps", color=mobilitains_gray)
-    ax.set_title("Trafic par mode", color=mobilitains_gray)
-
-    ax.set_yticks([])
-    ax.spines["bottom"].set_color(mobilitains_gray)
-    ax.spines["top"].set_visible(False)
-    ax.spines["left"].set_visible(False)
-    ax.spines["right"].set_visible(False)
-
-    fig.set_facecolor(mobilitains_dark_blue)
-    fig.tight_layout(pad=2.0)
-    buf = io.BytesIO()
-    fig.set_size_inches(10, 5)
-    fig.savefig(buf, format="png", dpi=100)
-    plt.close()
-    response = HttpResponse(buf.getvalue(), content_type="image/png")
-    return response
+    return chart_response(request, mobilito_session, "timeseries")
 
 
 def mobilito_session_fraction_image(request, session_sha1):
-    """Generate an image of the eco fraction of a Mobilito session.
-
-    The point of this graphic is to visualise the fraction of
-    pedestrian and bicycle traffic compard to car traffic.  It's
-    objective is purely to visualise a fraction, a / b.
+    """Serve the eco fraction chart of a Mobilito session.
 
-    On a web page we'll (eventually) use d3 to render these images, as
-    it's lighter and responsive.  But in email, a PNG works far
-    better, in the sense that d3 won't render in many an email client.
-
-    This needs to be localised to French.  And most of the
-    labels/titles are place holders for now.
+    Cf. charts.render_fraction().
 
     """
     mobilito_session = get_object_or_404(
         MobilitoSession, session_sha1=session_sha1
     )
-    # Specify our brand font.
-
-    icon_path = "mobilito/static/mobilito/images"
-    img_walking = mpimg.imread(f"{icon_path}/ped-icon-small.png")
-    img_bicycle = mpimg.imread(f"{icon_path}/bike-icon-small.png")
-    img_car = mpimg.imread(f"{icon_path}/car-icon-small.png")
-    img_tc = mpimg.imread(f"{icon_path}/tc-icon-small.png")
-
-    init_brand_font()
-    mobilitains_light_blue = (91.0 / 255, 194.0 / 255, 231.0 / 255)
-    mobilitains_dark_blue = (67.0 / 255, 82.0 / 255, 110.0 / 255)
-    mobilitains_gray = (219.0 / 255, 227.0 / 255, 235.0 / 255)
-    mobilitains_red = (250.0 / 255, 70.0 / 255, 22.0 / 255)
-    mobilitains_maroon = (128.0 / 255, 105.0 / 255, 102.0 / 255)
-
-    fig, ax = plt.subplots(figsize=(3, 3), dpi=100)
-
-    modal_values = [
-        mobilito_session.pedestrian_count,
-        mobilito_session.bicycle_count,
-        mobilito_session.motor_vehicle_count,
-        mobilito_session.public_transport_count,
-    ]
-    modal_colors = [
-        mobilitains_light_blue,
-        mobilitains_light_blue,
-        mobilitains_red,
-        mobilitains_maroon,
-    ]
-    modal_explosion = [0.01] * 4
-    pie = ax.pie(modal_values, colors=modal_colors, explode=modal_explosion)
-    pie_text = pie[1]
-
-    # Bug: these axes are being positioned in the coordinate system of
-    # the figure rather than relative to the pie axes.
-    walk_icon = fig.add_axes(
-        [
-            pie_text[0].get_position()[0],
-            pie_text[0].get_position()[1],
-            0.05,
-            0.05,
-        ]
-    )
-    walk_icon.set_axis_off()
-    walk_icon.imshow(img_walking, aspect="equal")
-
-    bicycle_icon = fig.add_axes(
-        [
-            pie_text[1].get_position()[0],
-            pie_text[1].get_position()[1],
-            0.05,
-            0.05,
-        ],
-        zorder=10,
-    )
-    bicycle_icon.set_axis_off()
-    bicycle_icon.imshow(img_bicycle, aspect="equal")
-
-    car_icon = fig.add_axes(
-        [
-            pie_text[2].get_position()[0],
-            pie_text[2].get_position()[1],
-            0.05,
-            0.05,
-        ],
-        zorder=-1,
-        transform=ax.transAxes,
-    )
-    car_icon.set_axis_off()
-    car_icon.imshow(img_car, aspect="equal")
-
-    tc_icon = fig.add_axes(
-        [
-            pie_text[3].get_position()[0],
-            pie_text[3].get_position()[1],
-            0.05,
-            0.05,
-        ]
-    )
-    tc_icon.set_axis_off()
-    tc_icon.imshow(img_tc, aspect="equal")
-
-    bike_ped_share = (
-        100.0
-        * (mobilito_session.pedestrian_count + mobilito_session.bicycle_count)
-        / (
-            mobilito_session.pedestrian_count
-            + mobilito_session.bicycle_count
-            + mobilito_session.motor_vehicle_count
-        )
-    )
-    ax.set_title(
-        f"{bike_ped_share:.0f} % piétons et vélos", color=mobilitains_gray
-    )
-
-    fig.set_facecolor(mobilitains_dark_blue)
-    fig.tight_layout(pad=2.0)
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png")
-    plt.close()
-    response = HttpResponse(buf.getvalue(), content_type="image/png")
-    return response
+    return chart_response(request, mobilito_session, "fraction")
 
 
 class ReverseGeocodingView(View):
@@ -925,12 +854,14 @@ class EditLocationView(UpdateView):
             raise PermissionDenied()
 
     def form_valid(self, *args, **kwargs):
-        """Log the location edit."""
+        """Log the location edit and forget the session's charts."""
         logger.info(
             f"{self.request.user} edited location of session "
             f"{self.object.session_sha1}"
         )
-        return super().form_valid(*args, **kwargs)
+        response = super().form_valid(*args, **kwargs)
+        delete_charts(self.object)
+        return response
 
 
 @csrf_protect
@@ -958,11 +889,11 @@ def flag_session(request: HttpRequest, **kwargs) -> HttpResponse:
         _, created = InappropriateFlag.objects.get_or_create(
             session=session_object,
             reporter_user=user,
-            reporter_tn_session_id=request.session.get("tn_session"),
+            reporter_tn_session_id=get_tn_session(request),
             defaults={
                 "session": session_object,
                 "reporter_user": user,
-                "reporter_tn_session_id": request.session.get("tn_session"),
+                "reporter_tn_session_id": get_tn_session(request),
                 "report_details": request.POST.get("report-abuse-text"),
             },
         )
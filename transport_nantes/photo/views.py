@@ -4,6 +4,7 @@ from io import BytesIO
 import PIL
 from PIL import Image
 
+from asso_tn.middleware.sessionCookie import get_tn_session
 from asso_tn.utils import make_timed_token, token_valid
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
@@ -161,7 +162,7 @@ class PhotoView(FormView):
         context = super().get_context_data(**kwargs)
         photo_sha1 = self.kwargs.get("photo_sha1")
         photo = get_object_or_404(PhotoEntry, sha1_name=photo_sha1)
-        tn_session_id = self.request.session.get("tn_session")
+        tn_session_id = get_tn_session(self.request)
         user = (
             self.request.user if self.request.user.is_authenticated else None
         )
@@ -237,7 +238,7 @@ class PhotoView(FormView):
         form.
         """
         user = request.user if request.user.is_authenticated else None
-        tn_session_id = request.session.get("tn_session")
+        tn_session_id = get_tn_session(request)
         # If there is a vote with the same user or if the user has already
         # voted with this session, we no longer user the AnonymousVoteForm
         # for simplicity
@@ -309,7 +310,7 @@ class PhotoView(FormView):
                 logger.error("Mailing list operation-pieton does not exist")
 
         # Always set at page load
-        tn_session_id = self.request.session.get("tn_session", None)
+        tn_session_id = get_tn_session(self.request)
 
         # Button only sends "upvotes" so we reverse the last vote to have the
         # opposite vote
@@ -395,7 +396,7 @@ class PhotoView(FormView):
             return HttpResponseForbidden("Invalid vote")
 
         # Always set at page load
-        tn_session_id = self.request.session.get("tn_session", None)
+        tn_session_id = get_tn_session(self.request)
 
         Vote.objects.create(
             user=user,
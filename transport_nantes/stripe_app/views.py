@@ -4,7 +4,8 @@ import logging
 from typing import Union
 
 import stripe
-import user_agents
+from asso_tn.middleware.sessionCookie import get_tn_session
+from asso_tn.user_agent import request_user_agent
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.mail import EmailMultiAlternatives
@@ -265,19 +266,19 @@ def tracking_progression(request: dict) -> TrackingProgression:
             elif data[key] == "false":
                 data[key] = False
 
-        user_agent = user_agents.parse(request.META.get("HTTP_USER_AGENT"))
+        user_agent = request_user_agent(request)
 
         kwargs = {
             "amount_form_done": data["step_1_completed"],
             "donation_form_done": data["step_2_completed"],
-            "tn_session": request.session.get("tn_session"),
-            "browser": user_agent.browser.family,
-            "browser_version": user_agent.browser.version_string,
-            "os": user_agent.os.family,
-            "os_version": user_agent.os.version_string,
-            "device_family": user_agent.device.family,
-            "device_brand": user_agent.device.brand,
-            "device_model": user_agent.device.model,
+            "tn_session": get_tn_session(request),
+            "browser": user_agent.browser_family,
+            "browser_version": user_agent.browser_version,
+            "os": user_agent.os_family,
+            "os_version": user_agent.os_version,
+            "device_family": user_agent.device_family,
+            "device_brand": user_agent.device_brand,
+            "device_model": user_agent.device_model,
             "is_mobile": user_agent.is_mobile,
             "is_tablet": user_agent.is_tablet,
             "is_touch_capable": user_agent.is_touch_capable,
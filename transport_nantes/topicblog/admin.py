@@ -11,6 +11,7 @@ from .models import (
     SendRecordTransactionalEmail,
     SendRecordTransactionalAdHoc,
     TopicBlogPanel,
+    SendCampaign,
 )
 
 
@@ -54,6 +55,27 @@ class SendRecordMarketingPressAdmin(admin.ModelAdmin):
     search_fields = ("mailinglist", "recipient", "send_time", "slug")
 
 
+class SendCampaignAdmin(admin.ModelAdmin):
+    readonly_fields = (
+        "created_time",
+        "start_time",
+        "end_time",
+        "heartbeat_time",
+    )
+
+    list_display = (
+        "slug",
+        "mailing_list",
+        "status",
+        "num_recipients",
+        "num_sent",
+        "num_failed",
+        "created_time",
+    )
+    list_filter = ("status", "mailing_list")
+    search_fields = ("slug",)
+
+
 class TopicBlogMailingListPitchAdmin(admin.ModelAdmin):
     readonly_fields = ("pk",)
 
@@ -73,3 +95,4 @@ admin.site.register(SendRecordTransactionalEmail)
 admin.site.register(SendRecordTransactionalPress)
 admin.site.register(SendRecordTransactionalAdHoc)
 admin.site.register(TopicBlogPanel)
+admin.site.register(SendCampaign, SendCampaignAdmin)
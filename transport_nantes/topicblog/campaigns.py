@@ -0,0 +1,297 @@
+"""Send a TopicBlog object to a mailing list in the background.
+
+TopicBlogBaseSendView creates a SendCampaign and calls
+enqueue_campaign(), which hands it to celery (or runs it in process if
+we don't send in the background, cf. CAMPAIGN_SEND_IN_BACKGROUND).
+run_campaign() then does the work in two phases:
+
+  * Setup: create a send record for every subscriber who doesn't yet
+    have one for this slug.
+
+  * Send: hand off the send records that are still pending, a chunk
+    at a time, and record progress on the campaign after each chunk.
+
+Since the send records say what remains to be done, a campaign that
+is cancelled, or whose worker dies, picks up where it stopped when it
+is resumed.  A worker that dies between handing off a message and
+recording it will send that one message again on resume.
+
+"""
+
+from datetime import datetime, timedelta, timezone
+import logging
+import time
+from urllib.parse import urlparse
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import F
+from django.test import RequestFactory
+
+from mailing_list.events import get_subcribed_users_email_list
+from topicblog.models import SendCampaign
+from topicblog.sending import hand_off
+
+logger = logging.getLogger("django")
+
+# A running campaign whose heartbeat is older than this is presumed
+# dead and may be resumed.  The worker beats after setup and after
+# each batch it hands off (cf. beat()), which must take much less than
+# this, or a second worker could send the same messages.
+k_stale_campaign_minutes = 10
+
+
+def make_email_request(site_url: str):
+    """Return a request from which templates can build absolute URLs.
+
+    Email templates need a request, but outside of a view we have
+    none, so we fake one for the site from which the campaign was
+    launched.
+
+    """
+    parsed_url = urlparse(site_url)
+    return RequestFactory().get(
+        "/", HTTP_HOST=parsed_url.netloc, secure=parsed_url.scheme == "https"
+    )
+
+
+def make_sender(campaign: SendCampaign):
+    """Return a SendableObjectMixin configured for campaign."""
+    # SendableObjectMixin lives with the views, which import us.
+    from topicblog.views import SendableObjectMixin
+
+    sender = SendableObjectMixin()
+    sender.base_model = apps.get_model("topicblog", campaign.base_model_name)
+    sender.send_record_class = apps.get_model(
+        "topicblog", campaign.send_record_class_name
+    )
+    sender.request = make_email_request(campaign.site_url)
+    # The number of personalized emails checked against a full render,
+    # cf. CAMPAIGN_RENDER_VERIFY_SAMPLE.
+    sender.num_verified = 0
+    return sender
+
+
+def enqueue_campaign(campaign: SendCampaign) -> bool:
+    """Start sending campaign in the background.
+
+    If CAMPAIGN_SEND_IN_BACKGROUND is False, send in process instead.
+
+    If we can't reach the celery broker, we don't send in process: the
+    web request would be killed before the end of a large campaign.
+    The campaign stays queued with the error, and may be resumed.
+    Return False in that case.
+
+    """
+    if not settings.CAMPAIGN_SEND_IN_BACKGROUND:
+        run_campaign(campaign.pk)
+        return True
+
+    from topicblog.tasks import send_campaign
+
+    try:
+        send_campaign.delay(campaign.pk)
+    except Exception as e:
+        logger.error(f"Failed to enqueue campaign {campaign.pk}: {e}")
+        SendCampaign.objects.filter(
+            pk=campaign.pk, status=SendCampaign.StatusChoices.QUEUED
+        ).update(error=f"Échec de la mise en file d'envoi : {e}")
+        return False
+    return True
+
+
+def cancel_campaign(campaign: SendCampaign) -> bool:
+    """Ask campaign to stop after its current chunk.
+
+    Return False if the campaign wasn't queued or running.
+
+    """
+    return bool(
+        SendCampaign.objects.filter(
+            pk=campaign.pk,
+            status__in=[
+                SendCampaign.StatusChoices.QUEUED,
+                SendCampaign.StatusChoices.RUNNING,
+            ],
+        ).update(
+            status=SendCampaign.StatusChoices.CANCELLED,
+            end_time=datetime.now(timezone.utc),
+        )
+    )
+
+
+def is_resumable(campaign: SendCampaign) -> bool:
+    """Return True if campaign stopped before finishing.
+
+    That includes queued campaigns that we failed to enqueue.
+
+    """
+    if campaign.status == SendCampaign.StatusChoices.QUEUED:
+        return bool(campaign.error)
+    if campaign.status in (
+        SendCampaign.StatusChoices.CANCELLED,
+        SendCampaign.StatusChoices.FAILED,
+    ):
+        return True
+    if campaign.status == SendCampaign.StatusChoices.RUNNING:
+        heartbeat = campaign.heartbeat_time or campaign.start_time
+        return heartbeat is None or datetime.now(
+            timezone.utc
+        ) - heartbeat > timedelta(minutes=k_stale_campaign_minutes)
+    return False
+
+
+def resume_campaign(campaign: SendCampaign) -> bool:
+    """Queue a stopped campaign again.  Return False if we can't."""
+    if not is_resumable(campaign):
+        return False
+    updated = SendCampaign.objects.filter(
+        pk=campaign.pk, status=campaign.status
+    ).update(status=SendCampaign.StatusChoices.QUEUED, end_time=None, error="")
+    if not updated:
+        return False
+    campaign.refresh_from_db()
+    enqueue_campaign(campaign)
+    return True
+
+
+def beat(campaign_id: int) -> None:
+    """Record that the worker sending campaign_id is alive."""
+    SendCampaign.objects.filter(pk=campaign_id).update(
+        heartbeat_time=datetime.now(timezone.utc)
+    )
+
+
+def create_send_records(campaign: SendCampaign, sender) -> None:
+    """Create the send records of the subscribers who don't have one.
+
+    Record the number of recipients, already sent or not, on the
+    campaign.
+
+    """
+    recipient_list = get_subcribed_users_email_list(campaign.mailing_list)
+    sender.create_send_records(
+        slug=campaign.slug,
+        mailing_list=campaign.mailing_list,
+        recipients=recipient_list,
+    )
+    SendCampaign.objects.filter(pk=campaign.pk).update(
+        num_recipients=len(recipient_list)
+    )
+
+
+def pending_send_records(campaign: SendCampaign, sender):
+    """Return the send records of campaign that remain to be sent."""
+    return sender.send_record_class.objects.filter(
+        slug=campaign.slug,
+        mailinglist=campaign.mailing_list,
+        status=sender.send_record_class.StatusChoices.PENDING,
+        handoff_time__isnull=True,
+    ).order_by("pk")
+
+
+def send_chunk(
+    campaign: SendCampaign, sender, tb_object, send_records
+) -> tuple:
+    """Send one chunk of send records.  Return (num_sent, num_failed)."""
+    emails_and_send_records = []
+    for send_record in send_records:
+        recipient = [send_record.recipient.email]
+        if settings.CAMPAIGN_RENDER_ONCE:
+            verify = (
+                sender.num_verified < settings.CAMPAIGN_RENDER_VERIFY_SAMPLE
+            )
+            custom_email = sender.prepare_campaign_email(
+                tb_object, recipient, send_record, verify=verify
+            )
+            sender.num_verified += verify
+        else:
+            custom_email = sender.prepare_email(
+                pkid=campaign.object_id,
+                the_slug=campaign.slug,
+                recipient=recipient,
+                mailing_list=campaign.mailing_list,
+                send_record=send_record,
+            )
+        emails_and_send_records.append((custom_email, send_record))
+    return hand_off(
+        emails_and_send_records, heartbeat=lambda: beat(campaign.pk)
+    )
+
+
+def run_campaign(campaign_id: int, time_budget_seconds=None) -> bool:
+    """Send a queued campaign.
+
+    Return True if we are done with the campaign (it's finished,
+    cancelled, failed, or not ours to run), False if we stopped
+    because we used up time_budget_seconds and the campaign should be
+    queued again.
+
+    """
+    # Claim the campaign, so that two workers never send it at once.
+    now = datetime.now(timezone.utc)
+    claimed = SendCampaign.objects.filter(
+        pk=campaign_id, status=SendCampaign.StatusChoices.QUEUED
+    ).update(
+        status=SendCampaign.StatusChoices.RUNNING,
+        start_time=now,
+        heartbeat_time=now,
+    )
+    if not claimed:
+        logger.info(f"Campaign {campaign_id} is not queued, not sending.")
+        return True
+
+    campaign = SendCampaign.objects.select_related("mailing_list").get(
+        pk=campaign_id
+    )
+    start = time.monotonic()
+    try:
+        sender = make_sender(campaign)
+        tb_object = sender.base_model.objects.get(pk=campaign.object_id)
+        create_send_records(campaign, sender)
+        beat(campaign_id)
+        while True:
+            send_records = list(
+                pending_send_records(campaign, sender).select_related(
+                    "recipient"
+                )[: settings.CAMPAIGN_SEND_CHUNK_SIZE]
+            )
+            if not send_records:
+                break
+            num_sent, num_failed = send_chunk(
+                campaign, sender, tb_object, send_records
+            )
+            SendCampaign.objects.filter(pk=campaign_id).update(
+                num_sent=F("num_sent") + num_sent,
+                num_failed=F("num_failed") + num_failed,
+                heartbeat_time=datetime.now(timezone.utc),
+            )
+            campaign.refresh_from_db(fields=["status"])
+            if campaign.status != SendCampaign.StatusChoices.RUNNING:
+                logger.info(f"Campaign {campaign_id} was {campaign.status}.")
+                return True
+            if (
+                time_budget_seconds is not None
+                and time.monotonic() - start > time_budget_seconds
+            ):
+                SendCampaign.objects.filter(
+                    pk=campaign_id, status=SendCampaign.StatusChoices.RUNNING
+                ).update(status=SendCampaign.StatusChoices.QUEUED)
+                return False
+    except Exception as e:
+        logger.error(f"Campaign {campaign_id} failed: {e}")
+        SendCampaign.objects.filter(pk=campaign_id).update(
+            status=SendCampaign.StatusChoices.FAILED,
+            error=str(e),
+            end_time=datetime.now(timezone.utc),
+        )
+        return True
+
+    SendCampaign.objects.filter(
+        pk=campaign_id, status=SendCampaign.StatusChoices.RUNNING
+    ).update(
+        status=SendCampaign.StatusChoices.DONE,
+        end_time=datetime.now(timezone.utc),
+    )
+    logger.info(f"Campaign {campaign_id} is done.")
+    return True
@@ -0,0 +1,139 @@
+import time
+
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from topicblog.models import SendRecordBase
+from topicblog.sending import hand_off
+
+
+class ConnectLatencyBackend(locmem.EmailBackend):
+    """The locmem backend, but opening a connection takes a while.
+
+    This stands in for the cost of setting up an SES client (and its
+    TLS connection), which locmem doesn't have.
+
+    """
+
+    open_latency_seconds = 0.0
+    num_opened = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.is_open = False
+
+    def open(self):
+        if self.is_open:
+            return False
+        time.sleep(self.open_latency_seconds)
+        ConnectLatencyBackend.num_opened += 1
+        self.is_open = True
+        return True
+
+    def close(self):
+        self.is_open = False
+
+    def send_messages(self, messages):
+        new_connection = self.open()
+        try:
+            return super().send_messages(messages)
+        finally:
+            if new_connection:
+                self.close()
+
+
+class BenchmarkSendRecord:
+    """A send record that isn't saved, to time the hand off alone."""
+
+    StatusChoices = SendRecordBase.StatusChoices
+
+    def __init__(self):
+        self.status = self.StatusChoices.PENDING
+        self.handoff_time = None
+
+    def save(self):
+        pass
+
+
+def make_emails(count: int) -> list:
+    return [
+        (
+            mail.EmailMultiAlternatives(
+                subject="Benchmark",
+                body="Bonjour",
+                from_email="benchmark@mobilitains.fr",
+                to=[f"user-{i}@example.com"],
+            ),
+            BenchmarkSendRecord(),
+        )
+        for i in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare sending emails one connection per message with "
+        "hand_off() on the locmem backend."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--messages",
+            type=int,
+            default=1000,
+            help="Number of messages to send.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Messages per connection with hand_off().",
+        )
+        parser.add_argument(
+            "--open-latency-ms",
+            type=float,
+            nargs="+",
+            default=[0, 1, 5],
+            help="Simulated cost of opening a connection.",
+        )
+
+    def handle(self, *args, **options):
+        backend = f"{__name__}.ConnectLatencyBackend"
+        num_messages = options["messages"]
+        # No rate limit, we are timing the hand off itself.
+        with override_settings(
+            EMAIL_BACKEND=backend, EMAIL_SEND_RATE_PER_SECOND=None
+        ):
+            for latency_ms in options["open_latency_ms"]:
+                ConnectLatencyBackend.open_latency_seconds = latency_ms / 1000
+
+                emails = make_emails(num_messages)
+                ConnectLatencyBackend.num_opened = 0
+                start = time.perf_counter()
+                for email, send_record in emails:
+                    email.send(fail_silently=False)
+                one_by_one = time.perf_counter() - start
+                one_by_one_opened = ConnectLatencyBackend.num_opened
+
+                emails = make_emails(num_messages)
+                ConnectLatencyBackend.num_opened = 0
+                start = time.perf_counter()
+                num_sent, _ = hand_off(
+                    emails, batch_size=options["batch_size"]
+                )
+                batched = time.perf_counter() - start
+                batched_opened = ConnectLatencyBackend.num_opened
+
+                self.stdout.write(
+                    f"open latency {latency_ms:5.1f} ms, "
+                    f"{num_messages} messages: "
+                    f"send() {one_by_one * 1000:9.1f} ms "
+                    f"({one_by_one_opened} connections), "
+                    f"hand_off() {batched * 1000:9.1f} ms "
+                    f"({batched_opened} connections), "
+                    f"speedup {one_by_one / batched:6.1f}x"
+                )
+                if num_sent != num_messages:
+                    self.stderr.write(f"hand_off() sent only {num_sent}")
@@ -0,0 +1,99 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+from django.test import RequestFactory
+
+from topicblog.tn_links import (
+    compile_inclusion_tag_template,
+    render_inclusion_tag_to_html,
+)
+
+
+def render_uncached(context_dict, tag_source, tag_name, *args, **kwargs):
+    """Render an inclusion tag the way we did before caching templates."""
+    context_dict["title"] = kwargs.get("title")
+    context_dict["mailinglist"] = kwargs.get("mailinglist")
+    context = Context(context_dict)
+    args_list = ""
+    for arg in args:
+        args_list += f"'{arg}' "
+    template_string = (
+        f"{{% load {tag_source} %}}" f"{{% {tag_name} {args_list} %}}"
+    )
+    return Template(template_string).render(context)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rendering the inclusion tags of a body with many news "
+        "and panel links with and without the compiled template cache."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--links",
+            type=int,
+            default=48,
+            help="Number of embedded tags in the body.",
+        )
+        parser.add_argument(
+            "--panel-slug",
+            default=None,
+            help=(
+                "Slug of a published panel to embed as well as "
+                "newsletter boxes (default: newsletter boxes only)."
+            ),
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Keep the best of this many runs.",
+        )
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get(
+            "/tb/t/benchmark/", HTTP_HOST=settings.ALLOWED_HOSTS[0]
+        )
+        calls = []
+        for index in range(options["links"]):
+            if options["panel_slug"] and index % 2:
+                calls.append(("panels", "panel", [options["panel_slug"]], {}))
+            else:
+                calls.append(
+                    (
+                        "newsletter",
+                        "show_mailing_list",
+                        [],
+                        {"mailinglist": "benchmark", "title": f"Box {index}"},
+                    )
+                )
+
+        timings = {}
+        for name, render in (
+            ("uncached", render_uncached),
+            ("cached", render_inclusion_tag_to_html),
+        ):
+            compile_inclusion_tag_template.cache_clear()
+            best = None
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                for tag_source, tag_name, tag_args, tag_kwargs in calls:
+                    render(
+                        {"request": request},
+                        tag_source,
+                        tag_name,
+                        *tag_args,
+                        **tag_kwargs,
+                    )
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best * 1000
+            self.stdout.write(
+                f"{name:>8}: {timings[name]:8.2f} ms for " f"{len(calls)} tags"
+            )
+        self.stdout.write(
+            f"speedup: {timings['uncached'] / timings['cached']:.1f}x"
+        )
@@ -0,0 +1,77 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from topicblog.tn_links import TNLinkParser, TNLinkStateMachineParser
+
+k_paragraph = (
+    "Les piétons de Nantes méritent des trottoirs [larges] et "
+    "continus : un vrai (réseau) piéton, pas des bouts de trottoir. "
+)
+k_links = (
+    "[[slug:notre plan]]((plan-pieton))",
+    "[[externe:la métropole]]((https://metropole.nantes.fr/))",
+    "[[don:]]((Soutenir))",
+    "[[contact:Écrivez-nous]]((Je veux aider))",
+    "[[cta:Agir]]((agir))",
+    "[[broken:link]]((",
+)
+
+
+def make_document(size: int, seed: int = 0) -> str:
+    """Return a markdown document of about size characters."""
+    rng = random.Random(seed)
+    chunks = []
+    length = 0
+    while length < size:
+        chunk = k_paragraph * rng.randint(1, 4) + rng.choice(k_links) + "\n\n"
+        chunks.append(chunk)
+        length += len(chunk)
+    return "".join(chunks)
+
+
+class Command(BaseCommand):
+    help = "Compare the speed of the TN link parsers on generated documents."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[1000, 10000, 100000],
+            help="Document sizes in characters.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Keep the best of this many runs.",
+        )
+
+    def handle(self, *args, **options):
+        for size in options["sizes"]:
+            document = make_document(size)
+            timings = {}
+            outputs = {}
+            for parser_class in (TNLinkStateMachineParser, TNLinkParser):
+                parser = parser_class({})
+                best = None
+                for _ in range(options["repeat"]):
+                    start = time.perf_counter()
+                    outputs[parser_class] = parser.transform(document)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[parser_class] = best
+            identical = (
+                outputs[TNLinkStateMachineParser] == outputs[TNLinkParser]
+            )
+            old_ms = timings[TNLinkStateMachineParser] * 1000
+            new_ms = timings[TNLinkParser] * 1000
+            self.stdout.write(
+                f"{len(document):>9} chars: "
+                f"state machine {old_ms:9.2f} ms, "
+                f"scanner {new_ms:8.2f} ms, "
+                f"speedup {old_ms / new_ms:6.1f}x, "
+                f"identical output: {identical}"
+            )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from topicblog.models import TopicBlogPublished
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute which object of each TopicBlog slug collection is "
+        "servable (the TopicBlogPublished table)."
+    )
+
+    def handle(self, *args, **options):
+        num_pointers = TopicBlogPublished.rebuild()
+        self.stdout.write(f"Pointed {num_pointers} slugs at their objects.")
@@ -0,0 +1,42 @@
+# Generated by Django 4.1.10 on 2026-10-18 16:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("topicblog", "0061_topicblogpanel"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="topicblogemail",
+            name="rendered_html",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="topicblogitem",
+            name="rendered_html",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="topicbloglauncher",
+            name="rendered_html",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="topicblogmailinglistpitch",
+            name="rendered_html",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="topicblogpanel",
+            name="rendered_html",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="topicblogpress",
+            name="rendered_html",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
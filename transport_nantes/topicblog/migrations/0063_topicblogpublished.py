@@ -0,0 +1,72 @@
+# Generated by Django 4.1.10 on 2026-10-18 16:46
+
+from django.db import migrations, models
+
+k_topicblog_models = [
+    "TopicBlogEmail",
+    "TopicBlogItem",
+    "TopicBlogLauncher",
+    "TopicBlogMailingListPitch",
+    "TopicBlogPanel",
+    "TopicBlogPress",
+]
+
+
+def point_at_published_objects(apps, schema_editor):
+    published_model = apps.get_model("topicblog", "TopicBlogPublished")
+    pointers = []
+    for model_name in k_topicblog_models:
+        model = apps.get_model("topicblog", model_name)
+        seen_slugs = set()
+        published = (
+            model.objects.filter(publication_date__isnull=False)
+            .order_by("slug", "-publication_date")
+            .values_list("slug", "pk")
+        )
+        for slug, pk in published:
+            if slug not in seen_slugs:
+                seen_slugs.add(slug)
+                pointers.append(
+                    published_model(
+                        model_name=model._meta.model_name,
+                        slug=slug,
+                        object_id=pk,
+                    )
+                )
+    published_model.objects.bulk_create(pointers)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("topicblog", "0062_topicblog_rendered_html"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TopicBlogPublished",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model_name", models.CharField(max_length=80)),
+                ("slug", models.SlugField(allow_unicode=True, max_length=90)),
+                ("object_id", models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="topicblogpublished",
+            constraint=models.UniqueConstraint(
+                fields=("model_name", "slug"),
+                name="unique_topicblog_published_slug",
+            ),
+        ),
+        migrations.RunPython(
+            point_at_published_objects, migrations.RunPython.noop
+        ),
+    ]
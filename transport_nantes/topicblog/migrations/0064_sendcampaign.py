@@ -0,0 +1,75 @@
+# Generated by Django 4.1.10 on 2026-10-18 16:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("mailing_list", "0013_alter_mailinglist_linked_article"),
+        ("topicblog", "0063_topicblogpublished"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SendCampaign",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("base_model_name", models.CharField(max_length=80)),
+                ("send_record_class_name", models.CharField(max_length=80)),
+                ("object_id", models.PositiveIntegerField()),
+                ("slug", models.SlugField(allow_unicode=True, max_length=90)),
+                ("site_url", models.CharField(max_length=200)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("QUEUED", "En attente"),
+                            ("RUNNING", "En cours"),
+                            ("DONE", "Terminé"),
+                            ("CANCELLED", "Annulé"),
+                            ("FAILED", "Échec"),
+                        ],
+                        default="QUEUED",
+                        max_length=20,
+                    ),
+                ),
+                ("num_recipients", models.PositiveIntegerField(default=0)),
+                ("num_sent", models.PositiveIntegerField(default=0)),
+                ("num_failed", models.PositiveIntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+                ("created_time", models.DateTimeField(auto_now_add=True)),
+                ("start_time", models.DateTimeField(blank=True, null=True)),
+                ("end_time", models.DateTimeField(blank=True, null=True)),
+                (
+                    "heartbeat_time",
+                    models.DateTimeField(blank=True, null=True),
+                ),
+                (
+                    "mailing_list",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        to="mailing_list.mailinglist",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -1,14 +1,18 @@
 from datetime import datetime, timezone, timedelta
+import hashlib
 import logging
+import re
 from typing import Union
 
 import bs4
 from bs4 import BeautifulSoup as bs
+from django.apps import apps
 from django.contrib.auth.models import User
 from django.forms import ValidationError
 from django.urls import reverse
-from django.db import models
-from django.db.models import Max
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from random import randint
 
 from mailing_list.models import MailingList
@@ -16,6 +20,12 @@ from mailing_list.models import MailingList
 
 logger = logging.getLogger("django")
 
+# Markdown that contains these TN links renders differently depending
+# on the request (the mailing list signup form carries a CSRF token and
+# the page's URL) or on the database at render time (a random panel),
+# so we never pre-render it.
+k_dynamic_tn_link_re = re.compile(r"\[\[(news|panel):")
+
 ######################################################################
 # topic blog, v1
 
@@ -140,6 +150,12 @@ class TopicBlogObjectBase(models.Model):
         User, on_delete=models.PROTECT, related_name="+", blank=True, null=True
     )
 
+    # The html of the markdown (*_md) fields, rendered when the object
+    # is published, cf. prerender_markdown().  Maps field name to
+    # {"sha1": sha1 of the markdown, "html": html or None if the field
+    # must be rendered per request}.
+    rendered_html = models.JSONField(default=dict, blank=True, editable=False)
+
     # Presentation ##################################################
     #
     # Encode the basic structure of a TBItem's presentation.
@@ -237,10 +253,70 @@ class TopicBlogObjectBase(models.Model):
                 self.publication_date = now_timestamp
             if self.scheduled_for_deletion_date:
                 self.scheduled_for_deletion_date = None
+            self.prerender_markdown()
             return True
         else:
             return False
 
+    def get_markdown_fields(self) -> list:
+        """
+        Return the names of the fields that hold markdown.
+        """
+        return [
+            field.name
+            for field in self._meta.get_fields()
+            if field.name.endswith("_md")
+        ]
+
+    def prerender_markdown(self):
+        """Render the markdown fields to html and store it on self.
+
+        Published objects don't change, so we can render their markdown
+        once rather than on each request.  What we store is the
+        rendering for the web; emails render their markdown with
+        absolute URLs and don't use it.  The caller is responsible for
+        saving.
+
+        """
+        from topicblog.templatetags.markdown import tn_markdown
+
+        rendered_html = {}
+        for field_name in self.get_markdown_fields():
+            value = getattr(self, field_name) or ""
+            if k_dynamic_tn_link_re.search(value):
+                html = None
+            else:
+                html = str(tn_markdown({}, value))
+            rendered_html[field_name] = {
+                "sha1": hashlib.sha1(value.encode()).hexdigest(),
+                "html": html,
+            }
+        self.rendered_html = rendered_html
+
+    def get_prerendered_markdown(self, field_name) -> Union[str, None]:
+        """Return the pre-rendered html of field_name or None.
+
+        We return None if there is no usable pre-rendered html: the
+        object is a draft, the field is dynamic, or the markdown has
+        changed since we rendered it (e.g., an edit in the admin).
+
+        Published objects that predate pre-rendering are rendered and
+        saved on first use.
+
+        """
+        if self.publication_date is None or self.pk is None:
+            return None
+        value = getattr(self, field_name) or ""
+        sha1 = hashlib.sha1(value.encode()).hexdigest()
+        rendered = (self.rendered_html or {}).get(field_name)
+        if rendered is None or rendered["sha1"] != sha1:
+            self.prerender_markdown()
+            type(self).objects.filter(pk=self.pk).update(
+                rendered_html=self.rendered_html
+            )
+            rendered = self.rendered_html[field_name]
+        return rendered["html"]
+
     def get_missing_publication_field_names(self) -> set:
         """
         This function returns a list of all missing fields
@@ -399,6 +475,144 @@ class TopicBlogObjectBase(models.Model):
                 return days_remaining
             return 0
 
+    @classmethod
+    def published_objects(cls) -> models.QuerySet:
+        """Return the servable object of each slug collection.
+
+        Cf. TopicBlogPublished.
+
+        """
+        return cls.objects.filter(
+            pk__in=TopicBlogPublished.objects.filter(
+                model_name=cls._meta.model_name
+            ).values("object_id")
+        )
+
+    @classmethod
+    def get_published(cls, slug) -> Union["TopicBlogObjectBase", None]:
+        """Return the servable object with this slug or None.
+
+        This is one query: a primary key fetch of the object
+        TopicBlogPublished points to.
+
+        """
+        return cls.objects.filter(
+            pk=models.Subquery(
+                TopicBlogPublished.objects.filter(
+                    model_name=cls._meta.model_name, slug=slug
+                ).values("object_id")[:1]
+            )
+        ).first()
+
+
+class TopicBlogPublished(models.Model):
+    """Point from a slug collection to its servable object.
+
+    The servable object of a slug collection is the one with the most
+    recent publication_date.  Finding it means sorting the collection,
+    and we do that on nearly every public page view, so we keep the
+    answer here instead.  There is one row per (model, slug) that has
+    a published object.
+
+    The pointer is updated whenever a TopicBlog object is saved or
+    deleted (cf. update_published_pointers below), in the same
+    transaction.  Updates that bypass save(), such as
+    QuerySet.update() of publication_date, must call update_slug()
+    themselves.  The rebuild_topicblog_published management command
+    recomputes the whole table.
+
+    """
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model_name", "slug"],
+                name="unique_topicblog_published_slug",
+            )
+        ]
+
+    # The model's _meta.model_name, e.g., "topicblogitem".
+    model_name = models.CharField(max_length=80)
+    slug = models.SlugField(max_length=90, allow_unicode=True)
+    object_id = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.model_name} {self.slug} -> {self.object_id}"
+
+    @staticmethod
+    def topicblog_models() -> list:
+        """Return the concrete TopicBlog object models."""
+        return [
+            model
+            for model in apps.get_app_config("topicblog").get_models()
+            if issubclass(model, TopicBlogObjectBase)
+        ]
+
+    @classmethod
+    def update_slug(cls, model, slug):
+        """Point the slug collection of model at its servable object."""
+        latest = (
+            model.objects.filter(slug=slug, publication_date__isnull=False)
+            .order_by("-publication_date")
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if latest is None:
+            cls.objects.filter(
+                model_name=model._meta.model_name, slug=slug
+            ).delete()
+        else:
+            cls.objects.update_or_create(
+                model_name=model._meta.model_name,
+                slug=slug,
+                defaults={"object_id": latest},
+            )
+
+    @classmethod
+    def update_object(cls, tb_object):
+        """Update the pointers that tb_object's save or delete may change.
+
+        That is the pointer of its slug and, if its slug has changed,
+        the pointer of its old slug.
+
+        """
+        model = type(tb_object)
+        slugs = {tb_object.slug}
+        slugs.update(
+            cls.objects.filter(
+                model_name=model._meta.model_name, object_id=tb_object.pk
+            ).values_list("slug", flat=True)
+        )
+        with transaction.atomic():
+            for slug in slugs:
+                cls.update_slug(model, slug)
+
+    @classmethod
+    def rebuild(cls) -> int:
+        """Recompute all pointers and return how many there are."""
+        pointers = []
+        for model in cls.topicblog_models():
+            seen_slugs = set()
+            published = (
+                model.objects.filter(publication_date__isnull=False)
+                .order_by("slug", "-publication_date")
+                .values_list("slug", "pk")
+            )
+            for slug, pk in published:
+                if slug not in seen_slugs:
+                    seen_slugs.add(slug)
+                    pointers.append(
+                        cls(
+                            model_name=model._meta.model_name,
+                            slug=slug,
+                            object_id=pk,
+                        )
+                    )
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(pointers)
+        return len(pointers)
+
 
 class TopicBlogObjectSocialBase(TopicBlogObjectBase):
 
@@ -600,6 +814,85 @@ class SendRecordMarketing(SendRecordBase):
     unsubscribe_time = models.DateTimeField(null=True, blank=True)
 
 
+class SendCampaign(models.Model):
+    """Represent the sending of a TopicBlog object to a mailing list.
+
+    Sending happens in the background, cf. topicblog/campaigns.py.
+    The send records are the checkpoint: we first create one for each
+    recipient who doesn't yet have one for the slug, then send the
+    records that haven't been handed off yet, a chunk at a time.  A
+    cancelled or interrupted campaign therefore resumes where it
+    stopped.
+
+    """
+
+    class StatusChoices(models.TextChoices):
+        # Waiting for a worker.
+        QUEUED = "QUEUED", "En attente"
+        RUNNING = "RUNNING", "En cours"
+        # Every send record has been handed off or has failed.
+        DONE = "DONE", "Terminé"
+        CANCELLED = "CANCELLED", "Annulé"
+        # The worker stopped on an unexpected error.
+        FAILED = "FAILED", "Échec"
+
+    # The class names of the object we send and of its send records,
+    # e.g., TopicBlogEmail and SendRecordMarketingEmail.
+    base_model_name = models.CharField(max_length=80)
+    send_record_class_name = models.CharField(max_length=80)
+    # The object that was published when the campaign was created.
+    object_id = models.PositiveIntegerField()
+    slug = models.SlugField(max_length=90, allow_unicode=True)
+    mailing_list = models.ForeignKey(MailingList, on_delete=models.PROTECT)
+    user = models.ForeignKey(User, on_delete=models.PROTECT, related_name="+")
+    # Scheme and host of the request that created the campaign, used
+    # to build absolute URLs in the mail.
+    site_url = models.CharField(max_length=200)
+
+    status = models.CharField(
+        max_length=20,
+        choices=StatusChoices.choices,
+        default=StatusChoices.QUEUED,
+    )
+    num_recipients = models.PositiveIntegerField(default=0)
+    num_sent = models.PositiveIntegerField(default=0)
+    num_failed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_time = models.DateTimeField(auto_now_add=True)
+    start_time = models.DateTimeField(null=True, blank=True)
+    end_time = models.DateTimeField(null=True, blank=True)
+    # Updated after each chunk, so that we can tell a running
+    # campaign from one whose worker died.
+    heartbeat_time = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return (
+            f"{self.base_model_name} {self.slug} -> "
+            f"{self.mailing_list} ({self.status})"
+        )
+
+    def get_absolute_url(self):
+        return reverse("topicblog:send_campaign", args=[self.pk])
+
+    @property
+    def num_remaining(self) -> int:
+        return max(self.num_recipients - self.num_sent - self.num_failed, 0)
+
+    @property
+    def send_permission(self) -> str:
+        """Return the permission needed to send or manage the campaign."""
+        if self.base_model_name == "TopicBlogPress":
+            return "topicblog.tbp.may_send"
+        return "topicblog.tbe.may_send"
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in (
+            self.StatusChoices.QUEUED,
+            self.StatusChoices.RUNNING,
+        )
+
+
 ######################################################################
 # TopicBlogItem
 
@@ -1178,7 +1471,9 @@ class TopicBlogPress(TopicBlogObjectSocialBase):
         """Return the first paragraph of the body text."""
         from topicblog.templatetags.markdown import tn_markdown
 
-        rendered_text = tn_markdown({}, self.body_text_1_md)
+        rendered_text = self.get_prerendered_markdown(
+            "body_text_1_md"
+        ) or tn_markdown({}, self.body_text_1_md)
         soup = bs(rendered_text, "html.parser")
         # Finds the first "p" tag inside body_text_1_md.
         first_paragraph = soup.find("p")
@@ -1684,29 +1979,18 @@ class TopicBlogPanel(TopicBlogObjectBase):
 
 def get_random_panel():
     """Choose a displayable panel at random."""
-    # Using objects.filter().order_by.distinct.count() would make a
-    # lot of sense, but the django ORM doesn't support distinct() on
-    # sqlite3 (in dev).  So we have to do this a bit differently
-    # unless/until we support an easy postgresql in vagrant solution
-    # for dev.
-    # num_published_panels = (
-    #     TopicBlogPanel.objects.filter(publication_date__isnull=False)
-    #     .annotate(num_published=Count("slug"))
-    #     .count()
-    # )
-    published_panels = (
-        TopicBlogPanel.objects.filter(publication_date__isnull=False)
-        .values("slug")
-        .annotate(pub_date=Max("publication_date"))
-    )
-    logger.info(f"Found {published_panels.count()} published panels.")
-    the_panel_values = published_panels[
-        randint(0, published_panels.count() - 1)
-    ]
-    logger.info(f"Chose f{the_panel_values}.")
-    the_panel_obj = TopicBlogPanel.objects.get(
-        slug=the_panel_values["slug"],
-        publication_date=the_panel_values["pub_date"],
-    )
+    # The servable panel of each slug, cf. TopicBlogPublished.
+    published_panels = TopicBlogPanel.published_objects().order_by("pk")
+    num_published_panels = published_panels.count()
+    logger.info(f"Found {num_published_panels} published panels.")
+    the_panel_obj = published_panels[randint(0, num_published_panels - 1)]
     logger.info(f"Chose panel {the_panel_obj}.")
     return the_panel_obj
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def update_published_pointers(sender, instance, **kwargs):
+    """Keep TopicBlogPublished up to date."""
+    if isinstance(instance, TopicBlogObjectBase) and not kwargs.get("raw"):
+        TopicBlogPublished.update_object(instance)
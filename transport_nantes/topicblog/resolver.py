@@ -0,0 +1,228 @@
+"""Fetch the TopicBlog objects that template tags display, in batches.
+
+The launcher, item_teaser and panel template tags each display the
+most recent version of a slug.  Looked up one tag at a time, a page
+with N teasers costs 2N queries.  Instead, the first such tag rendered
+during a request walks the template being rendered (and the templates
+it extends, includes and renders through inclusion tags) for tags with
+literal slugs, and fetches all of them with one query per model.  The
+tags then read from the resolver, which is stored on the request.
+
+Tags whose slug is a variable are resolved on demand, one query per
+slug, but are still only fetched once per request.
+
+"""
+
+from weakref import WeakKeyDictionary
+
+from django.db.models.functions import Lower
+from django.template import Node, TemplateDoesNotExist
+from django.template.library import InclusionNode
+from django.template.loader_tags import ExtendsNode, IncludeNode
+
+from topicblog.models import TopicBlogItem, TopicBlogLauncher, TopicBlogPanel
+
+k_launcher_tags = {
+    ("topicblog.templatetags.launcher", "launcher"),
+    ("topicblog.templatetags.launcher", "launcher_carousel"),
+}
+k_teaser_tags = {
+    ("topicblog.templatetags.launcher", "item_teaser"),
+    ("topicblog.templatetags.launcher", "item_teaser_index"),
+}
+k_panel_tags = {
+    ("topicblog.templatetags.panels", "panel"),
+}
+
+# The slugs referenced by a template, computed once per compiled
+# template.
+_template_slugs = WeakKeyDictionary()
+
+
+def latest_by_slug(model, slugs, published_only=True) -> dict:
+    """Return a dict mapping each lower case slug to its latest object.
+
+    The latest object is the one with the most recent publication
+    date, or None if there is none.  Slugs are compared without regard
+    to case, as with slug__iexact.  One query.
+
+    """
+    latest = {slug.lower(): None for slug in slugs}
+    if not latest:
+        return latest
+    if published_only:
+        # Cf. TopicBlogPublished.
+        objects = model.published_objects()
+    else:
+        objects = model.objects.all()
+    objects = (
+        objects.annotate(slug_lower=Lower("slug"))
+        .filter(slug_lower__in=latest.keys())
+        .order_by("-publication_date")
+    )
+    for tb_object in objects:
+        if latest.get(tb_object.slug_lower) is None:
+            latest[tb_object.slug_lower] = tb_object
+    return latest
+
+
+def _literal_first_arg(node) -> str:
+    """Return the first positional argument of node if it's a literal."""
+    if not node.args:
+        return None
+    arg = node.args[0]
+    if isinstance(arg.var, str) and not arg.filters:
+        return arg.var
+    return None
+
+
+def _literal_template_name(filter_expression) -> str:
+    if (
+        isinstance(filter_expression.var, str)
+        and not filter_expression.filters
+    ):
+        return filter_expression.var
+    return None
+
+
+def _collect_slugs(template, slugs, seen):
+    """Add the literal slugs of the tags in template to slugs."""
+    if template in seen:
+        return
+    seen.add(template)
+    for node in template.nodelist.get_nodes_by_type(Node):
+        template_name = None
+        if isinstance(node, InclusionNode):
+            tag = (node.func.__module__, node.func.__name__)
+            slug = _literal_first_arg(node)
+            if slug is not None:
+                if tag in k_launcher_tags:
+                    slugs["launchers"].add(slug)
+                elif tag in k_teaser_tags:
+                    slugs["launchers"].add(slug)
+                    slugs["teasers"].add(slug)
+                elif tag in k_panel_tags:
+                    slugs["panels"].add(slug)
+            if isinstance(node.filename, str):
+                template_name = node.filename
+        elif isinstance(node, IncludeNode):
+            template_name = _literal_template_name(node.template)
+        elif isinstance(node, ExtendsNode):
+            template_name = _literal_template_name(node.parent_name)
+        if template_name is None:
+            continue
+        try:
+            child = template.engine.get_template(template_name)
+        except TemplateDoesNotExist:
+            continue
+        _collect_slugs(child, slugs, seen)
+
+
+def template_slugs(template) -> dict:
+    """Return the literal slugs referenced by template's tags.
+
+    The result maps "launchers", "teasers" and "panels" to sets of
+    slugs.  Teaser slugs are launcher slugs whose items we also need.
+
+    """
+    try:
+        return _template_slugs[template]
+    except KeyError:
+        pass
+    slugs = {"launchers": set(), "teasers": set(), "panels": set()}
+    _collect_slugs(template, slugs, set())
+    _template_slugs[template] = slugs
+    return slugs
+
+
+class TopicBlogResolver:
+    """Cache of the latest launchers, items and panels by slug."""
+
+    def __init__(self):
+        self.launchers = {}
+        self.items = {}
+        self.panels = {}
+        self.prefetched_templates = set()
+
+    def prefetch(self, launcher_slugs=(), teaser_slugs=(), panel_slugs=()):
+        """Fetch the objects we don't yet have, one query per model."""
+        self.launchers.update(
+            latest_by_slug(
+                TopicBlogLauncher,
+                {
+                    slug
+                    for slug in launcher_slugs
+                    if slug.lower() not in self.launchers
+                },
+            )
+        )
+        article_slugs = set()
+        for slug in teaser_slugs:
+            launcher = self.launchers.get(slug.lower())
+            if launcher is not None and launcher.article_slug:
+                article_slugs.add(launcher.article_slug)
+        self.items.update(
+            latest_by_slug(
+                TopicBlogItem,
+                {
+                    slug
+                    for slug in article_slugs
+                    if slug.lower() not in self.items
+                },
+            )
+        )
+        # The panel tag has always served the latest panel, published
+        # or not.
+        self.panels.update(
+            latest_by_slug(
+                TopicBlogPanel,
+                {
+                    slug
+                    for slug in panel_slugs
+                    if slug.lower() not in self.panels
+                },
+                published_only=False,
+            )
+        )
+
+    def prefetch_template(self, template):
+        """Prefetch the objects referenced by template, once."""
+        if template is None or template in self.prefetched_templates:
+            return
+        self.prefetched_templates.add(template)
+        slugs = template_slugs(template)
+        self.prefetch(slugs["launchers"], slugs["teasers"], slugs["panels"])
+
+    def launcher(self, slug):
+        if slug.lower() not in self.launchers:
+            self.prefetch(launcher_slugs=[slug])
+        return self.launchers[slug.lower()]
+
+    def item(self, slug):
+        if slug.lower() not in self.items:
+            self.items.update(latest_by_slug(TopicBlogItem, [slug]))
+        return self.items[slug.lower()]
+
+    def panel(self, slug):
+        if slug.lower() not in self.panels:
+            self.prefetch(panel_slugs=[slug])
+        return self.panels[slug.lower()]
+
+
+def get_resolver(context) -> TopicBlogResolver:
+    """Return the resolver for the request being rendered.
+
+    Without a request (e.g., a template rendered outside a view), each
+    call returns a fresh resolver, which amounts to fetching each
+    object as it is needed.
+
+    """
+    request = getattr(context, "request", None) or context.get("request")
+    if request is None:
+        return TopicBlogResolver()
+    resolver = getattr(request, "topicblog_resolver", None)
+    if resolver is None:
+        resolver = TopicBlogResolver()
+        request.topicblog_resolver = resolver
+    resolver.prefetch_template(context.template)
+    return resolver
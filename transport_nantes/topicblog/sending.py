@@ -0,0 +1,144 @@
+"""Hand off prepared emails to the email backend.
+
+Calling EmailMessage.send() opens a new backend connection per
+message, which with django_amazon_ses means a new SES client per
+recipient.  hand_off() instead opens one connection per
+EMAIL_SEND_BATCH_SIZE messages and passes each message to
+send_messages() on that connection.  Messages are passed one at a time
+so that a failure is attributed to the right send record: it is marked
+FAILED and we carry on with the rest of the batch.
+
+SES limits how many messages per second we may send.  hand_off() waits
+on a token bucket that refills at EMAIL_SEND_RATE_PER_SECOND, so that
+we stay under the quota rather than get throttled.  The bucket is per
+process: if several workers send at once, divide the quota between
+them.
+
+"""
+
+from datetime import datetime, timezone
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core import mail
+
+logger = logging.getLogger("django")
+
+
+class TokenBucket:
+    """Allow rate events per second on average, in bursts of capacity."""
+
+    def __init__(
+        self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep
+    ):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.last_refill = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.last_refill) * self.rate
+        )
+        self.last_refill = now
+
+    def acquire(self):
+        """Take a token, waiting until one is available."""
+        with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                self.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process's token bucket, or None if unlimited."""
+    global _rate_limiter
+    rate = settings.EMAIL_SEND_RATE_PER_SECOND
+    if not rate:
+        return None
+    with _rate_limiter_lock:
+        if _rate_limiter is None or _rate_limiter.rate != rate:
+            _rate_limiter = TokenBucket(rate)
+        return _rate_limiter
+
+
+def mark_failed(send_record):
+    send_record.status = send_record.StatusChoices.FAILED
+    send_record.save()
+
+
+def send_one(connection, email, send_record) -> bool:
+    """Send email on connection and record the outcome on send_record."""
+    recipient = ", ".join(email.to)
+    try:
+        if connection.send_messages([email]) != 1:
+            raise RuntimeError("the backend did not send the message")
+    except Exception as e:
+        logger.error(f"Failed to send email to {recipient} : {e}")
+        mark_failed(send_record)
+        return False
+    send_record.handoff_time = datetime.now(timezone.utc)
+    send_record.save()
+    logger.info(f"Successfully sent email to {recipient}")
+    return True
+
+
+def hand_off(
+    emails_and_send_records, batch_size=None, rate_limiter=None, heartbeat=None
+):
+    """Send emails, recording the outcome on their send records.
+
+    emails_and_send_records is a sequence of (email, send_record).  On
+    success we set the send record's handoff_time, on failure we set
+    its status to FAILED, and we save it either way.
+
+    If given, heartbeat is called after each batch, so that the caller
+    can show that it is still making progress (cf. campaigns.py).
+
+    Return (num_sent, num_failed).
+
+    """
+    if batch_size is None:
+        batch_size = settings.EMAIL_SEND_BATCH_SIZE
+    if rate_limiter is None:
+        rate_limiter = get_rate_limiter()
+    emails_and_send_records = list(emails_and_send_records)
+    num_sent = 0
+    num_failed = 0
+    for start in range(0, len(emails_and_send_records), batch_size):
+        end = start + batch_size
+        batch = emails_and_send_records[start:end]
+        connection = mail.get_connection(fail_silently=False)
+        try:
+            connection.open()
+        except Exception as e:
+            logger.error(f"Failed to open email connection : {e}")
+            for email, send_record in batch:
+                mark_failed(send_record)
+            num_failed += len(batch)
+        else:
+            try:
+                for email, send_record in batch:
+                    if rate_limiter is not None:
+                        rate_limiter.acquire()
+                    if send_one(connection, email, send_record):
+                        num_sent += 1
+                    else:
+                        num_failed += 1
+            finally:
+                connection.close()
+        if heartbeat is not None:
+            heartbeat()
+    return num_sent, num_failed
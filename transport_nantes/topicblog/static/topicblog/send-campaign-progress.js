@@ -0,0 +1,24 @@
+/*
+This script refreshes the progress of a campaign that is being sent.
+When the campaign stops, we reload the page to show the right buttons.
+*/
+
+const k_poll_interval_ms = 3000;
+
+async function refresh_progress() {
+    let table = document.getElementById('send-campaign-progress');
+    let response = await fetch(table.dataset.progressUrl);
+    let progress = await response.json();
+    document.getElementById('campaign-status').innerHTML = progress.status_display;
+    document.getElementById('campaign-num-recipients').innerHTML = progress.num_recipients;
+    document.getElementById('campaign-num-sent').innerHTML = progress.num_sent;
+    document.getElementById('campaign-num-failed').innerHTML = progress.num_failed;
+    document.getElementById('campaign-num-remaining').innerHTML = progress.num_remaining;
+    if (progress.is_active) {
+        setTimeout(refresh_progress, k_poll_interval_ms);
+    } else {
+        window.location.reload();
+    }
+}
+
+setTimeout(refresh_progress, k_poll_interval_ms);
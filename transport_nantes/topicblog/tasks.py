@@ -0,0 +1,23 @@
+from celery import shared_task
+from django.conf import settings
+
+from topicblog.campaigns import enqueue_campaign, run_campaign
+from topicblog.models import SendCampaign
+
+
+@shared_task
+def send_campaign(campaign_id):
+    """Send a SendCampaign, cf. topicblog/campaigns.py.
+
+    If we run out of time before the end, queue ourselves again to
+    pick up where we stopped.  If the broker is unreachable, the
+    campaign stays queued with the error, and may be resumed.
+
+    """
+    done = run_campaign(
+        campaign_id,
+        time_budget_seconds=settings.CAMPAIGN_SEND_TIME_BUDGET_SECONDS,
+    )
+    if not done:
+        enqueue_campaign(SendCampaign.objects.get(pk=campaign_id))
+    return done
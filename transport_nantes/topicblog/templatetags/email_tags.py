@@ -1,7 +1,8 @@
 from django import template
 from django.urls import reverse_lazy
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
-from .markdown import tn_markdown
+from .markdown import email_link, tn_markdown
 
 register = template.Library()
 
@@ -27,7 +28,7 @@ def email_full_width_image(
     """.format(  # noqa: E501
         filepath=request.build_absolute_uri(filepath),
         alt_text=alt_text,
-        link=link,
+        link=escape(email_link(context, link)),
     )
     return mark_safe(html_template)
 
@@ -53,14 +54,12 @@ def email_cta_button(context: dict, slug: str, label: str) -> str:
     tbe_path = reverse_lazy(
         "topicblog:view_item_by_slug", kwargs={"the_slug": slug}
     )
-    host = context["request"].get_host()
-    scheme = context["request"].scheme
     html_template = """
     <tr>
         <td style="padding-right:30px;padding-left:30px;padding-bottom:15px;
         background-color:#ffffff;text-align:center;">
             <p>
-                <a href="{scheme}://{host}{tbe_path}" class="btn donation-button btn-lg"
+                <a href="{link}" class="btn donation-button btn-lg"
                 style="background-color: #5BC2E7;color:white;font-weight: 600;">
                     {label} <i class="fa fa-arrow-right" area-hidden="true"></i>
                 </a>
@@ -68,6 +67,11 @@ def email_cta_button(context: dict, slug: str, label: str) -> str:
         </td>
     </tr>
     """.format(  # noqa: E501
-        scheme=scheme, host=host, tbe_path=tbe_path, label=label
+        link=escape(
+            email_link(
+                context, context["request"].build_absolute_uri(tbe_path)
+            )
+        ),
+        label=label,
     )
     return mark_safe(html_template)
@@ -1,5 +1,5 @@
 from django import template
-from topicblog.models import TopicBlogLauncher, TopicBlogItem
+from topicblog.resolver import get_resolver
 import logging
 
 register = template.Library()
@@ -20,14 +20,9 @@ def launcher(context, slug, is_preview=False):
         # we need to get the object from the database, as the "page" variable
         # is not available. (typically in the index)
         # because no database rule enforces the rule "one publication date per
-        # slug", we need to get the most recent one just in case
-        launcher = (
-            TopicBlogLauncher.objects.filter(
-                slug__iexact=slug, publication_date__isnull=False
-            )
-            .order_by("-publication_date")
-            .first()
-        )
+        # slug", we need to get the most recent one just in case.  The
+        # resolver fetches those of all the tags on the page at once.
+        launcher = get_resolver(context).launcher(slug)
     if launcher is None:
         logger.error(f'item_teaser failed to find slug: "{slug}".')
     return {"launcher": launcher}
@@ -54,14 +49,9 @@ def item_teaser(context, slug, is_preview=False):
         # we need to get the object from the database, as the "page" variable
         # is not available. (typically in the index)
         # because no database rule enforces the rule "one publication date per
-        # slug", we need to get the most recent one just in case
-        launcher = (
-            TopicBlogLauncher.objects.filter(
-                slug__iexact=slug, publication_date__isnull=False
-            )
-            .order_by("-publication_date")
-            .first()
-        )
+        # slug", we need to get the most recent one just in case.  The
+        # resolver fetches those of all the tags on the page at once.
+        launcher = get_resolver(context).launcher(slug)
 
     if launcher is None:
         logger.error(f'item_teaser failed to find slug: "{slug}".')
@@ -69,14 +59,7 @@ def item_teaser(context, slug, is_preview=False):
     else:
         # because no database rule enforces the rule "one publication date per
         # slug", we need to get the most recent one just in case
-        item = (
-            TopicBlogItem.objects.filter(
-                slug__iexact=launcher.article_slug,
-                publication_date__isnull=False,
-            )
-            .order_by("-publication_date")
-            .first()
-        )
+        item = get_resolver(context).item(launcher.article_slug)
         if item is None:
             logger.error(f'item_teaser failed to find slug: "{slug}".')
     return {"launcher": launcher, "item": item}
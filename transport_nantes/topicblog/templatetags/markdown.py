@@ -3,6 +3,8 @@ from django.utils.html import escape, mark_safe
 from markdown2 import markdown
 
 from topicblog.tn_links import TNLinkParser
+from topicblog.tracking import track_links, tracking_url
+from topicblog.views import k_render_as_email
 
 register = template.Library()
 
@@ -19,4 +21,43 @@ def tn_markdown(context, value):
       {% tn_markdown md_text_variable %}
     """
     parser = TNLinkParser(context, verbose=False)
-    return mark_safe(markdown(parser.transform(escape(value))))
+    html = markdown(parser.transform(escape(value)))
+    if is_tracked_email(context):
+        html = track_links(context["request"], context["beacon_token"], html)
+    return mark_safe(html)
+
+
+def is_tracked_email(context) -> bool:
+    """Return whether we are rendering an email whose clicks we track."""
+    return (
+        k_render_as_email in context
+        and bool(context.get("beacon_token"))
+        and context.get("request") is not None
+    )
+
+
+def email_link(context, url: str) -> str:
+    """Return the href for a link to url, tracked if in an email."""
+    url = str(url)
+    if is_tracked_email(context) and url.startswith(("http://", "https://")):
+        return tracking_url(context["request"], context["beacon_token"], url)
+    return url
+
+
+@register.simple_tag(takes_context=True, name="tn_markdown_field")
+def tn_markdown_field(context, tb_object, field_name):
+    """Render the markdown field field_name of a TopicBlog object.
+
+    Published objects carry their markdown pre-rendered to html
+    (cf. TopicBlogObjectBase.prerender_markdown()), which we use if we
+    can.  Drafts, dynamic fields, and emails render as tn_markdown.
+
+    Usage:
+
+      {% tn_markdown_field page "body_text_1_md" %}
+    """
+    if k_render_as_email not in context:
+        html = tb_object.get_prerendered_markdown(field_name)
+        if html is not None:
+            return mark_safe(html)
+    return tn_markdown(context, getattr(tb_object, field_name))
@@ -1,5 +1,5 @@
 from django import template
-from topicblog.models import TopicBlogPanel
+from topicblog.resolver import get_resolver
 import logging
 from topicblog.views import k_render_as_email
 
@@ -25,11 +25,7 @@ def panel(context: dict, slug: str, is_preview=False):
     if is_preview and context:
         panel = context.get("page")
     else:
-        panel = (
-            TopicBlogPanel.objects.filter(slug__iexact=slug)
-            .order_by("-publication_date")
-            .first()
-        )
+        panel = get_resolver(context).panel(slug)
     if panel is None:
         logger.error(f'panel failed to find slug: "{slug}".')
     return {
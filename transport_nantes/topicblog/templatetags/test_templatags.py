@@ -2,7 +2,9 @@ from urllib.parse import quote
 from django.http import HttpRequest
 from django.template import Template, Context
 from django.test.client import RequestFactory
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse, reverse_lazy
 from django.contrib.auth.models import User
 from topicblog.models import TopicBlogItem, TopicBlogLauncher, TopicBlogPanel
@@ -154,6 +156,104 @@ class TBItemTeaserTemplateTagsTests(TestCase):
         self.assertIn(text, rendered_template)
 
 
+class TopicBlogResolverTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username="test-user", password="test-pass"
+        )
+        now = datetime.now(timezone.utc)
+        for index in range(6):
+            TopicBlogItem.objects.create(
+                slug=f"item-{index}",
+                publication_date=now,
+                first_publication_date=now,
+                user=self.admin,
+                template_name="topicblog/content.html",
+                body_text_1_md=f"body of item {index}",
+                title=f"Item {index}",
+            )
+            TopicBlogLauncher.objects.create(
+                slug=f"launcher-{index}",
+                launcher_image="picture.png",
+                launcher_image_alt_text="picture",
+                launcher_text_md=f"launcher text {index}",
+                publication_date=now,
+                first_publication_date=now,
+                user=self.admin,
+                article_slug=f"item-{index}",
+                template_name="topicblog/content_launcher.html",
+                headline=f"Headline {index}",
+            )
+
+    def count_topicblog_queries(self, template_string):
+        context = Context({"request": RequestFactory().get("/")})
+        with CaptureQueriesContext(connection) as queries:
+            rendered = Template(template_string).render(context)
+        num_queries = len(
+            [query for query in queries if "topicblog_" in query["sql"]]
+        )
+        return rendered, num_queries
+
+    def test_constant_number_of_queries(self):
+        for num_teasers in [1, 3, 6]:
+            template_string = "{% load launcher %}" + "".join(
+                f"{{% item_teaser 'launcher-{index}' %}}"
+                f"{{% launcher 'launcher-{index}' %}}"
+                for index in range(num_teasers)
+            )
+            rendered, num_queries = self.count_topicblog_queries(
+                template_string
+            )
+            self.assertEqual(num_queries, 2, msg=num_teasers)
+            for index in range(num_teasers):
+                self.assertIn(f"body of item {index}", rendered)
+                self.assertIn(f"Headline {index}", rendered)
+
+    def test_variable_slugs(self):
+        template_string = (
+            "{% load launcher %}"
+            "{% item_teaser slug %}{% item_teaser slug %}"
+            "{% item_teaser 'launcher-1' %}"
+        )
+        context = Context(
+            {"request": RequestFactory().get("/"), "slug": "LAUNCHER-0"}
+        )
+        with CaptureQueriesContext(connection) as queries:
+            rendered = Template(template_string).render(context)
+        # The literal slug at once, then the variable one's launcher
+        # and item, only once.
+        self.assertEqual(len(queries), 4)
+        self.assertEqual(rendered.count("body of item 0"), 2)
+        self.assertIn("body of item 1", rendered)
+
+    def test_latest_version(self):
+        TopicBlogLauncher.objects.create(
+            slug="launcher-0",
+            launcher_image="picture.png",
+            launcher_image_alt_text="picture",
+            launcher_text_md="draft launcher text",
+            user=self.admin,
+            article_slug="item-1",
+            template_name="topicblog/content_launcher.html",
+            headline="Draft headline",
+        )
+        rendered, _ = self.count_topicblog_queries(
+            "{% load launcher %}{% launcher 'launcher-0' %}"
+            "{% launcher 'does-not-exist' %}"
+        )
+        self.assertIn("Headline 0", rendered)
+        self.assertNotIn("Draft headline", rendered)
+
+    def test_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("index"))
+        self.assertEqual(response.status_code, 200)
+        topicblog_queries = [
+            query for query in queries if "topicblog_" in query["sql"]
+        ]
+        self.assertLessEqual(len(topicblog_queries), 2)
+
+
 class TestTopicBlogPanel(TestCase):
     def setUp(self):
         self.user = User.objects.create(
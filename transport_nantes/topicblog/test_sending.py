@@ -0,0 +1,114 @@
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from topicblog.management.commands.benchmark_email_handoff import (
+    ConnectLatencyBackend,
+)
+from topicblog.models import SendRecordTransactionalEmail
+from topicblog.sending import TokenBucket, hand_off
+
+
+class RefusingBackend(locmem.EmailBackend):
+    """Fail to send to addresses that start with "refused"."""
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0].startswith("refused"):
+                raise ConnectionError("Refused")
+        return super().send_messages(messages)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+class TokenBucketTest(TestCase):
+    def test_burst_then_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2, capacity=4, clock=clock, sleep=clock.sleep)
+        for _ in range(4):
+            bucket.acquire()
+        self.assertEqual(clock.slept, 0)
+        for _ in range(4):
+            bucket.acquire()
+        # Four more tokens at two per second.
+        self.assertAlmostEqual(clock.slept, 2)
+
+    def test_refill_is_capped(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1, capacity=2, clock=clock, sleep=clock.sleep)
+        clock.now = 100
+        for _ in range(3):
+            bucket.acquire()
+        self.assertAlmostEqual(clock.slept, 1)
+
+
+@override_settings(EMAIL_SEND_RATE_PER_SECOND=None)
+class HandOffTest(TestCase):
+    def make_emails(self, addresses):
+        emails_and_send_records = []
+        for address in addresses:
+            user = User.objects.create_user(username=address, email=address)
+            send_record = SendRecordTransactionalEmail.objects.create(
+                recipient=user, slug="test-slug"
+            )
+            email = mail.EmailMultiAlternatives(
+                subject="Subject", body="Body", to=[address]
+            )
+            emails_and_send_records.append((email, send_record))
+        return emails_and_send_records
+
+    @override_settings(EMAIL_BACKEND="topicblog.test_sending.RefusingBackend")
+    def test_failure_marks_its_own_send_record(self):
+        emails_and_send_records = self.make_emails(
+            ["a@example.com", "refused@example.com", "b@example.com"]
+        )
+        self.assertEqual(hand_off(emails_and_send_records), (2, 1))
+        self.assertEqual(
+            [message.to[0] for message in mail.outbox],
+            ["a@example.com", "b@example.com"],
+        )
+        statuses = {
+            send_record.recipient.email: (
+                send_record.status,
+                send_record.handoff_time is not None,
+            )
+            for send_record in SendRecordTransactionalEmail.objects.all()
+        }
+        self.assertEqual(
+            statuses,
+            {
+                "a@example.com": ("PENDING", True),
+                "refused@example.com": ("FAILED", False),
+                "b@example.com": ("PENDING", True),
+            },
+        )
+
+    @override_settings(
+        EMAIL_BACKEND=(
+            "topicblog.management.commands.benchmark_email_handoff."
+            "ConnectLatencyBackend"
+        )
+    )
+    def test_one_connection_per_batch(self):
+        ConnectLatencyBackend.num_opened = 0
+        emails_and_send_records = self.make_emails(
+            [f"user-{i}@example.com" for i in range(7)]
+        )
+        self.assertEqual(
+            hand_off(emails_and_send_records, batch_size=3), (7, 0)
+        )
+        self.assertEqual(ConnectLatencyBackend.num_opened, 3)
+        self.assertEqual(len(mail.outbox), 7)
@@ -3,12 +3,18 @@ from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth.models import User
 import datetime
+import random
 
 from asso_tn.templatetags import don
 from mailing_list.templatetags import newsletter
 from topicblog.models import TopicBlogPanel
 from .templatetags import slug
-from .tn_links import TNLinkParser, render_inclusion_tag_to_html
+from .tn_links import (
+    TNLinkParser,
+    TNLinkStateMachineParser,
+    compile_inclusion_tag_template,
+    render_inclusion_tag_to_html,
+)
 
 
 class TnLinkParserTest(TestCase):
@@ -230,3 +236,112 @@ class TnLinkParserTest(TestCase):
         self.assertEqual(
             self.parser.transform(button1 + button2), html1 + html2
         )
+
+
+class TnLinkParserEquivalenceTest(TestCase):
+    """TNLinkParser must produce exactly what the original parser did."""
+
+    def setUp(self):
+        self.parser = TNLinkParser({}, verbose=False)
+        self.reference_parser = TNLinkStateMachineParser({}, verbose=False)
+
+    def assert_same_output(self, text):
+        self.assertEqual(
+            self.parser.transform(text),
+            self.reference_parser.transform(text),
+            msg=repr(text),
+        )
+
+    def test_corpus(self):
+        corpus = [
+            "",
+            "dog",
+            "[[",
+            "]]",
+            "((",
+            "))",
+            "[",
+            "[dog]",
+            "[dog](",
+            "[dog]((",
+            "[dog](hat)",
+            "[dog]((hat))",
+            "[dog:cat]",
+            "[[hello",
+            "[[hello]]((goodbye))",
+            "[[hello:goodbye",
+            "[[hello:goodbye]",
+            "dog [[hello:goodbye]] cat",
+            "[[hello:goodbye]]((dog)",
+            "[[hello:good:bye]]((dog))",
+            "[[hello:goodbye]]((dog[))",
+            "[[a[[don:]]((give!))",
+            "[[[don:]]((give!))",
+            "[[don:]]((give!))",
+            "[[don:large]]((give!))",
+            "[[don:adhésion]]((give!))",
+            "[[don:fixed|5]]((give!))",
+            "[[don:unknown]]((give!))",
+            "[[contact:Hello, World!]]((Je veux être bénévole))",
+            "[[action:Do something!]]((does-not-exist))",
+            "[[cta:join us!]]((my_topic_name))",
+            "[[slug:my-label-text]]((my-slug))",
+            "dog [[externe:Pays de la Loire]]((https://dog/cat/horse)) cat",
+            "[[EXTERNE:my-label-text]]((my-url))",
+            "dog [[petition:my-label-text]]((my-petition)) cat",
+            "[[action:join us!]]((my_topic_name))[[don:adhésion]]((give!))",
+        ]
+        for text in corpus:
+            self.assert_same_output(text)
+
+    def test_random_texts(self):
+        pieces = [
+            "[", "]", "(", ")", ":", "[[", "]]", "((", "))",
+            "don", "large", "fixed|3", "slug", "cta", "contact",
+            "externe", "EXTERNE", "petition", "dog", " ", "é", "\n",
+        ]  # fmt: skip
+        rng = random.Random(0)
+        for _ in range(5000):
+            text = "".join(
+                rng.choice(pieces) for _ in range(rng.randint(0, 30))
+            )
+            self.assert_same_output(text)
+
+
+class RenderInclusionTagTest(TestCase):
+    def setUp(self):
+        def mock_get_host():
+            return "127.0.0.1:8000"
+
+        self.http_request = HttpRequest()
+        self.http_request.get_host = mock_get_host
+        compile_inclusion_tag_template.cache_clear()
+
+    def test_template_compiled_once(self):
+        for title in ["aardvark", "kangaroo", "aardvark"]:
+            html = render_inclusion_tag_to_html(
+                {"request": self.http_request},
+                "newsletter",
+                "show_mailing_list",
+                **{"mailinglist": "kangaroo", "title": title},
+            )
+            self.assertIn(title, html)
+        user = User.objects.create_user(
+            username="test-user", password="test-pass"
+        )
+        for panel_slug in ["aardvark", "kangaroo"]:
+            TopicBlogPanel.objects.create(
+                slug=panel_slug,
+                user=user,
+                template_name="topicblog/panel_did_you_know_tip_1.html",
+                title=f"I am {panel_slug}",
+                body_text_1_md="# Hello, world!",
+                publication_date=datetime.datetime.now(datetime.timezone.utc),
+            )
+            html = render_inclusion_tag_to_html(
+                {"request": self.http_request}, "panels", "panel", panel_slug
+            )
+            self.assertIn(f"I am {panel_slug}", html)
+        cache_info = compile_inclusion_tag_template.cache_info()
+        self.assertEqual(cache_info.misses, 2)
+        self.assertEqual(cache_info.hits, 3)
@@ -0,0 +1,207 @@
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.models import User
+from django.template import Context, Template
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from asso_tn.utils import make_timed_token
+from mailing_list.models import MailingList
+from topicblog.models import (
+    SendRecordMarketingEmail,
+    SendRecordTransactionalEmail,
+    TopicBlogEmailClicks,
+)
+from topicblog.tracking import (
+    TrackingBuffer,
+    apply_clicks,
+    apply_opens,
+    k_beacon_gif,
+    tracking_url,
+)
+from topicblog.views import k_render_as_email
+
+
+def beacon_token(send_record) -> str:
+    return make_timed_token(
+        send_record.__class__.__name__, 60, int_key=send_record.pk
+    )
+
+
+class BeaconTest(TestCase):
+    def setUp(self):
+        self.send_records = [
+            SendRecordTransactionalEmail.objects.create(
+                recipient=User.objects.create_user(
+                    username=f"user-{i}", email=f"user-{i}@example.com"
+                ),
+                slug="test-slug",
+            )
+            for i in range(20)
+        ]
+
+    def open_time(self, send_record):
+        send_record.refresh_from_db()
+        return send_record.open_time
+
+    @override_settings(TRACKING_IN_BACKGROUND=False)
+    def test_beacon_serves_pixel(self):
+        send_record = self.send_records[0]
+        url = reverse(
+            "topicblog:beacon_view", args=[beacon_token(send_record) + ".gif"]
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/gif")
+        self.assertEqual(
+            response["Cache-Control"], "private, max-age=31536000"
+        )
+        self.assertEqual(response.content, k_beacon_gif)
+        first_open_time = self.open_time(send_record)
+        self.assertIsNotNone(first_open_time)
+
+        # The first open wins.
+        self.client.get(url)
+        self.assertEqual(self.open_time(send_record), first_open_time)
+
+        # Bad tokens still get a pixel.
+        response = self.client.get(
+            reverse("topicblog:beacon_view", args=["garbage.gif"])
+        )
+        self.assertEqual(response.content, k_beacon_gif)
+
+    @override_settings(TRACKING_IN_BACKGROUND=True, TRACKING_FLUSH_SIZE=1000)
+    def test_opens_are_applied_in_batches(self):
+        already_opened = self.send_records[0]
+        earlier = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        already_opened.open_time = earlier
+        already_opened.save()
+
+        buffer = TrackingBuffer(apply_opens, autostart=False)
+        now = datetime.now(timezone.utc)
+        with self.assertNumQueries(0):
+            for i, send_record in enumerate(self.send_records):
+                # The same mail opened twice, the later open first.
+                buffer.add(
+                    (beacon_token(send_record), now + timedelta(seconds=i))
+                )
+                buffer.add((beacon_token(send_record), now))
+            buffer.add(("garbage", now))
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 41)
+
+        self.assertEqual(self.open_time(already_opened), earlier)
+        for send_record in self.send_records[1:]:
+            self.assertEqual(self.open_time(send_record), now)
+        self.assertEqual(buffer.flush(), 0)
+
+
+class ClickTest(TestCase):
+    def setUp(self):
+        mailing_list = MailingList.objects.create(
+            mailing_list_name="news", mailing_list_token="news"
+        )
+        self.send_records = [
+            SendRecordMarketingEmail.objects.create(
+                recipient=User.objects.create_user(
+                    username=f"user-{i}", email=f"user-{i}@example.com"
+                ),
+                slug="test-slug",
+                mailinglist=mailing_list,
+            )
+            for i in range(10)
+        ]
+        self.request = RequestFactory().get("/")
+
+    def click_url(self, send_record, url):
+        return tracking_url(self.request, beacon_token(send_record), url)
+
+    @override_settings(TRACKING_IN_BACKGROUND=False)
+    def test_click_redirects_and_is_recorded(self):
+        send_record = self.send_records[0]
+        url = "https://example.com/a?b=c&d=e"
+        response = self.client.get(self.click_url(send_record, url))
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        send_record.refresh_from_db()
+        first_click_time = send_record.click_time
+        self.assertIsNotNone(first_click_time)
+
+        self.client.get(self.click_url(send_record, "https://example.com/"))
+        send_record.refresh_from_db()
+        self.assertEqual(send_record.click_time, first_click_time)
+        self.assertEqual(
+            list(
+                TopicBlogEmailClicks.objects.order_by("pk").values_list(
+                    "email_id", "click_url"
+                )
+            ),
+            [
+                (send_record.pk, url),
+                (send_record.pk, "https://example.com/"),
+            ],
+        )
+
+    def test_unsigned_click_is_refused(self):
+        token = beacon_token(self.send_records[0])
+        click_url = tracking_url(self.request, token, "https://a.example/")
+        response = self.client.get(
+            click_url.replace("a.example", "b.example", 1)
+        )
+        self.assertEqual(response.status_code, 400)
+        # A link doesn't work with another recipient's token.
+        other_token = beacon_token(self.send_records[1])
+        response = self.client.get(click_url.replace(token, other_token, 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TopicBlogEmailClicks.objects.exists())
+
+    @override_settings(TRACKING_IN_BACKGROUND=True, TRACKING_FLUSH_SIZE=1000)
+    def test_clicks_are_applied_in_batches(self):
+        buffer = TrackingBuffer(apply_clicks, autostart=False)
+        now = datetime.now(timezone.utc)
+        for send_record in self.send_records:
+            for i in range(3):
+                buffer.add(
+                    (
+                        beacon_token(send_record),
+                        now + timedelta(seconds=i),
+                        f"https://example.com/{i}",
+                    )
+                )
+        # Update click_time, find send records, insert the clicks.
+        with self.assertNumQueries(3):
+            self.assertEqual(buffer.flush(), 30)
+        self.assertEqual(TopicBlogEmailClicks.objects.count(), 30)
+        for send_record in self.send_records:
+            send_record.refresh_from_db()
+            self.assertEqual(send_record.click_time, now)
+
+    def test_email_links_are_tracked(self):
+        send_record = self.send_records[0]
+        token = beacon_token(send_record)
+        html = Template("{% load markdown %}{% tn_markdown text %}").render(
+            Context(
+                {
+                    k_render_as_email: True,
+                    "beacon_token": token,
+                    "request": self.request,
+                    "text": "[Le site](https://mobilitains.fr/?a=1&b=2)",
+                }
+            )
+        )
+        self.assertIn(reverse("topicblog:click_view", args=[token]), html)
+        self.assertNotIn('href="https://mobilitains.fr', html)
+        href = html.split('href="', 1)[1].split('"', 1)[0]
+        response = self.client.get(href.replace("&amp;", "&"))
+        self.assertRedirects(
+            response,
+            "https://mobilitains.fr/?a=1&b=2",
+            fetch_redirect_response=False,
+        )
+
+        # Not in an email, links are left alone.
+        html = Template("{% load markdown %}{% tn_markdown text %}").render(
+            Context({"text": "[Le site](https://mobilitains.fr/)"})
+        )
+        self.assertIn('href="https://mobilitains.fr/"', html)
@@ -1,21 +1,49 @@
 from datetime import datetime, timedelta, timezone
+from io import StringIO
+import json
+from unittest import mock
 
 from django.contrib.auth.models import Permission, User
 from django.core import mail
+from django.core.management import call_command
+from django.db import connection
 from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
 from django.urls import reverse
-from mailing_list.models import MailingList
+from django_ses.signals import bounce_received
+from mailing_list.models import (
+    MailingList,
+    MailingListCounts,
+    MailingListEvent,
+    MailingListSubscription,
+)
 from mailing_list.events import (
     get_subcribed_users_email_list,
     unsubscribe_user_from_list,
     subscribe_user_to_list,
 )
+from topicblog import views
+from topicblog import campaigns
+from topicblog.campaigns import (
+    cancel_campaign,
+    is_resumable,
+    make_sender,
+    run_campaign,
+)
+from topicblog.email_rendering import PersonalizableEmail
 from topicblog.forms import TopicBlogEmailSendForm
+from topicblog.sending import hand_off
+from topicblog.tasks import send_campaign
+from topicblog.templatetags.markdown import tn_markdown
 from .models import (
+    SendCampaign,
+    SendRecordMarketingEmail,
     TopicBlogEmail,
     TopicBlogItem,
     TopicBlogPress,
     TopicBlogPanel,
+    TopicBlogPublished,
     get_random_panel,
 )
 
@@ -1125,6 +1153,129 @@ class TBIModel(TestCase):
             {"body_image", "body_image_alt_text"},
         )
 
+    def test_publish_prerenders_markdown(self):
+        item = self.item_without_date
+        item.body_text_1_md = "Some *body*"
+        self.assertTrue(item.publish())
+        self.assertEqual(
+            set(item.rendered_html),
+            {"body_text_1_md", "body_text_2_md", "body_text_3_md"},
+        )
+        self.assertEqual(
+            item.rendered_html["body_text_1_md"]["html"],
+            str(tn_markdown({}, "Some *body*")),
+        )
+        self.assertEqual(
+            item.get_prerendered_markdown("body_text_1_md"),
+            str(tn_markdown({}, "Some *body*")),
+        )
+
+    def test_prerendered_markdown_not_for_drafts(self):
+        self.assertIsNone(
+            self.item_without_date.get_prerendered_markdown("body_text_1_md")
+        )
+        self.assertEqual(self.item_without_date.rendered_html, {})
+
+    def test_prerendered_markdown_not_for_dynamic_fields(self):
+        self.item_with_slug.body_text_2_md = "[[news:]]((une-liste))"
+        self.item_with_slug.prerender_markdown()
+        self.assertIsNotNone(
+            self.item_with_slug.get_prerendered_markdown("body_text_1_md")
+        )
+        self.assertIsNone(
+            self.item_with_slug.get_prerendered_markdown("body_text_2_md")
+        )
+
+    def test_prerendered_markdown_backfill(self):
+        # Published before we pre-rendered markdown.
+        self.assertEqual(self.item_with_slug.rendered_html, {})
+        html = self.item_with_slug.get_prerendered_markdown("body_text_1_md")
+        self.assertEqual(html, str(tn_markdown({}, "body 1")))
+        self.item_with_slug.refresh_from_db()
+        self.assertEqual(
+            self.item_with_slug.rendered_html["body_text_3_md"]["html"],
+            str(tn_markdown({}, "body 3")),
+        )
+
+    def test_prerendered_markdown_stale(self):
+        self.item_with_slug.prerender_markdown()
+        self.item_with_slug.body_text_1_md = "changed in the admin"
+        self.assertEqual(
+            self.item_with_slug.get_prerendered_markdown("body_text_1_md"),
+            str(tn_markdown({}, "changed in the admin")),
+        )
+
+    def test_view_uses_prerendered_markdown(self):
+        self.item_with_slug.prerender_markdown()
+        self.item_with_slug.rendered_html["body_text_1_md"][
+            "html"
+        ] = "<p>pre-rendered</p>"
+        self.item_with_slug.save()
+        response = self.user_permited_client.get(
+            reverse(
+                "topicblog:view_item_by_pkid",
+                args=[self.item_with_slug.pk, self.item_with_slug.slug],
+            )
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "<p>pre-rendered</p>")
+        self.assertContains(response, str(tn_markdown({}, "body 2")))
+
+
+class TopicBlogPublishedTest(TestCase):
+    def setUp(self):
+        TBIEditStatusCodeTest.setUp(self)
+
+    def test_pointers_follow_saves(self):
+        # item_with_higher_date was published last.
+        self.assertEqual(
+            TopicBlogItem.get_published("test-slug"),
+            self.item_with_higher_date,
+        )
+        self.assertTrue(self.item_with_slug.publish())
+        self.item_with_slug.save()
+        self.assertEqual(
+            TopicBlogItem.get_published("test-slug"), self.item_with_slug
+        )
+        self.item_with_slug.delete()
+        self.assertEqual(
+            TopicBlogItem.get_published("test-slug"),
+            self.item_with_higher_date,
+        )
+        self.assertIsNone(TopicBlogItem.get_published("test-slug-no-date"))
+        self.assertIsNone(TopicBlogEmail.get_published("test-slug"))
+
+    def test_slug_change(self):
+        self.item_without_alt.slug = "new-slug"
+        self.item_without_alt.save()
+        self.assertIsNone(TopicBlogItem.get_published("test-slug-no-alt"))
+        self.assertEqual(
+            TopicBlogItem.get_published("new-slug"), self.item_without_alt
+        )
+
+    def test_get_published_is_one_query(self):
+        with self.assertNumQueries(1):
+            TopicBlogItem.get_published("test-slug")
+
+    def test_rebuild(self):
+        expected = list(
+            TopicBlogPublished.objects.order_by("model_name", "slug").values(
+                "model_name", "slug", "object_id"
+            )
+        )
+        TopicBlogPublished.objects.all().delete()
+        out = StringIO()
+        call_command("rebuild_topicblog_published", stdout=out)
+        self.assertIn(f"Pointed {len(expected)} slugs", out.getvalue())
+        self.assertEqual(
+            list(
+                TopicBlogPublished.objects.order_by(
+                    "model_name", "slug"
+                ).values("model_name", "slug", "object_id")
+            ),
+            expected,
+        )
+
 
 class TBIView(TestCase):
     def setUp(self):
@@ -1386,6 +1537,371 @@ class TopicBlogEmailTest(TransactionTestCase):
         self.assertEqual(len(mail.outbox), 0)
 
 
+class SendCampaignTest(TestCase):
+    def setUp(self):
+        self.superuser = User.objects.create_superuser(
+            username="test_user",
+            email="admin@mobilitain.fr",
+            password="test_password",
+        )
+        self.email_article = TopicBlogEmail.objects.create(
+            subject="Test subject",
+            user=self.superuser,
+            body_text_1_md="Test body text 1",
+            slug="test-email",
+            publication_date=datetime.now(timezone.utc),
+            first_publication_date=datetime.now(timezone.utc),
+            template_name="topicblog/content_email.html",
+            title="Test title",
+        )
+        self.mailing_list = MailingList.objects.create(
+            mailing_list_name="the_mailing_list_name",
+            mailing_list_token="the_mailing_list_token",
+            contact_frequency_weeks=12,
+            list_active=True,
+        )
+        subscribe_user_to_list(self.superuser, self.mailing_list)
+        for i in range(4):
+            user = User.objects.create_user(
+                username=f"user_{i}", email=f"user_{i}@mobilitain.fr"
+            )
+            subscribe_user_to_list(user, self.mailing_list)
+        self.admin_client = Client()
+        self.admin_client.force_login(self.superuser)
+        self.send_url = reverse(
+            "topicblog:send_email", args=[self.email_article.slug]
+        )
+        self.form_data = {
+            "mailing_list": "the_mailing_list_token",
+            "confirmation_box": "on",
+        }
+
+    def make_campaign(self):
+        return SendCampaign.objects.create(
+            base_model_name="TopicBlogEmail",
+            send_record_class_name="SendRecordMarketingEmail",
+            object_id=self.email_article.id,
+            slug=self.email_article.slug,
+            mailing_list=self.mailing_list,
+            user=self.superuser,
+            site_url="http://testserver/",
+        )
+
+    def test_send_redirects_to_campaign(self):
+        response = self.admin_client.post(self.send_url, self.form_data)
+        campaign = SendCampaign.objects.get()
+        self.assertRedirects(response, campaign.get_absolute_url())
+        self.assertEqual(campaign.status, SendCampaign.StatusChoices.DONE)
+        self.assertEqual(campaign.num_recipients, 5)
+        self.assertEqual(campaign.num_sent, 5)
+        self.assertEqual(len(mail.outbox), 5)
+
+        response = self.admin_client.get(
+            campaign.get_absolute_url(), {"format": "json"}
+        )
+        self.assertEqual(response.json()["num_sent"], 5)
+        self.assertFalse(response.json()["is_active"])
+        response = self.admin_client.get(campaign.get_absolute_url())
+        self.assertContains(response, "the_mailing_list_name")
+
+    @override_settings(CAMPAIGN_SEND_CHUNK_SIZE=2)
+    def test_time_budget_requeues(self):
+        campaign = self.make_campaign()
+        # A negative budget stops after the first chunk.
+        self.assertFalse(run_campaign(campaign.pk, time_budget_seconds=-1))
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, SendCampaign.StatusChoices.QUEUED)
+        self.assertEqual(campaign.num_sent, 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+        self.assertTrue(run_campaign(campaign.pk))
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, SendCampaign.StatusChoices.DONE)
+        self.assertEqual(campaign.num_sent, 5)
+        # Nobody received the email twice.
+        self.assertCountEqual(
+            [message.to[0] for message in mail.outbox],
+            get_subcribed_users_email_list(self.mailing_list),
+        )
+
+    @override_settings(CAMPAIGN_SEND_CHUNK_SIZE=2)
+    def test_cancel_and_resume(self):
+        campaign = self.make_campaign()
+        cancel_campaign(campaign)
+        # A cancelled campaign isn't run.
+        self.assertTrue(run_campaign(campaign.pk))
+        self.assertEqual(len(mail.outbox), 0)
+
+        response = self.admin_client.post(
+            campaign.get_absolute_url(), {"action": "resume"}
+        )
+        self.assertRedirects(response, campaign.get_absolute_url())
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, SendCampaign.StatusChoices.DONE)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(
+            SendRecordMarketingEmail.objects.filter(
+                handoff_time__isnull=True
+            ).exists()
+        )
+
+    @override_settings(CAMPAIGN_SEND_IN_BACKGROUND=True)
+    def test_broker_failure_leaves_campaign_queued(self):
+        with mock.patch(
+            "topicblog.tasks.send_campaign.delay",
+            side_effect=ConnectionError("broker down"),
+        ):
+            response = self.admin_client.post(self.send_url, self.form_data)
+        campaign = SendCampaign.objects.get()
+        self.assertRedirects(response, campaign.get_absolute_url())
+        # Nothing was sent from the web request.
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(campaign.status, SendCampaign.StatusChoices.QUEUED)
+        self.assertIn("broker down", campaign.error)
+        self.assertTrue(is_resumable(campaign))
+
+        with override_settings(CAMPAIGN_SEND_IN_BACKGROUND=False):
+            self.admin_client.post(
+                campaign.get_absolute_url(), {"action": "resume"}
+            )
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, SendCampaign.StatusChoices.DONE)
+        self.assertEqual(campaign.error, "")
+        self.assertEqual(len(mail.outbox), 5)
+
+    @override_settings(
+        CAMPAIGN_SEND_IN_BACKGROUND=True,
+        CAMPAIGN_SEND_CHUNK_SIZE=2,
+        CAMPAIGN_SEND_TIME_BUDGET_SECONDS=-1,
+    )
+    def test_broker_failure_when_requeueing(self):
+        campaign = self.make_campaign()
+        with mock.patch(
+            "topicblog.tasks.send_campaign.delay",
+            side_effect=ConnectionError("broker down"),
+        ):
+            self.assertFalse(send_campaign(campaign.pk))
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, SendCampaign.StatusChoices.QUEUED)
+        self.assertEqual(campaign.num_sent, 2)
+        self.assertIn("broker down", campaign.error)
+        self.assertTrue(is_resumable(campaign))
+
+    @override_settings(EMAIL_SEND_BATCH_SIZE=2)
+    def test_heartbeat_while_sending(self):
+        campaign = self.make_campaign()
+        long_ago = datetime.now(timezone.utc) - timedelta(hours=1)
+        num_heartbeats = []
+
+        def slow_hand_off(emails_and_send_records, heartbeat):
+            # Pretend that setup took an hour.
+            SendCampaign.objects.filter(pk=campaign.pk).update(
+                heartbeat_time=long_ago
+            )
+            self.assertTrue(
+                is_resumable(SendCampaign.objects.get(pk=campaign.pk))
+            )
+
+            def counting_heartbeat():
+                num_heartbeats.append(1)
+                heartbeat()
+
+            result = hand_off(
+                emails_and_send_records, heartbeat=counting_heartbeat
+            )
+            # The batches we handed off show that we are alive.
+            self.assertFalse(
+                is_resumable(SendCampaign.objects.get(pk=campaign.pk))
+            )
+            return result
+
+        with mock.patch.object(campaigns, "hand_off", slow_hand_off):
+            self.assertTrue(run_campaign(campaign.pk))
+        self.assertEqual(len(num_heartbeats), 3)
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_campaign_view_permissions(self):
+        campaign = self.make_campaign()
+        user = User.objects.create_user(
+            username="no_permissions", email="no_permissions@mobilitain.fr"
+        )
+        client = Client()
+        client.force_login(user)
+        response = client.get(campaign.get_absolute_url())
+        self.assertEqual(response.status_code, 403)
+        response = client.post(
+            campaign.get_absolute_url(), {"action": "cancel"}
+        )
+        self.assertEqual(response.status_code, 403)
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, SendCampaign.StatusChoices.QUEUED)
+
+    def make_send_record(self):
+        return SendRecordMarketingEmail.objects.create(
+            slug=self.email_article.slug,
+            mailinglist=self.mailing_list,
+            recipient=self.superuser,
+        )
+
+    def test_create_send_records_in_bulk(self):
+        sender = make_sender(self.make_campaign())
+        already_sent = self.make_send_record()
+        recipients = get_subcribed_users_email_list(self.mailing_list)
+        with CaptureQueriesContext(connection) as queries:
+            ids = sender.create_send_records(
+                self.email_article.slug, self.mailing_list, recipients
+            )
+        # One query to find the recipients, one to insert, and the
+        # savepoint around the insert.
+        self.assertLessEqual(len(queries), 4)
+        self.assertEqual(len(ids), 4)
+        self.assertNotIn(already_sent.pk, ids)
+        self.assertCountEqual(
+            SendRecordMarketingEmail.objects.values_list(
+                "recipient__email", flat=True
+            ),
+            recipients,
+        )
+        self.assertEqual(
+            set(ids),
+            set(
+                SendRecordMarketingEmail.objects.exclude(
+                    pk=already_sent.pk
+                ).values_list("pk", flat=True)
+            ),
+        )
+        # Everyone has a send record now.
+        self.assertEqual(
+            sender.create_send_records(
+                self.email_article.slug, self.mailing_list, recipients
+            ),
+            [],
+        )
+
+    def test_personalized_email_matches_full_render(self):
+        sender = make_sender(self.make_campaign())
+        send_record = self.make_send_record()
+        with mock.patch.object(views.logger, "error") as log_error:
+            email = sender.prepare_campaign_email(
+                self.email_article,
+                [self.superuser.email],
+                send_record,
+                verify=True,
+            )
+        log_error.assert_not_called()
+        html = email.alternatives[0][0]
+        self.assertNotIn("tnslot", html)
+        self.assertNotIn("tnslot", email.body)
+        self.assertIn(reverse("topicblog:beacon_view", args=["x"])[:-1], html)
+        self.assertIn(
+            reverse("mailing_list:newsletter_unsubscribe", args=["x"])[:-1],
+            html,
+        )
+
+    def test_personalization_mismatch_falls_back_to_full_render(self):
+        sender = make_sender(self.make_campaign())
+        personalizable_email = sender.get_personalizable_email(
+            self.email_article
+        )
+        # Pretend the template mangled the placeholders.
+        sender._personalizable_emails[
+            self.email_article.pk
+        ] = PersonalizableEmail(
+            "<p>Pas de jeton</p>", personalizable_email.placeholders
+        )
+        with mock.patch.object(views.logger, "error") as log_error:
+            email = sender.prepare_campaign_email(
+                self.email_article,
+                [self.superuser.email],
+                self.make_send_record(),
+                verify=True,
+            )
+        log_error.assert_called_once()
+        self.assertNotIn("Pas de jeton", email.alternatives[0][0])
+        self.assertTrue(sender._personalization_failed)
+
+    @override_settings(CAMPAIGN_RENDER_VERIFY_SAMPLE=0)
+    def test_campaign_renders_once(self):
+        campaign = self.make_campaign()
+        with mock.patch.object(
+            views, "render_to_string", wraps=views.render_to_string
+        ) as render:
+            run_campaign(campaign.pk)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(len(mail.outbox), 5)
+        # Each recipient gets their own unsubscribe link.
+        bodies = {message.alternatives[0][0] for message in mail.outbox}
+        self.assertEqual(len(bodies), 5)
+
+
+class SESBounceTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="bouncer", email="bouncer@mobilitain.fr"
+        )
+        self.mailing_list = MailingList.objects.create(
+            mailing_list_name="the_mailing_list_name",
+            mailing_list_token="the_mailing_list_token",
+            contact_frequency_weeks=12,
+            list_active=True,
+        )
+        subscribe_user_to_list(self.user, self.mailing_list)
+        self.send_record = SendRecordMarketingEmail.objects.create(
+            recipient=self.user,
+            slug="test-email",
+            mailinglist=self.mailing_list,
+        )
+
+    def bounce(self, bounce_type):
+        comments = json.dumps(
+            {
+                "send_record class": "SendRecordMarketingEmail",
+                "send_record id": str(self.send_record.id),
+            }
+        )
+        bounce_received.send(
+            sender=None,
+            mail_obj={
+                "messageId": "the-message-id",
+                "headers": [{"name": "Comments", "value": comments}],
+            },
+            bounce_obj={"bounceType": bounce_type},
+            raw_message=b"",
+        )
+        self.send_record.refresh_from_db()
+
+    def test_bounce_is_recorded_on_the_list(self):
+        self.bounce("Permanent")
+        self.assertEqual(
+            self.send_record.status,
+            SendRecordMarketingEmail.StatusChoices.FAILED,
+        )
+        subscription = MailingListSubscription.objects.get(
+            user=self.user, mailing_list=self.mailing_list
+        )
+        bounce = MailingListEvent.objects.get(
+            event_type=MailingListEvent.EventType.BOUNCE
+        )
+        self.assertEqual(subscription.last_bounce_time, bounce.event_timestamp)
+        # A bounce doesn't unsubscribe.
+        self.assertTrue(subscription.is_subscribed)
+        self.assertEqual(
+            MailingListCounts.get_counts(self.mailing_list.pk), (1, 1)
+        )
+
+    def test_transient_bounce_is_retried(self):
+        self.bounce("Transient")
+        self.assertEqual(
+            self.send_record.status,
+            SendRecordMarketingEmail.StatusChoices.RETRYING,
+        )
+        self.assertTrue(
+            MailingListEvent.objects.filter(
+                event_type=MailingListEvent.EventType.BOUNCE
+            ).exists()
+        )
+
+
 class TopicBlogPressTests(TransactionTestCase):
     def setUp(self):
         self.superuser = User.objects.create_superuser(
@@ -1,4 +1,6 @@
 from enum import Enum, unique, auto
+from functools import lru_cache
+import re
 
 from django.template import Template, Context
 from django.urls import reverse, NoReverseMatch
@@ -70,6 +72,24 @@ functions in order to permit HTML on the output.
 """
 
 
+@lru_cache(maxsize=64)
+def compile_inclusion_tag_template(
+    tag_source: str, tag_name: str, num_args: int
+) -> Template:
+    """Return the compiled template that calls an inclusion tag.
+
+    The arguments are passed through the context as tn_arg_0,
+    tn_arg_1, ..., so one template serves all calls with the same
+    number of arguments and we only compile (and {% load %}) it once.
+
+    """
+    args_list = " ".join(f"tn_arg_{index}" for index in range(num_args))
+    template_string = (
+        f"{{% load {tag_source} %}}" f"{{% {tag_name} {args_list} %}}"
+    )
+    return Template(template_string)
+
+
 def render_inclusion_tag_to_html(
     context_dict: dict,
     tag_source: str,
@@ -81,15 +101,143 @@ def render_inclusion_tag_to_html(
     context_dict["title"] = kwargs.get("title")
     context_dict["mailinglist"] = kwargs.get("mailinglist")
     context = Context(context_dict)
-    args_list = ""
-    if args:
-        for arg in args:
-            args_list += f"'{arg}' "
+    context.update({f"tn_arg_{index}": arg for index, arg in enumerate(args)})
+    template = compile_inclusion_tag_template(tag_source, tag_name, len(args))
+    return template.render(context)
+
+
+# A complete link: [[class:label]]((satellite)).  Neither class nor
+# label may contain brackets, parentheses, or colons.  The satellite
+# may contain colons (URLs) but not brackets or parentheses.
+k_tn_link_re = re.compile(
+    r"\[\[([^\[\]():]*):([^\[\]():]*)\]\]\(\(([^\[\]()]*)\)\)"
+)
+# The longest prefix of a link.  If a link doesn't match, the text
+# from the opening bracket up to and including the next character
+# (the one that doesn't fit) is passed through unchanged.
+k_tn_link_prefix_re = re.compile(
+    r"\[(?:\[[^\[\]():]*(?::[^\[\]():]*"
+    r"(?:\](?:\](?:\((?:\([^\[\]()]*(?:\))?)?)?)?)?)?)?"
+)
 
-    template_string = (
-        f"{{% load {tag_source} %}}" f"{{% {tag_name} {args_list} %}}"
-    )
-    return Template(template_string).render(context)
+
+class TNLinkParser(object):
+    """Transform TN links in a text, cf. the file header.
+
+    We scan for opening brackets and match links with a regular
+    expression, so the work is linear in the length of the text.  The
+    output is the same as that of the original character-by-character
+    parser, TNLinkStateMachineParser, including for malformed links.
+
+    """
+
+    verbose = False
+
+    def __init__(self, context, verbose=False):
+        self.verbose = verbose
+        self.context = context
+
+    def transform(self, in_text):
+        """Parse text and return output.
+
+        Transform incoming text as noted in the file header.
+
+        """
+        self.log(in_text)
+        chunks = []
+        position = 0
+        while position < len(in_text):
+            bracket = in_text.find("[", position)
+            if bracket < 0:
+                chunks.append(in_text[position:])
+                break
+            chunks.append(in_text[position:bracket])
+            link = k_tn_link_re.match(in_text, bracket)
+            if link:
+                chunks.append(self.transcribe(*link.groups()))
+                position = link.end()
+            else:
+                # Note that the character that doesn't fit is never
+                # the start of a link, even if it is a bracket.
+                position = k_tn_link_prefix_re.match(in_text, bracket).end()
+                position += 1
+                chunks.append(in_text[bracket:position])
+        return "".join(chunks)
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def transcribe(self, bracket_class, bracket_label, paren):
+        """Return the transformation of [[class:label]]((paren)).
+
+        This is where the magic happens.
+        """
+        if "don" == bracket_class:
+            if "" == bracket_label:
+                return don.bouton_don(paren, context=self.context)
+            elif "large" == bracket_label:
+                return don.bouton_don_lg(paren, context=self.context)
+            elif "adhésion" == bracket_label:
+                return don.bouton_join(paren)
+            elif bracket_label.startswith("fixed|"):
+                donation_args = bracket_label.split("|", 1)
+                # The first element must be "fixed" by construction.
+                # The second should be the donation amount, default=1.
+                if len(donation_args) > 1:
+                    donation_amount = donation_args[1]
+                else:
+                    donation_amount = 1
+                return don.fixed_amount_donation_button(donation_amount, paren)
+            else:
+                return bracket_class + ":" + bracket_label + "(" + paren + ")"
+        elif "news" == bracket_class:
+            return render_inclusion_tag_to_html(
+                self.context,
+                "newsletter",
+                "show_mailing_list",
+                **{"mailinglist": bracket_label, "title": paren},
+            )
+        elif "panel" == bracket_class:
+            # Ideally, we'd pass the object through to the panel tag,
+            # but render_inclusion_tag_to_html() is a hideous mess
+            # that depends too much on its first client, the mailing
+            # list tag.  So we'll leave that all to another day.
+            return render_inclusion_tag_to_html(
+                self.context, "panels", "panel", paren
+            )
+        elif "cta" == bracket_class or "action" == bracket_class:
+            # Deprecated "action:".
+            try:
+                url = reverse("topic_blog:view_item_by_slug", args=[paren])
+            except NoReverseMatch:
+                url = "(((pas trouvé : {ps})))".format(ps=paren)
+            return don.action_button(url, bracket_label, context=self.context)
+        elif "slug" == bracket_class:
+            return slug.tbi_slug(self.context, bracket_label, paren)
+        elif "contact" == bracket_class:
+            return don.contact_button(bracket_label, paren)
+        elif "externe" == bracket_class:
+            return don.external_url(paren, bracket_label)
+        elif "EXTERNE" == bracket_class:
+            return don.external_url_button(
+                paren, bracket_label, context=self.context
+            )
+        elif "petition" == bracket_class:
+            return newsletter.petition_link(paren, bracket_label)
+        else:
+            self.log("Unexpected transcription case: " + bracket_class)
+            return f"[[{bracket_class}:{bracket_label}]](({paren}))"
+
+
+######################################################################
+# The original parser.
+#
+# It reads one character at a time through a state machine and
+# accumulates its output by concatenation, which is slow on long
+# texts.  We keep it as the reference for TNLinkParser's behaviour:
+# the tests check that the two agree, and the benchmark_tn_links
+# management command compares their speed.
 
 
 @unique
@@ -107,8 +255,8 @@ class State(Enum):
     PARSING_CLOSE_PAREN = auto()
 
 
-class TNLinkParser(object):
-    """ """
+class TNLinkStateMachineParser(TNLinkParser):
+    """The original TN link parser, cf. above."""
 
     # Accumulators.
     out_string = ""
@@ -117,11 +265,6 @@ class TNLinkParser(object):
     paren_string = ""
     # Current state.
     state = State.ORDINARY
-    verbose = False
-
-    def __init__(self, context, verbose=False):
-        self.verbose = verbose
-        self.context = context
 
     def clear(self):
         """Clear state before parsing."""
@@ -142,10 +285,6 @@ class TNLinkParser(object):
         self.consume_ordinary(in_text)
         return self.out_string
 
-    def log(self, message):
-        if self.verbose:
-            print(message)
-
     def set_state(self, state):
         self.log(state.name)
         self.state = state
@@ -201,101 +340,12 @@ class TNLinkParser(object):
         self.reset_to_ordinary()
 
     def transcribe_accumulated_text(self):
-        """We've finished accumulating something, transform and output it.
-
-        This is where the magic happens.
-        """
-        if "don" == self.bracket_class_string:
-            if "" == self.bracket_label_string:
-                self.out_string += don.bouton_don(
-                    self.paren_string, context=self.context
-                )
-            elif "large" == self.bracket_label_string:
-                self.out_string += don.bouton_don_lg(
-                    self.paren_string, context=self.context
-                )
-            elif "adhésion" == self.bracket_label_string:
-                self.out_string += don.bouton_join(self.paren_string)
-            elif self.bracket_label_string.startswith("fixed|"):
-                donation_args = self.bracket_label_string.split("|", 1)
-                # The first element must be "fixed" by construction.
-                # The second should be the donation amount, default=1.
-                if len(donation_args) > 1:
-                    donation_amount = donation_args[1]
-                else:
-                    donation_amount = 1
-                self.out_string += don.fixed_amount_donation_button(
-                    donation_amount, self.paren_string
-                )
-            else:
-                self.out_string += (
-                    self.bracket_class_string
-                    + ":"
-                    + self.bracket_label_string
-                    + "("
-                    + self.paren_string
-                    + ")"
-                )
-        elif "news" == self.bracket_class_string:
-            mailinglist_name = self.bracket_label_string
-            description_text = self.paren_string
-            self.out_string += render_inclusion_tag_to_html(
-                self.context,
-                "newsletter",
-                "show_mailing_list",
-                **{"mailinglist": mailinglist_name, "title": description_text},
-            )
-        elif "panel" == self.bracket_class_string:
-            panel_slug = self.paren_string
-            # Ideally, we'd pass the object through to the panel tag,
-            # but render_inclusion_tag_to_html() is a hideous mess
-            # that depends too much on its first client, the mailing
-            # list tag.  So we'll leave that all to another day.
-            self.out_string += render_inclusion_tag_to_html(
-                self.context, "panels", "panel", panel_slug
-            )
-        elif (
-            "cta" == self.bracket_class_string
-            or "action" == self.bracket_class_string
-        ):
-            # Deprecated "action:".
-            try:
-                url = reverse(
-                    "topic_blog:view_item_by_slug", args=[self.paren_string]
-                )
-            except NoReverseMatch:
-                url = "(((pas trouvé : {ps})))".format(ps=self.paren_string)
-            self.out_string += don.action_button(
-                url, self.bracket_label_string, context=self.context
-            )
-        elif "slug" == self.bracket_class_string:
-            self.out_string += slug.tbi_slug(
-                self.context, self.bracket_label_string, self.paren_string
-            )
-        elif "contact" == self.bracket_class_string:
-            self.out_string += don.contact_button(
-                self.bracket_label_string, self.paren_string
-            )
-        elif "externe" == self.bracket_class_string:
-            url = self.paren_string
-            self.out_string += don.external_url(url, self.bracket_label_string)
-        elif "EXTERNE" == self.bracket_class_string:
-            url = self.paren_string
-            self.out_string += don.external_url_button(
-                url, self.bracket_label_string, context=self.context
-            )
-        elif "petition" == self.bracket_class_string:
-            self.out_string += newsletter.petition_link(
-                self.paren_string, self.bracket_label_string
-            )
-        else:
-            self.out_string += (
-                f"[[{self.bracket_class_string}:{self.bracket_label_string}]]"
-                f"(({self.paren_string}))"
-            )
-            self.log(
-                "Unexpected transcription case: " + self.bracket_class_string
-            )
+        """We've finished accumulating something, transform and output it."""
+        self.out_string += self.transcribe(
+            self.bracket_class_string,
+            self.bracket_label_string,
+            self.paren_string,
+        )
 
     def consume_ordinary(self, in_text):
         """
@@ -0,0 +1,337 @@
+"""Record what recipients do with our emails without making them wait.
+
+Right after a campaign goes out, mail clients fetch the beacon of
+thousands of messages within minutes, and many recipients click
+through.  The beacon and click views answer at once, from memory, and
+leave the database work to a TrackingBuffer: events are collected in
+the web worker and applied in batches by a thread.  Opens cost one
+UPDATE per send record class and batch.  Clicks are bulk-inserted into
+TopicBlogEmailClicks and TopicBlogPressClicks.  The first open (click)
+of a send record wins: the UPDATE only touches rows whose open_time
+(click_time) is NULL.
+
+Links in emails point to the click view with the mail's beacon token
+and the destination URL, which we sign so that the view can't be used
+to redirect anywhere else (cf. tracking_url()).
+
+Buffered events live in the process.  Those still waiting when the
+process exits normally are applied at exit; if the process dies, we
+lose at most TRACKING_FLUSH_SECONDS of them, which for statistics on
+opens and clicks is acceptable.
+
+"""
+
+import atexit
+from collections import defaultdict
+from datetime import datetime, timezone
+import html
+import logging
+import os
+from pathlib import Path
+import re
+import threading
+from urllib.parse import urlencode
+
+from django.apps import apps
+from django.conf import settings
+from django.core import signing
+from django.db import close_old_connections
+from django.db.models import Case, DateTimeField, Value, When
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+
+from asso_tn.utils import token_valid
+
+from .models import SendRecordBase, TopicBlogEmailClicks, TopicBlogPressClicks
+
+logger = logging.getLogger("django")
+
+k_beacon_path = (
+    Path(__file__).parent.parent
+    / "asso_tn"
+    / "static"
+    / "asso_tn"
+    / "beacon.gif"
+)
+k_beacon_gif = k_beacon_path.read_bytes()
+# A given beacon URL always returns the same pixel.  Each URL belongs
+# to one recipient, so shared caches mustn't keep it.
+k_beacon_cache_control = "private, max-age=31536000"
+# Send records per UPDATE.
+k_update_batch_size = 500
+k_click_signature_salt = "topicblog.tracking.click"
+k_click_url_max_length = 1024
+# The links we track: absolute http(s) links in rendered html.
+k_href_re = re.compile(r'href="(https?://[^"]+)"')
+# Send record class name -> (click model, its send record field).
+k_click_models = {
+    "SendRecordMarketingEmail": (TopicBlogEmailClicks, "email"),
+    "SendRecordMarketingPress": (TopicBlogPressClicks, "press"),
+}
+
+
+class TrackingBuffer:
+    """Collect tracking events and apply them in batches.
+
+    apply is called with a list of events.  With TRACKING_IN_BACKGROUND,
+    add() only appends the event to a list, and a daemon thread passes
+    the list to apply every TRACKING_FLUSH_SECONDS, or sooner once
+    TRACKING_FLUSH_SIZE events are waiting.  Otherwise add() applies
+    each event at once.
+
+    The thread is started on the first add() in each process (so after
+    the web server forks its workers).  With autostart False it is not
+    started at all and it's up to the caller to flush().
+
+    """
+
+    def __init__(self, apply, autostart=True):
+        self.apply = apply
+        self.autostart = autostart
+        self.lock = threading.Lock()
+        self.events = []
+        self.wake = threading.Event()
+        self.pid = None
+
+    def add(self, event):
+        if not settings.TRACKING_IN_BACKGROUND:
+            self.apply([event])
+            return
+        with self.lock:
+            self.events.append(event)
+            num_events = len(self.events)
+            if self.autostart and self.pid != os.getpid():
+                self.start()
+        if num_events >= settings.TRACKING_FLUSH_SIZE:
+            self.wake.set()
+
+    def start(self):
+        """Start the thread that flushes the buffer.  Hold the lock."""
+        if self.pid is None:
+            atexit.register(self.flush)
+        self.pid = os.getpid()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            self.wake.wait(settings.TRACKING_FLUSH_SECONDS)
+            self.wake.clear()
+            close_old_connections()
+            self.flush()
+
+    def flush(self) -> int:
+        """Apply the buffered events.  Return how many there were."""
+        with self.lock:
+            events, self.events = self.events, []
+        if not events:
+            return 0
+        try:
+            self.apply(events)
+        except Exception as e:
+            logger.error(
+                f"Lost {len(events)} tracking events "
+                f"({self.apply.__name__}): {e}"
+            )
+        return len(events)
+
+
+def get_send_record_class(send_record_class_string: str):
+    """Return the send record class with this name, or None."""
+    try:
+        send_record_class = apps.get_model(
+            "topicblog", send_record_class_string
+        )
+    except LookupError:
+        logger.info(
+            f"No send record class with name {send_record_class_string}."
+        )
+        return None
+    if not issubclass(send_record_class, SendRecordBase):
+        logger.info(f"{send_record_class_string} is not a send record class.")
+        return None
+    return send_record_class
+
+
+def group_by_send_record_class(events: list) -> dict:
+    """Decode the beacon tokens of events.
+
+    events is a list of tuples that start with (beacon token, time).
+    Return a dict mapping send record class name to a list of
+    (send record id, time, ...) for its events, in order.  Events with
+    invalid tokens are dropped.
+
+    """
+    groups = defaultdict(list)
+    for token, *event in events:
+        send_record_class_string, send_record_id = token_valid(token)
+        if not send_record_id:
+            logger.info(
+                f"The token {token} provided an incorrect "
+                f"ID : {send_record_id} "
+                f"(Class string : {send_record_class_string}"
+            )
+            continue
+        groups[send_record_class_string].append((send_record_id, *event))
+    return groups
+
+
+def first_times(events: list) -> dict:
+    """Map each send record id in events to its earliest time.
+
+    events is a list of (send record id, time, ...).
+
+    """
+    times = {}
+    for send_record_id, event_time, *_ in events:
+        if send_record_id not in times or event_time < times[send_record_id]:
+            times[send_record_id] = event_time
+    return times
+
+
+def set_first_times(send_record_class, field_name: str, times: dict) -> int:
+    """Set field_name on the send records in times where it is NULL.
+
+    times maps send record id to the time to set.  Return the number
+    of send records updated.
+
+    """
+    num_updated = 0
+    send_record_ids = list(times)
+    for start in range(0, len(send_record_ids), k_update_batch_size):
+        end = start + k_update_batch_size
+        batch = send_record_ids[start:end]
+        num_updated += send_record_class.objects.filter(
+            pk__in=batch, **{f"{field_name}__isnull": True}
+        ).update(
+            **{
+                field_name: Case(
+                    *[When(pk=pk, then=Value(times[pk])) for pk in batch],
+                    output_field=DateTimeField(),
+                )
+            }
+        )
+    return num_updated
+
+
+def apply_opens(opens: list) -> int:
+    """Set the open time of send records that don't have one yet.
+
+    opens is a list of (beacon token, open time).  Each send record
+    gets the earliest of its open times in the list, unless it was
+    already opened.  Return the number of send records updated.
+
+    """
+    num_opened = 0
+    groups = group_by_send_record_class(opens)
+    for send_record_class_string, class_opens in groups.items():
+        send_record_class = get_send_record_class(send_record_class_string)
+        if send_record_class is None:
+            continue
+        num_opened += set_first_times(
+            send_record_class, "open_time", first_times(class_opens)
+        )
+        logger.info(
+            f"{len(class_opens)} {send_record_class_string} beacons received."
+        )
+    return num_opened
+
+
+def apply_clicks(clicks: list) -> int:
+    """Store clicks and set the click time of send records without one.
+
+    clicks is a list of (beacon token, click time, url).  Clicks on
+    TopicBlogEmail and TopicBlogPress mails are stored in their click
+    tables, in one INSERT per batch.  Return the number of click rows
+    created.
+
+    """
+    num_created = 0
+    groups = group_by_send_record_class(clicks)
+    for send_record_class_string, class_clicks in groups.items():
+        send_record_class = get_send_record_class(send_record_class_string)
+        if send_record_class is None:
+            continue
+        times = first_times(class_clicks)
+        set_first_times(send_record_class, "click_time", times)
+        if send_record_class_string not in k_click_models:
+            continue
+        click_model, send_record_field = k_click_models[
+            send_record_class_string
+        ]
+        # Tokens outlive send records, but clicks can't.
+        existing_ids = set(
+            send_record_class.objects.filter(pk__in=list(times)).values_list(
+                "pk", flat=True
+            )
+        )
+        rows = [
+            click_model(
+                **{f"{send_record_field}_id": send_record_id},
+                click_time=click_time,
+                click_url=url[:k_click_url_max_length],
+            )
+            for send_record_id, click_time, url in class_clicks
+            if send_record_id in existing_ids
+        ]
+        click_model.objects.bulk_create(rows, batch_size=k_update_batch_size)
+        num_created += len(rows)
+        logger.info(f"{len(rows)} {send_record_class_string} clicks received.")
+    return num_created
+
+
+open_buffer = TrackingBuffer(apply_opens)
+click_buffer = TrackingBuffer(apply_clicks)
+
+
+def record_open(token: str) -> None:
+    """Note that the mail with this beacon token was opened."""
+    open_buffer.add((token, datetime.now(timezone.utc)))
+
+
+def beacon_response() -> HttpResponse:
+    """Make a response that contains the beacon image."""
+    response = HttpResponse(k_beacon_gif, content_type="image/gif")
+    response["Cache-Control"] = k_beacon_cache_control
+    response["Content-Length"] = len(k_beacon_gif)
+    return response
+
+
+def click_signature(token: str, url: str) -> str:
+    """Sign url for the recipient of token.
+
+    The signature covers the token, so that a link can't be replayed
+    with another recipient's token.
+
+    """
+    return signing.Signer(salt=k_click_signature_salt).signature(
+        f"{token}:{url}"
+    )
+
+
+def is_signed_click(token: str, url: str, signature: str) -> bool:
+    """Return whether signature is our signature of token and url."""
+    return constant_time_compare(click_signature(token, url), signature)
+
+
+def tracking_url(request, token: str, url: str) -> str:
+    """Return the absolute URL of the click view for url and token."""
+    query = urlencode({"u": url, "s": click_signature(token, url)})
+    return request.build_absolute_uri(
+        f"{reverse('topicblog:click_view', args=[token])}?{query}"
+    )
+
+
+def track_links(request, token: str, html_text: str) -> str:
+    """Point the absolute http(s) links in html_text to the click view."""
+
+    def replace(match):
+        url = html.unescape(match.group(1))
+        return f'href="{html.escape(tracking_url(request, token, url))}"'
+
+    return k_href_re.sub(replace, html_text)
+
+
+def record_click(token: str, url: str) -> None:
+    """Note that url was clicked in the mail with this beacon token."""
+    click_buffer.add((token, datetime.now(timezone.utc), url))
@@ -300,7 +300,13 @@ mail_sending_urls = [
         views.TopicBlogSelfSendView.as_view(),
         name="self_send",
     ),
+    path(
+        "admin/send/campaign/<int:pk>/",
+        views.SendCampaignView.as_view(),
+        name="send_campaign",
+    ),
     path("e/i/<str:token>", views.beacon_view, name="beacon_view"),
+    path("e/c/<str:token>", views.click_view, name="click_view"),
 ]
 
 urlpatterns = []
@@ -2,21 +2,19 @@ from collections import Counter
 from datetime import datetime, timezone
 import json
 import logging
-from pathlib import Path
 from typing import Tuple, Type, Union, TYPE_CHECKING
 from django.apps import apps
 from django.conf import settings
 from django.core import mail
 from django.core.exceptions import ImproperlyConfigured
-from django.db import IntegrityError
+from django.db import IntegrityError, connections, transaction
 
-from django.db.models import Count, Max, Subquery, OuterRef, F
+from django.db.models import Count, Max
 from django.dispatch import receiver
 from django.http import (
     Http404,
     HttpResponseBadRequest,
     HttpResponseServerError,
-    FileResponse,
 )
 from django.http import HttpResponseRedirect
 from django.http.response import JsonResponse
@@ -31,19 +29,22 @@ from django.contrib.auth.models import User
 from django.views.generic.base import TemplateView
 from django.views.generic.edit import FormView, BaseFormView
 from django.views.generic.list import ListView
-from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
+from django.core.exceptions import PermissionDenied
 from django.urls import reverse, reverse_lazy
 from django.utils.html import strip_tags
-from django_ses.signals import open_received, click_received, send_received
-
-from asso_tn.utils import StaffRequired, make_timed_token, token_valid
-from mailing_list.events import (
-    get_subcribed_users_email_list,
-    user_subscribe_count,
+from django_ses.signals import (
+    bounce_received,
+    click_received,
+    open_received,
+    send_received,
 )
+
+from asso_tn.utils import StaffRequired, make_timed_token
+from mailing_list.events import bounce_user_from_list, user_subscribe_count
 from mailing_list.models import MailingList
 
 from .models import (
+    SendCampaign,
     SendRecordTransactionalEmail,
     SendRecordTransactionalPress,
     TopicBlogItem,
@@ -56,6 +57,20 @@ from .models import (
     SendRecordMarketingPress,
     SendRecordTransactional,
 )
+from .campaigns import (
+    cancel_campaign,
+    enqueue_campaign,
+    is_resumable,
+    resume_campaign,
+)
+from .email_rendering import PersonalizableEmail, make_placeholder
+from .sending import hand_off
+from .tracking import (
+    beacon_response,
+    is_signed_click,
+    record_click,
+    record_open,
+)
 from .forms import (
     TopicBlogItemForm,
     TopicBlogEmailSendForm,
@@ -235,16 +250,7 @@ class TopicBlogBaseView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        try:
-            tb_object = (
-                self.model.objects.filter(
-                    slug=kwargs["the_slug"], publication_date__isnull=False
-                )
-                .order_by("publication_date")
-                .last()
-            )
-        except ObjectDoesNotExist:
-            raise Http404("Page non trouvée")
+        tb_object = self.model.get_published(kwargs["the_slug"])
         if tb_object is None:
             raise Http404("Page non trouvée")
 
@@ -312,13 +318,7 @@ class TopicBlogBaseViewOne(LoginRequiredMixin, TemplateView):
         context["topicblog_admin"] = True
         context["base_model"] = self.model.__name__.lower()
 
-        context["served_object"] = (
-            self.model.objects.filter(
-                slug=slug, publication_date__isnull=False
-            )
-            .order_by("publication_date")
-            .last()
-        )
+        context["served_object"] = self.model.get_published(slug)
 
         if self.transactional_send_record_class:
             context[
@@ -341,7 +341,10 @@ class TopicBlogBaseViewOne(LoginRequiredMixin, TemplateView):
         try:
             tb_object.publisher = self.request.user
             if tb_object.publish():
-                tb_object.save()
+                # Saving also points the slug at this object,
+                # cf. TopicBlogPublished.
+                with transaction.atomic():
+                    tb_object.save()
                 return HttpResponseRedirect(tb_object.get_absolute_url())
         except Exception as e:
             logger.error(e)
@@ -419,6 +422,8 @@ class TopicBlogBaseList(LoginRequiredMixin, ListView):
 # This is the name of the key we put in contexts to communicate
 # to renderers.
 k_render_as_email = "render_as_email"
+# The number of send records we create per INSERT.
+k_send_record_batch_size = 1000
 
 
 class SendableObjectMixin:
@@ -437,10 +442,8 @@ class SendableObjectMixin:
         recent publication_date.
 
         """
-        tb_objects = self.base_model.objects.filter(
-            slug=tb_slug, publication_date__isnull=False
-        ).order_by("-publication_date")
-        if len(tb_objects) == 0:
+        tb_object = self.base_model.get_published(tb_slug)
+        if tb_object is None:
             logger.error(
                 "Failed to find requested email object in class " f"{tb_slug}"
             )
@@ -448,7 +451,7 @@ class SendableObjectMixin:
                 f"There is no {self.base_model.__name__} with"
                 f" slug {tb_slug} and a not-null publication date"
             )
-        return tb_objects[0]
+        return tb_object
 
     def prepare_email(
         self,
@@ -539,7 +542,25 @@ class SendableObjectMixin:
         # In cases where the HTML message isn't accepted, a plain text
         # message is displayed in the mail client.
         plain_text_message = strip_tags(html_message)
+        return self._make_email_message(
+            tb_object,
+            html_message,
+            plain_text_message,
+            recipient_list,
+            send_record,
+            from_email,
+        )
 
+    def _make_email_message(
+        self,
+        tb_object,
+        html_message: str,
+        plain_text_message: str,
+        recipient_list: list,
+        send_record,
+        from_email: str = settings.DEFAULT_FROM_EMAIL,
+    ) -> mail.EmailMultiAlternatives:
+        """Wrap a rendered email in an EmailMultiAlternatives object."""
         # AWS SES reads the headers to check the presence of a configuration
         # set. If one is found, the configuration set allows notifications
         # regarding the email to be sent to the endpoints set in AWS (i.e.
@@ -628,6 +649,92 @@ class SendableObjectMixin:
 
         return context
 
+    def get_personalizable_email(self, tb_object) -> PersonalizableEmail:
+        """Render tb_object's email template once for many recipients.
+
+        The per-recipient values of _set_email_context() are replaced
+        by placeholders.  The result is cached on self, so a sender
+        renders each object once.
+
+        """
+        cache = self.__dict__.setdefault("_personalizable_emails", {})
+        if tb_object.pk in cache:
+            return cache[tb_object.pk]
+        self.template_name = tb_object.template_config[
+            tb_object.template_name
+        ].get("email_template")
+        placeholders = {
+            "token": make_placeholder("token"),
+            "beacon_token": make_placeholder("beacon_token"),
+        }
+        context = {k_render_as_email: True, "email": tb_object}
+        context.update(placeholders)
+        html_message = render_to_string(
+            self.template_name, context=context, request=self.request
+        )
+        personalizable_email = PersonalizableEmail(html_message, placeholders)
+        missing_slots = personalizable_email.missing_slots()
+        if missing_slots:
+            logger.warning(
+                f"{self.template_name} doesn't use {missing_slots}, "
+                "recipients won't get their own values for them."
+            )
+        cache[tb_object.pk] = personalizable_email
+        return personalizable_email
+
+    def prepare_campaign_email(
+        self, tb_object, recipient: list, send_record, verify: bool = False
+    ) -> mail.EmailMultiAlternatives:
+        """Like prepare_email(), but render the template once per object.
+
+        If verify is True, also render the email in full and check that
+        we get the same thing.  If we don't, log an error and render in
+        full from then on.
+
+        """
+        personalizable_email = self.get_personalizable_email(tb_object)
+        if self.__dict__.get("_personalization_failed"):
+            context = self._set_email_context(
+                recipient, send_record.id, tb_object
+            )
+            return self._create_email_object(
+                tb_object, context, recipient, send_record
+            )
+        values = {
+            "token": self.get_unsubscribe_token(recipient[0], send_record.id),
+            "beacon_token": self.get_beacon_token(send_record.id),
+        }
+        # Cf. the comment on issue #777 in _set_email_context().
+        logger.info(
+            f"Token {values['token']} is associated "
+            f"with Email {recipient[0]} and SR.id {send_record.id}"
+        )
+        html_message, plain_text_message = personalizable_email.personalize(
+            values
+        )
+        if verify:
+            context = dict(values)
+            context.update({k_render_as_email: True, "email": tb_object})
+            full_html_message = render_to_string(
+                self.template_name, context=context, request=self.request
+            )
+            if full_html_message != html_message:
+                logger.error(
+                    f"Personalized {tb_object.__class__.__name__} "
+                    f"{tb_object.pk} differs from its full render for "
+                    f"SR.id {send_record.id}, sending the full render."
+                )
+                self._personalization_failed = True
+                html_message = full_html_message
+                plain_text_message = strip_tags(full_html_message)
+        return self._make_email_message(
+            tb_object,
+            html_message,
+            plain_text_message,
+            recipient,
+            send_record,
+        )
+
     def create_send_record(
         self, slug: str, mailing_list: MailingList, recipient: str
     ):
@@ -653,6 +760,96 @@ class SendableObjectMixin:
         logger.info("Created send record " + str(type(send_record)))
         return send_record
 
+    def create_send_records(
+        self, slug: str, mailing_list: MailingList, recipients: list
+    ) -> list:
+        """Create the send records of the recipients who don't have one.
+
+        Resolve the recipients' email addresses to users and leave out
+        those who already have a send record for slug in one query,
+        then create the missing send records with bulk_create.
+
+        Keyword arguments:
+        slug -- the slug of the object to send
+        mailing_list -- the mailing list to send a the object to
+        recipients -- the recipients' emails
+
+        Returns:
+        The ids of the send records created.
+
+        """
+        already_sent = self.send_record_class.objects.filter(slug=slug).values(
+            "recipient_id"
+        )
+        # Some backends (sqlite) limit the number of parameters in a
+        # query.  Keep one for the slug.
+        features = connections[self.send_record_class.objects.db].features
+        if features.max_query_params:
+            lookup_size = features.max_query_params - 1
+        else:
+            lookup_size = max(len(recipients), 1)
+        recipient_ids = set()
+        for start in range(0, len(recipients), lookup_size):
+            end = start + lookup_size
+            recipient_ids.update(
+                User.objects.filter(email__in=recipients[start:end])
+                .exclude(pk__in=already_sent)
+                .values_list("pk", flat=True)
+            )
+
+        send_record_ids = []
+        recipient_ids = sorted(recipient_ids)
+        for start in range(0, len(recipient_ids), k_send_record_batch_size):
+            end = start + k_send_record_batch_size
+            send_records = [
+                self.send_record_class(
+                    slug=slug, mailinglist=mailing_list, recipient_id=user_id
+                )
+                for user_id in recipient_ids[start:end]
+            ]
+            try:
+                with transaction.atomic():
+                    send_records = self.send_record_class.objects.bulk_create(
+                        send_records
+                    )
+            except IntegrityError:
+                # Someone else created some of these meanwhile.  Take
+                # the slow path for this batch.
+                send_records = self._create_send_records_one_by_one(
+                    send_records
+                )
+            if any(send_record.pk is None for send_record in send_records):
+                # The backend doesn't return ids from bulk inserts.
+                send_record_ids.extend(
+                    self.send_record_class.objects.filter(
+                        slug=slug, recipient_id__in=recipient_ids[start:end]
+                    ).values_list("pk", flat=True)
+                )
+            else:
+                send_record_ids.extend(
+                    send_record.pk for send_record in send_records
+                )
+        logger.info(
+            f"Created {len(send_record_ids)} send records "
+            f"{self.send_record_class.__name__} for {slug}"
+        )
+        return send_record_ids
+
+    def _create_send_records_one_by_one(self, send_records: list) -> list:
+        """Save send_records, skipping those that already exist."""
+        created = []
+        for send_record in send_records:
+            try:
+                with transaction.atomic():
+                    send_record.save()
+                created.append(send_record)
+            except IntegrityError:
+                logger.info(
+                    f"User {send_record.recipient_id} already received "
+                    f"an email for {send_record.slug}"
+                )
+        return created
+
     def get_unsubscribe_token(self, email: str, send_record_id: int) -> str:
         """
         Create a token to unsubscribe the user from the mailing list.
@@ -705,6 +902,14 @@ class TopicBlogBaseSendView(FormView, SendableObjectMixin):
             .order_by("date_created")
             .last()
         )
+        context["campaigns"] = (
+            SendCampaign.objects.filter(
+                base_model_name=self.base_model.__name__,
+                slug=self.kwargs["the_slug"],
+            )
+            .select_related("mailing_list")
+            .order_by("-created_time")[:10]
+        )
         return context
 
     def form_valid(self, form):
@@ -727,42 +932,80 @@ class TopicBlogBaseSendView(FormView, SendableObjectMixin):
             mailing_list_token=mailing_list_token
         )
         mailing_list: MailingList
-        recipient_list = get_subcribed_users_email_list(mailing_list)
 
         # We create and send an email for each recipient, each with
-        # custom informations (like the unsubscribe link).
-        for recipient in recipient_list:
-            try:
-                send_record = self.create_send_record(
-                    slug=tbe_slug,
-                    mailing_list=mailing_list,
-                    recipient=recipient,
-                )
-            except IntegrityError:
-                logger.info(
-                    f"{recipient} already received an email for " f"{tbe_slug}"
-                )
-                continue
-            custom_email = self.prepare_email(
-                pkid=tbe_object.id,
-                the_slug=tbe_slug,
-                recipient=[recipient],
-                mailing_list=mailing_list,
-                send_record=send_record,
-            )
+        # custom informations (like the unsubscribe link), in the
+        # background.  Cf. topicblog/campaigns.py.
+        campaign = SendCampaign.objects.create(
+            base_model_name=self.base_model.__name__,
+            send_record_class_name=self.send_record_class.__name__,
+            object_id=tbe_object.id,
+            slug=tbe_slug,
+            mailing_list=mailing_list,
+            user=self.request.user,
+            site_url=self.request.build_absolute_uri("/"),
+            num_recipients=user_subscribe_count(mailing_list),
+        )
+        enqueue_campaign(campaign)
+        self.success_url = campaign.get_absolute_url()
+        return super().form_valid(form)
 
-            logger.info(f"Successfully prepared email to {recipient}")
-            try:
-                custom_email.send(fail_silently=False)
-                send_record.handoff_time = datetime.now(timezone.utc)
-                send_record.save()
-                logger.info(f"Successfully sent email to {recipient}")
-            except Exception as e:
-                logger.error(f"Failed to send email to {recipient} : {e}")
-                send_record.status = "FAILED"
-                send_record.save()
 
-        return super().form_valid(form)
+class SendCampaignView(LoginRequiredMixin, TemplateView):
+    """Show the progress of a SendCampaign and let us cancel or resume it.
+
+    With ?format=json, return the progress only, for polling.
+
+    """
+
+    template_name = "topicblog/send_campaign.html"
+
+    def dispatch(self, request, *args, **kwargs):
+        self.campaign = get_object_or_404(
+            SendCampaign.objects.select_related("mailing_list"),
+            pk=kwargs["pk"],
+        )
+        if request.user.is_authenticated and not request.user.has_perm(
+            self.campaign.send_permission
+        ):
+            raise PermissionDenied
+        return super().dispatch(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get("format") == "json":
+            return JsonResponse(self.get_progress())
+        return super().get(request, *args, **kwargs)
+
+    def post(self, request, *args, **kwargs):
+        action = request.POST.get("action")
+        if action == "cancel":
+            cancel_campaign(self.campaign)
+        elif action == "resume":
+            resume_campaign(self.campaign)
+        else:
+            return HttpResponseBadRequest()
+        return HttpResponseRedirect(self.campaign.get_absolute_url())
+
+    def get_progress(self) -> dict:
+        campaign = self.campaign
+        return {
+            "status": campaign.status,
+            "status_display": campaign.get_status_display(),
+            "num_recipients": campaign.num_recipients,
+            "num_sent": campaign.num_sent,
+            "num_failed": campaign.num_failed,
+            "num_remaining": campaign.num_remaining,
+            "is_active": campaign.is_active,
+            "is_resumable": is_resumable(campaign),
+        }
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["campaign"] = self.campaign
+        context["progress"] = self.get_progress()
+        base_model = apps.get_model("topicblog", self.campaign.base_model_name)
+        context["base_model"] = base_model
+        return context
 
 
 class TopicBlogSelfSendView(
@@ -838,17 +1081,7 @@ class TopicBlogSelfSendView(
             send_record=send_record,
         )
         # Send the email.
-        try:
-            custom_email.send(fail_silently=False)
-            send_record.handoff_time = datetime.now(timezone.utc)
-            send_record.save()
-            logger.info(f"Sent email to {self.request.user.email}")
-        except Exception as e:
-            logger.error(
-                f"Failed to send email to {self.request.user.email} : {e}"
-            )
-            send_record.status = "FAILED"
-            send_record.save()
+        hand_off([(custom_email, send_record)])
 
     def create_send_record(
         self,
@@ -1232,22 +1465,7 @@ class TopicBlogPressIndex(ListView):
     paginate_by = 10
 
     def get_queryset(self) -> list:
-        # Subquery preparation
-        latest_press_release = TopicBlogPress.objects.filter(
-            slug=OuterRef("slug"), publication_date__isnull=False
-        ).order_by("-publication_date")
-
-        queryset = (
-            TopicBlogPress.objects.annotate(
-                latest_press_release=Subquery(
-                    latest_press_release.values("publication_date")[:1]
-                )
-            )
-            .filter(publication_date=F("latest_press_release"))
-            .order_by("-publication_date")
-        )
-
-        return queryset
+        return TopicBlogPress.published_objects().order_by("-publication_date")
 
 
 ######################################################################
@@ -1468,70 +1686,33 @@ class TopicBlogPanelList(PermissionRequiredMixin, TopicBlogBaseList):
     permission_required = "topicblog.tbpanel.may_view"
 
 
-def beacon_view(response, **kwargs):
-    """Process received mail beacon."""
+def beacon_view(request, **kwargs):
+    """Process received mail beacon.
 
-    def update_send_record_open_time(token: str) -> None:
-        """Update the token's associated send record's open time.
+    Answer with the pixel at once, the open is recorded in the
+    background, cf. topicblog/tracking.py.
 
-        Keyword argument :
-        token -- The beacon token embedded in the email the user received.
+    """
+    # We remove the ".gif" from the end of the token
+    token = kwargs["token"][:-4]
+    record_open(token)
+    return beacon_response()
 
-        Returns:
-        None
-        """
-        send_record_class_string, send_record_id = token_valid(token)
-        if not send_record_id:
-            logger.info(
-                f"The token {token} provided an incorrect "
-                f"ID : {send_record_id} "
-                f"(Class string : {send_record_class_string}"
-            )
-            return None
 
-        try:
-            send_record_class = apps.get_model(
-                "topicblog", send_record_class_string
-            )
-            # In case the token is valid, we update the open_time
-            send_record = send_record_class.objects.get(pk=send_record_id)
-            if not send_record.open_time:
-                send_record.open_time = datetime.now(timezone.utc)
-                send_record.save()
-                logger.info(
-                    f"{send_record.recipient.email} opened email"
-                    f" ({send_record_class_string} SR.id :{send_record.pk})"
-                )
-        except ObjectDoesNotExist:
-            logger.info(
-                f"No send record with id {send_record_id} in class"
-                f" {send_record_class_string}."
-            )
-            return None
-        except LookupError:
-            logger.info(
-                f"No send record class with name {send_record_class_string}."
-            )
-            return None
+def click_view(request, token):
+    """Redirect a click on a link in an email to its destination.
 
-    def make_beacon_response() -> FileResponse:
-        """Make a response that contains the beacon image."""
-        path_to_beacon = (
-            Path(__file__).parent.parent
-            / "asso_tn"
-            / "static"
-            / "asso_tn"
-            / "beacon.gif"
-        )
-        image = open(path_to_beacon, "rb")
-        response = FileResponse(image, content_type="image/gif")
-        return response
+    The link carries the destination and our signature of it and of
+    the token (cf. tracking_url()).  The click is recorded in the
+    background.
 
-    # We remove the ".gif" from the end of the token
-    token = kwargs["token"][:-4]
-    update_send_record_open_time(token)
-    response = make_beacon_response()
-    return response
+    """
+    url = request.GET.get("u", "")
+    if not url or not is_signed_click(token, url, request.GET.get("s", "")):
+        logger.info(f"Refused to redirect click to unsigned URL {url}.")
+        return HttpResponseBadRequest("Lien invalide.")
+    record_click(token, url)
+    return HttpResponseRedirect(url)
 
 
 def _extract_data_from_ses_signal(mail_obj: dict) -> Tuple[str, str, str]:
@@ -1601,6 +1782,47 @@ def send_received_handler(sender, mail_obj, send_obj, *args, **kwargs):
             logger.error(f"Error while updating send_record : {e}")
 
 
+@receiver(bounce_received)
+def bounce_received_handler(sender, mail_obj, bounce_obj, *args, **kwargs):
+    """Handle AWS SES bounce_received notifications.
+
+    AWS Receiver
+    This function will run when a bounce_received is received from
+    Amazon SES.
+    The signal is sent from django_ses' view.
+
+    A permanent bounce fails the send record, a transient one leaves it
+    to be retried.  The bounce of a mail sent to a mailing list is
+    recorded on the list, cf. bounce_user_from_list().
+    """
+    (
+        aws_message_id,
+        send_record_class,
+        send_record_id,
+    ) = _extract_data_from_ses_signal(mail_obj)
+    bounce_type = bounce_obj.get("bounceType")
+    logger.info(f"Received {bounce_type} bounce_received for {aws_message_id}")
+    logger.info(f"  {send_record_class} ID : {send_record_id}")
+    if send_record_class and send_record_id:
+        try:
+            send_record = send_record_class.objects.select_related(
+                "recipient"
+            ).get(pk=send_record_id)
+            if bounce_type == "Permanent":
+                send_record.status = send_record.StatusChoices.FAILED
+            else:
+                send_record.status = send_record.StatusChoices.RETRYING
+            send_record.aws_message_id = aws_message_id
+            send_record.save()
+            mailing_list_id = getattr(send_record, "mailinglist_id", None)
+            if mailing_list_id is not None:
+                bounce_user_from_list(
+                    send_record.recipient, send_record.mailinglist
+                )
+        except Exception as e:
+            logger.error(f"Error while recording bounce : {e}")
+
+
 @receiver(open_received)
 def open_received_handler(sender, mail_obj, open_obj, *args, **kwargs):
     """Handle AWS SES open_received notifications
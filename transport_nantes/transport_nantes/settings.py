@@ -86,6 +86,8 @@ INSTALLED_APPS = [
 ] + settings_local.MORE_INSTALLED_APPS
 
 MIDDLEWARE = [
+    # First, so that its timings include the other middleware.
+    "asso_tn.middleware.instrumentation.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -328,6 +330,106 @@ CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
 CELERY_BROKER_URL = "amqp://localhost"
 
+# Expired sessions are deleted periodically rather than on every
+# request.  Run "celery -A transport_nantes beat" or call the
+# clear_expired_sessions management command from cron.
+SESSION_SWEEP_INTERVAL_SECONDS = getattr(
+    settings_local, "SESSION_SWEEP_INTERVAL_SECONDS", 3600
+)
+SESSION_SWEEP_BATCH_SIZE = getattr(
+    settings_local, "SESSION_SWEEP_BATCH_SIZE", 1000
+)
+# None means sweep until there are no more expired sessions.
+SESSION_SWEEP_MAX_BATCHES = getattr(
+    settings_local, "SESSION_SWEEP_MAX_BATCHES", None
+)
+# Mailing list subscriber and signature counts are kept up to date as
+# users subscribe and unsubscribe, cached for
+# MAILING_LIST_COUNTS_CACHE_SECONDS, and recounted every
+# MAILING_LIST_COUNTS_RECONCILE_SECONDS to correct any drift.  Cf.
+# MailingListCounts in mailing_list/models.py.
+MAILING_LIST_COUNTS_CACHE_SECONDS = getattr(
+    settings_local, "MAILING_LIST_COUNTS_CACHE_SECONDS", 300
+)
+MAILING_LIST_COUNTS_RECONCILE_SECONDS = getattr(
+    settings_local, "MAILING_LIST_COUNTS_RECONCILE_SECONDS", 6 * 3600
+)
+CELERY_BEAT_SCHEDULE = {
+    "clear-expired-sessions": {
+        "task": "asso_tn.tasks.clear_expired_sessions",
+        "schedule": SESSION_SWEEP_INTERVAL_SECONDS,
+    },
+    "reconcile-mailing-list-counts": {
+        "task": "mailing_list.tasks.reconcile_mailing_list_counts",
+        "schedule": MAILING_LIST_COUNTS_RECONCILE_SECONDS,
+    },
+}
+
+# TopicBlog emails and press releases are sent to mailing lists by a
+# celery task, CAMPAIGN_SEND_CHUNK_SIZE send records at a time.  A task
+# that has run for CAMPAIGN_SEND_TIME_BUDGET_SECONDS (keep it under
+# CELERY_TASK_TIME_LIMIT) queues itself again to continue.  If
+# CAMPAIGN_SEND_IN_BACKGROUND is False, campaigns are sent in process.
+# If the broker is unreachable, the campaign stays queued with the
+# error recorded, and may be resumed.  Cf. topicblog/campaigns.py.
+CAMPAIGN_SEND_IN_BACKGROUND = getattr(
+    settings_local, "CAMPAIGN_SEND_IN_BACKGROUND", ROLE != "dev"
+)
+CAMPAIGN_SEND_CHUNK_SIZE = getattr(
+    settings_local, "CAMPAIGN_SEND_CHUNK_SIZE", 100
+)
+CAMPAIGN_SEND_TIME_BUDGET_SECONDS = getattr(
+    settings_local, "CAMPAIGN_SEND_TIME_BUDGET_SECONDS", 20 * 60
+)
+# With CAMPAIGN_RENDER_ONCE, a campaign renders its email once and
+# substitutes each recipient's tokens into the result.  The first
+# CAMPAIGN_RENDER_VERIFY_SAMPLE emails of each run are also rendered in
+# full and compared; on a mismatch, we log an error and render in full.
+# Cf. topicblog/email_rendering.py.
+CAMPAIGN_RENDER_ONCE = getattr(settings_local, "CAMPAIGN_RENDER_ONCE", True)
+CAMPAIGN_RENDER_VERIFY_SAMPLE = getattr(
+    settings_local, "CAMPAIGN_RENDER_VERIFY_SAMPLE", 3
+)
+# Emails are handed off to the backend over one connection per
+# EMAIL_SEND_BATCH_SIZE messages, at most EMAIL_SEND_RATE_PER_SECOND
+# messages per second per process (our SES sending quota; None means
+# no limit).  Cf. topicblog/sending.py.
+EMAIL_SEND_BATCH_SIZE = getattr(settings_local, "EMAIL_SEND_BATCH_SIZE", 50)
+EMAIL_SEND_RATE_PER_SECOND = getattr(
+    settings_local, "EMAIL_SEND_RATE_PER_SECOND", 14
+)
+# Mail opens are answered at once and written to the database in
+# batches by a thread in each web process, every TRACKING_FLUSH_SECONDS
+# or sooner once TRACKING_FLUSH_SIZE are waiting.  If
+# TRACKING_IN_BACKGROUND is False, each one is written before we
+# answer.  Cf. topicblog/tracking.py.
+TRACKING_IN_BACKGROUND = getattr(
+    settings_local, "TRACKING_IN_BACKGROUND", ROLE != "dev"
+)
+TRACKING_FLUSH_SECONDS = getattr(settings_local, "TRACKING_FLUSH_SECONDS", 5)
+TRACKING_FLUSH_SIZE = getattr(settings_local, "TRACKING_FLUSH_SIZE", 500)
+# The charts of ended Mobilito sessions are rendered once, stored in
+# media and served with this max-age and an ETag.  When the session
+# ends they are rendered, then the results email that shows them is
+# sent, by celery if MOBILITO_CHARTS_IN_BACKGROUND, else in the
+# request.  A request for a chart that isn't ready has celery render it
+# and waits MOBILITO_CHART_WAIT_SECONDS at most, then renders it
+# itself.  Cf. mobilito/charts.py.
+MOBILITO_CHART_MAX_AGE_SECONDS = getattr(
+    settings_local, "MOBILITO_CHART_MAX_AGE_SECONDS", 24 * 3600
+)
+MOBILITO_CHARTS_IN_BACKGROUND = getattr(
+    settings_local, "MOBILITO_CHARTS_IN_BACKGROUND", ROLE != "dev"
+)
+MOBILITO_CHART_WAIT_SECONDS = getattr(
+    settings_local, "MOBILITO_CHART_WAIT_SECONDS", 5
+)
+# Timeseries charts of sessions with more events than this show the
+# number of events per minute rather than each event.
+MOBILITO_TIMESERIES_DENSITY_THRESHOLD = getattr(
+    settings_local, "MOBILITO_TIMESERIES_DENSITY_THRESHOLD", 5000
+)
+
 if ROLE in ("beta", "production"):
     ROLLBAR = {
         "access_token": settings_local.ROLLBAR_ACCESS_TOKEN,
@@ -340,6 +442,58 @@ if ROLE in ("beta", "production"):
 
 MAPS_API_KEY = settings_local.MAPS_API_KEY
 
+# InstrumentationMiddleware records query count, database time,
+# template render time and wall time per URL name.  Staff can see the
+# aggregates at dashboard:request_stats; they are also logged every
+# REQUEST_STATS_LOG_INTERVAL_SECONDS.  A view that makes more queries
+# than its budget (REQUEST_STATS_QUERY_BUDGETS, keyed by URL name, or
+# else REQUEST_STATS_DEFAULT_QUERY_BUDGET if not None) logs a warning.
+REQUEST_STATS_ENABLED = getattr(settings_local, "REQUEST_STATS_ENABLED", True)
+REQUEST_STATS_LOG_INTERVAL_SECONDS = getattr(
+    settings_local, "REQUEST_STATS_LOG_INTERVAL_SECONDS", 15 * 60
+)
+REQUEST_STATS_DEFAULT_QUERY_BUDGET = getattr(
+    settings_local, "REQUEST_STATS_DEFAULT_QUERY_BUDGET", None
+)
+REQUEST_STATS_QUERY_BUDGETS = getattr(
+    settings_local,
+    "REQUEST_STATS_QUERY_BUDGETS",
+    {
+        "index": 30,
+        "topicblog:view_item_by_slug": 30,
+        "topicblog:view_email_by_slug": 30,
+        "topicblog:view_press_by_slug": 30,
+        "mailing_list:list_items": 30,
+        "geoplan:map": 30,
+    },
+)
+
+# SessionCookieMiddleWare gives each visitor a tn_session identifier.
+# By default it lives in the django session, which costs a session row
+# per new visitor.  With TN_SESSION_SIGNED_COOKIE, it is carried in its
+# own signed cookie instead and anonymous visitors cause no session
+# writes.
+TN_SESSION_SIGNED_COOKIE = getattr(
+    settings_local, "TN_SESSION_SIGNED_COOKIE", False
+)
+
+# UtmMiddleware records a UTM row for every non-admin request.  With
+# UTM_BUFFER_ENABLED, rows are queued in memory and written with
+# bulk_create every UTM_BUFFER_BATCH_SIZE rows or every
+# UTM_BUFFER_FLUSH_SECONDS seconds.  If the queue reaches
+# UTM_BUFFER_MAX_SIZE, the overflow policy is either "drop" (discard
+# new rows) or "block" (write synchronously in the request).
+# Cf. utm/buffer.py.
+UTM_BUFFER_ENABLED = getattr(settings_local, "UTM_BUFFER_ENABLED", False)
+UTM_BUFFER_BATCH_SIZE = getattr(settings_local, "UTM_BUFFER_BATCH_SIZE", 200)
+UTM_BUFFER_FLUSH_SECONDS = getattr(
+    settings_local, "UTM_BUFFER_FLUSH_SECONDS", 10
+)
+UTM_BUFFER_MAX_SIZE = getattr(settings_local, "UTM_BUFFER_MAX_SIZE", 5000)
+UTM_BUFFER_OVERFLOW_POLICY = getattr(
+    settings_local, "UTM_BUFFER_OVERFLOW_POLICY", "drop"
+)
+
 
 # Mobilito uses Mapbox to produce static images of a map.
 # The Mapbox API is free for up to 50,000 map views per month.
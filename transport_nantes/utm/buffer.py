@@ -0,0 +1,147 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.db import close_old_connections
+
+from utm.models import UTM
+
+logger = logging.getLogger("django")
+
+
+class UtmBuffer:
+    """Accumulate UTM records in memory and write them in batches.
+
+    Every non-admin request produces a UTM record.  Inserting each one
+    synchronously means every page view pays a database round-trip
+    before the view even runs.  Instead, the middleware may append
+    unsaved UTM objects here and we write them with bulk_create once
+    we have batch_size of them or once flush_seconds have passed since
+    the last write, whichever comes first.  The time threshold is
+    watched by a daemon thread, started on the first append() in each
+    process (so after gunicorn forks its workers), so that records
+    don't wait for the next request on a quiet worker.  With autostart
+    False there is no thread and the time threshold is only checked on
+    append().  Anything still buffered when the worker exits is flushed
+    by an atexit handler.
+
+    The buffer is bounded by max_size.  If we can't keep up (typically
+    because the database is refusing writes), the overflow policy
+    decides what happens to new records:
+
+    * "drop": discard the new record.  We lose a bit of analytics, but
+      the request doesn't wait.
+    * "block": flush synchronously in the calling request before
+      accepting the record.  This applies backpressure to the request
+      path rather than losing data.
+
+    Note that the buffer is per process: with several gunicorn
+    workers, each has its own.
+
+    """
+
+    k_overflow_drop = "drop"
+    k_overflow_block = "block"
+
+    def __init__(
+        self,
+        batch_size=200,
+        flush_seconds=10,
+        max_size=5000,
+        overflow_policy="drop",
+        autostart=True,
+    ):
+        if overflow_policy not in (
+            self.k_overflow_drop,
+            self.k_overflow_block,
+        ):
+            raise ValueError(f"Unknown UTM overflow policy {overflow_policy}")
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_size = max(max_size, batch_size)
+        self.overflow_policy = overflow_policy
+        self.records = []
+        self.dropped_count = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.autostart = autostart
+        self.pid = None
+        atexit.register(self.flush)
+
+    def __len__(self):
+        return len(self.records)
+
+    def append(self, utm: UTM) -> None:
+        """Queue a UTM record, flushing if a threshold is reached."""
+        if len(self.records) >= self.max_size:
+            if self.overflow_policy == self.k_overflow_drop:
+                self.dropped_count += 1
+                if self.dropped_count % self.batch_size == 1:
+                    logger.warning(
+                        f"UTM buffer full, dropped {self.dropped_count} "
+                        "records so far."
+                    )
+                return
+            self.flush()
+        with self.lock:
+            self.records.append(utm)
+            if self.autostart and self.pid != os.getpid():
+                self.start()
+        if self.should_flush():
+            self.flush()
+
+    def start(self):
+        """Start the thread that flushes on time.  Hold the lock."""
+        self.pid = os.getpid()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if self.records:
+                    delay = self.last_flush + self.flush_seconds
+                    delay -= time.monotonic()
+                else:
+                    delay = self.flush_seconds
+            time.sleep(max(delay, 0.1))
+            if self.should_flush():
+                close_old_connections()
+                self.flush()
+
+    def should_flush(self) -> bool:
+        """Return True if either the size or the time threshold is met."""
+        with self.lock:
+            num_records = len(self.records)
+            last_flush = self.last_flush
+        if num_records >= self.batch_size:
+            return True
+        return (
+            num_records > 0
+            and time.monotonic() - last_flush >= self.flush_seconds
+        )
+
+    def flush(self) -> int:
+        """Write all buffered records and return how many we wrote.
+
+        If the write fails, we put the records back (up to max_size) so
+        that the next flush can try again.
+
+        """
+        with self.lock:
+            batch = self.records
+            self.records = []
+            self.last_flush = time.monotonic()
+        if not batch:
+            return 0
+        try:
+            UTM.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} UTM records: {e}")
+            with self.lock:
+                room = self.max_size - len(self.records)
+                self.records = batch[:room] + self.records
+                self.dropped_count += max(0, len(batch) - room)
+            return 0
+        return len(batch)
@@ -1,5 +1,8 @@
-import user_agents
+from asso_tn.middleware.sessionCookie import get_tn_session
+from asso_tn.user_agent import request_user_agent
+from django.conf import settings
 
+from utm.buffer import UtmBuffer
 from utm.models import UTM
 
 tracked_params = [
@@ -21,6 +24,17 @@ class UtmMiddleware:
     def __init__(self, get_response):
         """One-time configuration and initialization."""
         self.get_response = get_response
+        # If buffering is enabled, UTM records are written in batches
+        # rather than one INSERT per request.  Cf. utm/buffer.py.
+        if getattr(settings, "UTM_BUFFER_ENABLED", False):
+            self.buffer = UtmBuffer(
+                batch_size=settings.UTM_BUFFER_BATCH_SIZE,
+                flush_seconds=settings.UTM_BUFFER_FLUSH_SECONDS,
+                max_size=settings.UTM_BUFFER_MAX_SIZE,
+                overflow_policy=settings.UTM_BUFFER_OVERFLOW_POLICY,
+            )
+        else:
+            self.buffer = None
 
     def __call__(self, request):
         """Called on each request."""
@@ -31,17 +45,15 @@ class UtmMiddleware:
         ) and not request.path.startswith("/favicon.ico"):
             utm = UTM()
             utm.base_url = request.path.split("&")[0]
-            utm.session_id = request.session.get("tn_session", "-")
+            utm.session_id = get_tn_session(request, "-")
 
             # If for some reason we receive no user agent data, the
             # device, os, and browser will be set to "Other" and the
             # booleans will all be false.
-            user_agent = user_agents.parse(
-                request.META.get("HTTP_USER_AGENT", "")
-            )
-            utm.ua_device = user_agent.get_device()
-            utm.ua_os = user_agent.get_os()
-            utm.ua_browser = user_agent.get_browser()
+            user_agent = request_user_agent(request)
+            utm.ua_device = user_agent.ua_device
+            utm.ua_os = user_agent.ua_os
+            utm.ua_browser = user_agent.ua_browser
             utm.ua_is_table = user_agent.is_tablet
             utm.ua_is_mobile = user_agent.is_mobile
             utm.ua_is_touch_capable = user_agent.is_touch_capable
@@ -67,7 +79,10 @@ class UtmMiddleware:
 
             utm.user_is_authenticated = request.user.is_authenticated
 
-            utm.save()
+            if self.buffer is not None:
+                self.buffer.append(utm)
+            else:
+                utm.save()
 
         response = self.get_response(request)
 
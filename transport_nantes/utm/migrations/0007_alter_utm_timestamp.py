@@ -0,0 +1,18 @@
+# Generated by Django 4.1.10 on 2026-10-18 16:18
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("utm", "0006_utm_user_is_authenticated"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="utm",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class UTM(models.Model):
@@ -61,4 +62,7 @@ class UTM(models.Model):
 
     user_is_authenticated = models.BooleanField(blank=True, default=False)
 
-    timestamp = models.DateTimeField(auto_now=True)
+    # Records may be written some time after the visit (cf. buffer.py),
+    # so we take the timestamp when the object is created rather than
+    # when it is saved.
+    timestamp = models.DateTimeField(default=timezone.now)
@@ -1,4 +1,9 @@
-from django.test import TestCase
+import os
+import time
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from .buffer import UtmBuffer
 from .models import UTM
 from django.utils.crypto import get_random_string
 
@@ -97,3 +102,109 @@ class SimpleTest(TestCase):
             object.base_url,
             "/tb/p/suite-president-republique-rer-dans-dix-villes/",
         )
+
+
+class StopLoop(Exception):
+    pass
+
+
+class UtmBufferTest(TestCase):
+    def make_buffer(self, **kwargs):
+        buffer = UtmBuffer(autostart=False, **kwargs)
+        # Don't leave anything for the atexit flush once the test
+        # database is gone.
+        self.addCleanup(lambda: buffer.records.clear())
+        return buffer
+
+    def make_utm(self):
+        return UTM(base_url="/", session_id=get_random_string(20))
+
+    def test_flush_on_batch_size(self):
+        buffer = self.make_buffer(
+            batch_size=3, flush_seconds=3600, max_size=10
+        )
+        buffer.append(self.make_utm())
+        buffer.append(self.make_utm())
+        self.assertEqual(UTM.objects.count(), 0)
+        self.assertEqual(len(buffer), 2)
+        buffer.append(self.make_utm())
+        self.assertEqual(UTM.objects.count(), 3)
+        self.assertEqual(len(buffer), 0)
+
+    def test_flush_on_time(self):
+        buffer = self.make_buffer(
+            batch_size=100, flush_seconds=0, max_size=200
+        )
+        buffer.append(self.make_utm())
+        self.assertEqual(UTM.objects.count(), 1)
+
+    def test_explicit_flush(self):
+        buffer = self.make_buffer(
+            batch_size=100, flush_seconds=3600, max_size=200
+        )
+        buffer.append(self.make_utm())
+        buffer.append(self.make_utm())
+        self.assertEqual(UTM.objects.count(), 0)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(UTM.objects.count(), 2)
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_overflow_drop(self):
+        buffer = self.make_buffer(batch_size=2, flush_seconds=3600, max_size=2)
+        # Pretend the buffer is full and can't be written.
+        buffer.records.extend([self.make_utm(), self.make_utm()])
+        buffer.append(self.make_utm())
+        self.assertEqual(buffer.dropped_count, 1)
+        self.assertEqual(len(buffer), 2)
+        self.assertEqual(UTM.objects.count(), 0)
+
+    def test_overflow_block(self):
+        buffer = self.make_buffer(
+            batch_size=2,
+            flush_seconds=3600,
+            max_size=2,
+            overflow_policy="block",
+        )
+        buffer.records.extend([self.make_utm(), self.make_utm()])
+        buffer.append(self.make_utm())
+        self.assertEqual(buffer.dropped_count, 0)
+        self.assertEqual(UTM.objects.count(), 2)
+        self.assertEqual(len(buffer), 1)
+
+    def test_timer_flushes_quiet_buffer(self):
+        buffer = self.make_buffer(
+            batch_size=100, flush_seconds=3600, max_size=200
+        )
+        buffer.append(self.make_utm())
+        self.assertFalse(buffer.should_flush())
+        # Nothing else arrives, but the time has come.
+        buffer.last_flush -= 3600
+        with mock.patch.object(time, "sleep", side_effect=[None, StopLoop]):
+            with self.assertRaises(StopLoop):
+                buffer.run()
+        self.assertEqual(UTM.objects.count(), 1)
+        self.assertEqual(len(buffer), 0)
+
+    def test_timer_starts_once_per_process(self):
+        buffer = self.make_buffer(flush_seconds=3600)
+        buffer.autostart = True
+        with mock.patch.object(buffer, "start") as start:
+            start.side_effect = lambda: setattr(buffer, "pid", os.getpid())
+            buffer.append(self.make_utm())
+            buffer.append(self.make_utm())
+        start.assert_called_once()
+
+    def test_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            UtmBuffer(overflow_policy="maybe")
+
+    @override_settings(
+        UTM_BUFFER_ENABLED=True,
+        UTM_BUFFER_BATCH_SIZE=2,
+        UTM_BUFFER_FLUSH_SECONDS=3600,
+    )
+    def test_middleware_buffers(self):
+        self.client.get("/?utm_source=buffered")
+        self.assertEqual(UTM.objects.count(), 0)
+        self.client.get("/?utm_source=buffered")
+        self.assertEqual(UTM.objects.filter(source="buffered").count(), 2)